@@ -0,0 +1,169 @@
+"""Times the vectorized difficulty calculator in utils/difficulty.py over a fixture set of synthetic maps
+
+Each map is also run through a per-object reference loop (how oppai computes strain) to check
+the vectorized passes agree with it and to show what they save.
+Run from the repository root with ``python -m benchmarks.difficulty_bench``.
+"""
+from __future__ import annotations
+import math
+import random
+import timeit
+from typing import List, Tuple
+from utils import difficulty
+from utils.difficulty import BeatmapFile, calculate_difficulty, parse_beatmap, parse_mods
+
+
+def build_map(objects: int, bpm: float, seed: int) -> bytes:
+    """A deterministic map mixing jumps, streams, sliders and the odd spinner"""
+    rng = random.Random(seed)
+    beat = 60000 / bpm
+    lines = [
+        "osu file format v14",
+        "",
+        "[General]",
+        "Mode: 0",
+        "",
+        "[Metadata]",
+        f"Title:Synthetic {objects}",
+        "Artist:benchmarks",
+        "Creator:aswo",
+        f"Version:seed {seed}",
+        "",
+        "[Difficulty]",
+        "HPDrainRate:5",
+        "CircleSize:4",
+        "OverallDifficulty:9",
+        "ApproachRate:9.3",
+        "SliderMultiplier:1.8",
+        "SliderTickRate:1",
+        "",
+        "[TimingPoints]",
+        f"0,{beat},4,2,0,60,1,0",
+        f"{beat * objects / 4},-75,4,2,0,60,0,0",
+        "",
+        "[HitObjects]",
+    ]
+    time = 1000.0
+    x, y = 256.0, 192.0
+    for index in range(objects):
+        pattern = (index // 32) % 4
+        if pattern == 0:
+            # Stream, quarter beats at small spacing
+            x = min(max(x + rng.uniform(-40, 40), 0), 512)
+            y = min(max(y + rng.uniform(-40, 40), 0), 384)
+            lines.append(f"{x:.0f},{y:.0f},{time:.0f},1,0,0:0:0:0:")
+            time += beat / 4
+        elif pattern == 1:
+            # Jumps on half beats
+            x, y = rng.uniform(0, 512), rng.uniform(0, 384)
+            lines.append(f"{x:.0f},{y:.0f},{time:.0f},1,0,0:0:0:0:")
+            time += beat / 2
+        elif pattern == 2 or index % 97:
+            length = rng.choice((70, 140, 210))
+            lines.append(f"{x:.0f},{y:.0f},{time:.0f},2,0,B|{x + 50:.0f}:{y:.0f},{rng.choice((1, 2))},{length}")
+            time += beat
+        else:
+            lines.append(f"256,192,{time:.0f},8,0,{time + beat * 4:.0f},0:0:0:0:")
+            time += beat * 5
+
+    return "\n".join(lines).encode()
+
+
+def shuffle_objects(data: bytes, seed: int) -> bytes:
+    """The same map with its [HitObjects] lines written out of order"""
+    head, _, objects = data.partition(b"[HitObjects]\n")
+    lines = objects.split(b"\n")
+    random.Random(seed).shuffle(lines)
+    return head + b"[HitObjects]\n" + b"\n".join(lines)
+
+
+FIXTURES: List[Tuple[str, bytes]] = [
+    ("short (300 objects)", build_map(300, 180, 1)),
+    ("typical (1,200 objects)", build_map(1_200, 200, 2)),
+    ("marathon (8,000 objects)", build_map(8_000, 190, 3)),
+]
+
+
+def reference_speed_weight(distance: float) -> float:
+    if distance > difficulty.SINGLE_SPACING:
+        return 2.5
+    if distance > difficulty.STREAM_SPACING:
+        return 1.6 + 0.9 * (distance - difficulty.STREAM_SPACING) / (difficulty.SINGLE_SPACING - difficulty.STREAM_SPACING)
+    if distance > difficulty.ALMOST_DIAMETER:
+        return 1.2 + 0.4 * (distance - difficulty.ALMOST_DIAMETER) / (difficulty.STREAM_SPACING - difficulty.ALMOST_DIAMETER)
+    if distance > difficulty.ALMOST_DIAMETER / 2:
+        return 0.95 + 0.25 * (distance - difficulty.ALMOST_DIAMETER / 2) / (difficulty.ALMOST_DIAMETER / 2)
+    return 0.95
+
+
+def reference_skill(beatmap: BeatmapFile, mods: int, kind: int) -> float:
+    """The per-object loop the vectorized passes replace"""
+    speed, cs, _, _, _ = difficulty._adjusted_stats(beatmap, mods)
+    radius = (difficulty.PLAYFIELD_WIDTH / 16) * (1 - 0.7 * (cs - 5) / 5)
+    scale = 52.0 / radius
+    if radius < difficulty.CIRCLESIZE_BUFF_THRESHOLD:
+        scale *= 1 + min(difficulty.CIRCLESIZE_BUFF_THRESHOLD - radius, 5) / 50
+
+    base = difficulty.DECAY_BASE[kind]
+    times = (beatmap.times / speed).tolist()
+    positions = (beatmap.positions * scale).tolist()
+    kinds = beatmap.kinds.tolist()
+    strains = [1.0]
+    for index in range(1, len(times)):
+        elapsed = times[index] - times[index - 1]
+        value = 0.0
+        if kinds[index] != difficulty.SPINNER:
+            distance = math.dist(positions[index], positions[index - 1])
+            if kind == difficulty.AIM:
+                weight = distance ** 0.99
+            else:
+                weight = reference_speed_weight(distance)
+            value = weight * difficulty.WEIGHT_SCALING[kind] / max(elapsed, 50)
+        strains.append(strains[-1] * base ** (elapsed / 1000) + value)
+
+    peaks = []
+    interval_end = math.ceil(times[0] / difficulty.STRAIN_STEP) * difficulty.STRAIN_STEP
+    highest = 0.0
+    for index, time in enumerate(times):
+        while time > interval_end:
+            peaks.append(highest)
+            highest = strains[index - 1] * base ** ((interval_end - times[index - 1]) / 1000)
+            interval_end += difficulty.STRAIN_STEP
+        highest = max(highest, strains[index])
+    peaks.append(highest)
+
+    peaks.sort(reverse=True)
+    return sum(peak * difficulty.DECAY_WEIGHT ** index for index, peak in enumerate(peaks))
+
+
+def reference_stars(beatmap: BeatmapFile, mods: int) -> float:
+    aim = math.sqrt(reference_skill(beatmap, mods, difficulty.AIM)) * difficulty.STAR_SCALING_FACTOR
+    speed = math.sqrt(reference_skill(beatmap, mods, difficulty.SPEED)) * difficulty.STAR_SCALING_FACTOR
+    return aim + speed + abs(speed - aim) * difficulty.EXTREME_SCALING_FACTOR
+
+
+def bench(number: int = 20):
+    for mods in ("", "HDDT", "HR"):
+        bits = parse_mods(mods)
+        print(f"+{mods or 'NM'}")
+        for name, data in FIXTURES:
+            beatmap = parse_beatmap(data)
+            result = calculate_difficulty(beatmap, bits)
+            expected = reference_stars(beatmap, bits)
+            assert math.isclose(result.stars, expected, rel_tol=1e-9), (result.stars, expected)
+            # .osu files don't have to list hit objects in order, parsing has to sort them
+            shuffled = parse_beatmap(shuffle_objects(data, len(data)))
+            assert shuffled.max_combo == beatmap.max_combo, (shuffled.max_combo, beatmap.max_combo)
+            assert math.isclose(calculate_difficulty(shuffled, bits).stars, result.stars, rel_tol=1e-9), name
+
+            vectorized = min(timeit.repeat(lambda: calculate_difficulty(beatmap, bits), number=number, repeat=3)) / number
+            loop = min(timeit.repeat(lambda: reference_stars(beatmap, bits), number=max(number // 10, 1), repeat=3)) / max(number // 10, 1)
+            print(f"  {name:<26} {result.stars:5.2f}* {beatmap.max_combo:>6,}x  vectorized {vectorized * 1000:7.2f} ms  loop {loop * 1000:8.2f} ms  ({loop / vectorized:5.1f}x)")
+
+    for name, data in FIXTURES:
+        parse = min(timeit.repeat(lambda: parse_beatmap(data), number=number, repeat=3)) / number
+        print(f"parse {name:<26} {parse * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,93 @@
+"""Fake interactions and messages, enough of discord.py's surface for the osu! cog's commands to run
+
+Responses are recorded instead of sent, so a command's latency is just the time spent in the bot.
+"""
+from __future__ import annotations
+import time
+from typing import Any, Dict, List, Optional
+import discord
+
+__all__ = (
+    "FakeUser",
+    "FakeInteraction",
+    "FakeMessage",
+)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str = "bench", *, bot: bool = False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{user_id}>"
+
+
+class _Object:
+    def __init__(self, object_id: int, **kwargs):
+        self.id = object_id
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+
+class _Response:
+    def __init__(self, interaction: FakeInteraction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def send_message(self, content: Optional[str] = None, **kwargs):
+        self._interaction._record(content, kwargs)
+        self._done = True
+
+    async def defer(self, **kwargs):
+        if self._interaction.first_response is None:
+            self._interaction.first_response = time.perf_counter()
+        self._done = True
+
+
+class _Followup:
+    def __init__(self, interaction: FakeInteraction):
+        self._interaction = interaction
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        self._interaction._record(content, kwargs)
+
+
+class FakeInteraction:
+    def __init__(self, client: discord.Client, user: FakeUser, *, guild_id: int = 1, channel_id: int = 1):
+        self.client = client
+        self.user = user
+        self.guild_id = guild_id
+        self.guild = _Object(guild_id, name="bench", members=[user])
+        self.channel_id = channel_id
+        self.command = None
+        self.extras: Dict[str, Any] = {}
+        self.response = _Response(self)
+        self.followup = _Followup(self)
+        self.started = time.perf_counter()
+        self.created_at = discord.utils.utcnow()
+        self.first_response: Optional[float] = None
+        self.messages: List[Dict[str, Any]] = []
+
+    @property
+    def failed(self) -> bool:
+        """Commands report their errors as ephemeral messages"""
+        return any(message.get("ephemeral") for message in self.messages)
+
+    def _record(self, content: Optional[str], kwargs: Dict[str, Any]):
+        if self.first_response is None:
+            self.first_response = time.perf_counter()
+        self.messages.append({"content": content, **kwargs})
+
+
+class FakeMessage:
+    """A message with ``.osr`` attachments, its channel is a real partial messageable so replies go through the HTTP client"""
+    def __init__(self, client: discord.Client, author: FakeUser, *, urls: List[str], guild_id: int = 1, channel_id: int = 1):
+        self.author = author
+        self.content = ""
+        self.attachments = [_Object(index, filename=url.rsplit("/", 1)[-1], url=url) for index, url in enumerate(urls)]
+        self.guild = _Object(guild_id)
+        self.channel = client.get_partial_messageable(channel_id, guild_id=guild_id)
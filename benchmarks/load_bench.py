@@ -0,0 +1,287 @@
+"""Load test for the osu! cog against local stand-ins for osu!, o!rdr and Discord, and a real Postgres
+
+Drives ``/osu user``, ``/osu beatmap``, the skin autocomplete and ``.osr`` messages at a fixed
+concurrency and writes p50/p95/p99 latency, upstream calls per operation and memory growth as JSON.
+
+Run from the repository root (``config.py`` has to exist, POSTGRES_URI is used unless ``--dsn`` is given
+and the database needs schema.sql applied)::
+
+    python -m benchmarks.load_bench --ops 500 --concurrency 32 --output before.json
+    python -m benchmarks.load_bench compare before.json after.json
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import aiohttp
+import asyncpg
+import discord
+from .driver import FakeInteraction, FakeMessage, FakeUser
+from .standins import StandIns
+
+SCENARIOS = ("user", "beatmap", "autocomplete", "osr")
+# Keeps rows made by the benchmark apart from real ones
+BENCH_USER_ID = 900_000_000_000_000_000
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(max(round(q / 100 * len(ordered) + 0.5) - 1, 0), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "p50": round(percentile(latencies, 50) * 1000, 3),
+        "p95": round(percentile(latencies, 95) * 1000, 3),
+        "p99": round(percentile(latencies, 99) * 1000, 3),
+        "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "max": round(max(latencies, default=0.0) * 1000, 3),
+    }
+
+
+def rss_kb() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.run_id = "".join(self.rng.choices(string.ascii_lowercase, k=6))
+        self.standins = StandIns(latency=args.upstream_latency / 1000, render_time=args.render_time)
+        self.usernames = [f"player_{index}" for index in range(args.keys)]
+        self.beatmaps = [129891 + index for index in range(args.keys)]
+        self.startup: Dict[str, float] = {}
+
+    async def run(self) -> Dict[str, Any]:
+        # Imported here so ``compare`` works without a config.py
+        import config
+        import utils
+        from bot import Aswo
+
+        await self.standins.start()
+        for key, value in {**self.standins.config(), "METRICS_PORT": 0, "BEATMAP_STORE_PATH": tempfile.mkdtemp(prefix="aswo-bench-")}.items():
+            setattr(config, key, value)
+        discord.http.Route.BASE = self.standins.discord_url
+
+        dsn = self.args.dsn or config.POSTGRES_URI
+        async with (
+            aiohttp.ClientSession(trace_configs=[utils.http_trace_config()]) as session,
+            utils.Upstreams(getattr(config, "UPSTREAMS", None), trace_configs=[utils.http_trace_config()]) as upstreams,
+            asyncpg.create_pool(dsn, connection_class=utils.InstrumentedConnection) as pool,
+            utils.Osu(client_id=0, client_secret="bench", session=upstreams.osu, limiter=utils.RateLimiter(rate=self.args.osu_rate, per=60), api_url=config.OSU_API_URL, token_url=config.OSU_TOKEN_URL) as osu,
+        ):
+            utils.instrument_pool(pool)
+            await pool.execute("DELETE FROM render_jobs WHERE user_id >= $1", BENCH_USER_ID)
+            bot = Aswo(session=session, upstreams=upstreams, osu=osu, pool=pool)
+            try:
+                # Runs setup_hook against the stand-ins, the gateway is never connected
+                with bot.startup.phase("login"):
+                    await bot.login("bench")
+                with bot.startup.phase("extensions"):
+                    await bot.load_extension("cogs.osu")
+                self.startup = dict(bot.startup.phases)
+                return await self._run_scenarios(bot)
+            finally:
+                await bot.close()
+                await self.standins.close()
+
+    async def _run_scenarios(self, bot) -> Dict[str, Any]:
+        cog = bot.get_cog("osu")
+        commands = {command.qualified_name: command for command in cog.walk_app_commands()}
+        runners: Dict[str, Callable[[int], Awaitable[bool]]] = {
+            "user": lambda op: self._command(bot, commands["osu user"], cog, username=self.rng.choice(self.usernames)),
+            "beatmap": lambda op: self._command(
+                bot, commands["osu beatmap"], cog,
+                beatmap=str(self.rng.choice(self.beatmaps)),
+                mods=self.rng.choice(("HD", "HDDT", "HR")) if self.rng.random() < self.args.calc_ratio else None,
+                acc=None
+            ),
+            "autocomplete": lambda op: self._autocomplete(bot, cog),
+            "osr": lambda op: self._replay(bot, cog, op),
+        }
+
+        results = {}
+        for name in self.args.scenarios:
+            gc.collect()
+            calls_before = self.standins.calls.copy()
+            rss_before = rss_kb()
+            traced_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+            started = time.perf_counter()
+
+            latencies, errors = await self._drive(runners[name], self.args.ops)
+            if name == "osr":
+                latencies, errors = await self._render_latencies(bot.pool)
+            elapsed = time.perf_counter() - started
+
+            gc.collect()
+            calls = self.standins.calls - calls_before
+            results[name] = {
+                "ops": self.args.ops,
+                "errors": errors,
+                "concurrency": self.args.concurrency,
+                "elapsed_s": round(elapsed, 3),
+                "throughput_per_s": round(self.args.ops / elapsed, 2),
+                "latency_ms": summarize(latencies),
+                "upstream_calls_per_op": {route: round(count / self.args.ops, 4) for route, count in sorted(calls.items())},
+                "memory": {
+                    "rss_kb_before": rss_before,
+                    "rss_kb_after": rss_kb(),
+                    "rss_growth_kb": rss_kb() - rss_before,
+                    "traced_growth_bytes": tracemalloc.get_traced_memory()[0] - traced_before if traced_before is not None else None,
+                },
+            }
+            logging.info(f"{name}: {results[name]['latency_ms']} errors={errors}")
+        return results
+
+    async def _drive(self, runner: Callable[[int], Awaitable[bool]], ops: int):
+        latencies: List[float] = []
+        errors = 0
+        queue = iter(range(ops))
+
+        async def worker():
+            nonlocal errors
+            for op in queue:
+                start = time.perf_counter()
+                try:
+                    ok = await runner(op)
+                except Exception:
+                    logging.exception("Operation failed")
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                errors += not ok
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        return latencies, errors
+
+    def _user(self) -> FakeUser:
+        return FakeUser(BENCH_USER_ID + self.rng.randrange(10_000))
+
+    async def _command(self, bot, command, cog, **kwargs) -> bool:
+        interaction = FakeInteraction(bot, self._user())
+        interaction.command = command
+        await command.callback(cog, interaction, **kwargs)
+        return not interaction.failed
+
+    async def _autocomplete(self, bot, cog) -> bool:
+        interaction = FakeInteraction(bot, self._user())
+        current = self.rng.choice(("", "sk", "Skin 1", "12", "in 3"))
+        return isinstance(await cog.id(interaction, current), list)
+
+    async def _replay(self, bot, cog, op: int) -> bool:
+        url = f"{self.standins.url}/replays/{self.run_id}{op}.osr"
+        await cog.on_message(FakeMessage(bot, self._user(), urls=[url]))
+        return True
+
+    async def _render_latencies(self, pool: asyncpg.Pool, timeout: float = 300.0):
+        """Replays are rendered in the background, their latency is enqueue to finish as recorded on the job"""
+        deadline = time.monotonic() + timeout
+        query = "SELECT status, created_at, finished_at FROM render_jobs WHERE user_id >= $1 AND replay_url LIKE $2"
+        pattern = f"%/replays/{self.run_id}%"
+        while True:
+            rows = await pool.fetch(query, BENCH_USER_ID, pattern)
+            if all(row['status'] in ("done", "failed") for row in rows) or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.2)
+
+        latencies = [(row['finished_at'] - row['created_at']).total_seconds() for row in rows if row['finished_at'] is not None]
+        return latencies, sum(1 for row in rows if row['status'] != "done")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path: str, after_path: str):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    print(f"{before['meta'].get('revision')} -> {after['meta'].get('revision')}")
+    for name, result in after["scenarios"].items():
+        old = before["scenarios"].get(name)
+        if old is None:
+            continue
+        print(name)
+        for stat in ("p50", "p95", "p99"):
+            a, b = old["latency_ms"][stat], result["latency_ms"][stat]
+            change = (b - a) / a * 100 if a else 0.0
+            print(f"  {stat:<4} {a:10.2f} ms -> {b:10.2f} ms  ({change:+.1f}%)")
+        old_calls, new_calls = sum(old["upstream_calls_per_op"].values()), sum(result["upstream_calls_per_op"].values())
+        print(f"  upstream calls/op {old_calls:.3f} -> {new_calls:.3f}")
+        print(f"  rss growth {old['memory']['rss_growth_kb']:,} KB -> {result['memory']['rss_growth_kb']:,} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=list(SCENARIOS), help=f"comma separated, any of {', '.join(SCENARIOS)}")
+    parser.add_argument("--ops", type=int, default=200, help="operations per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--keys", type=int, default=50, help="distinct usernames and beatmaps to pick from")
+    parser.add_argument("--calc-ratio", type=float, default=0.3, help="share of /osu beatmap calls that ask for mods")
+    parser.add_argument("--upstream-latency", type=float, default=20.0, help="ms added to every stand-in response")
+    parser.add_argument("--render-time", type=float, default=0.5, help="seconds o!rdr takes per render")
+    parser.add_argument("--osu-rate", type=int, default=6000, help="osu! API requests per minute")
+    parser.add_argument("--dsn", help="Postgres to use instead of config.POSTGRES_URI")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true", help="also report traced allocations, slows everything down")
+    parser.add_argument("--output", help="write results here instead of stdout")
+
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        compare(sys.argv[2], sys.argv[3])
+        return
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logging.getLogger("discord").setLevel(logging.WARNING)
+    logging.getLogger("bot").setLevel(logging.WARNING)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    test = LoadTest(args)
+    scenarios = asyncio.run(test.run())
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "args": {key: value for key, value in vars(args).items() if key != "dsn"},
+        },
+        "startup_ms": {phase: round(seconds * 1000, 3) for phase, seconds in test.startup.items()},
+        "scenarios": scenarios,
+    }
+    data = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data)
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Compares the slotted osu! models in utils/old_osu.py against the ones they replaced
+
+Reports decode time (bytes -> model) and memory kept alive per model.
+Run from the repository root with ``python -m benchmarks.models_bench``.
+"""
+from __future__ import annotations
+import gc
+import json
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List
+from utils import old_osu
+from . import legacy_models
+
+
+def user_payload(user_id: int = 124493) -> Dict[str, Any]:
+    """Roughly the shape and size of a real /users/{user} response"""
+    return {
+        "avatar_url": f"https://a.ppy.sh/{user_id}?1.jpeg",
+        "country_code": "KR",
+        "default_group": "default",
+        "id": user_id,
+        "is_active": True,
+        "is_bot": False,
+        "is_deleted": False,
+        "is_online": False,
+        "is_supporter": True,
+        "last_visit": "2023-03-26T12:00:00+00:00",
+        "pm_friends_only": False,
+        "profile_colour": None,
+        "username": "Cookiezi",
+        "cover_url": "https://assets.ppy.sh/user-profile-covers/124493/cover.jpeg",
+        "discord": None,
+        "has_supported": True,
+        "interests": None,
+        "join_date": "2008-01-23T07:52:22+00:00",
+        "kudosu": {"total": 0, "available": 0},
+        "location": None,
+        "max_blocks": 100,
+        "max_friends": 500,
+        "occupation": None,
+        "playmode": "osu",
+        "playstyle": ["keyboard", "tablet"],
+        "post_count": 11,
+        "profile_order": ["me", "recent_activity", "top_ranks", "medals", "historical", "beatmaps", "kudosu"],
+        "title": None,
+        "twitter": None,
+        "website": None,
+        "country": {"code": "KR", "name": "South Korea"},
+        "cover": {"custom_url": None, "url": "https://assets.ppy.sh/user-profile-covers/124493/cover.jpeg", "id": None},
+        "badges": [{"awarded_at": "2015-01-01T00:00:00+00:00", "description": f"badge {i}", "image_url": "https://assets.ppy.sh/badge.png", "url": ""} for i in range(10)],
+        "follower_count": 120000,
+        "monthly_playcounts": [{"start_date": f"20{10 + i // 12}-{i % 12 + 1:02}-01", "count": i * 37} for i in range(150)],
+        "replays_watched_counts": [{"start_date": f"20{10 + i // 12}-{i % 12 + 1:02}-01", "count": i * 11} for i in range(150)],
+        "rank_history": {"mode": "osu", "data": list(range(1000, 1090))},
+        "statistics": {
+            "level": {"current": 102, "progress": 8},
+            "global_rank": 1337,
+            "pp": 12345.67,
+            "ranked_score": 51432123456,
+            "hit_accuracy": 98.7654,
+            "play_count": 123456,
+            "play_time": 9876543,
+            "total_score": 345678901234,
+            "total_hits": 98765432,
+            "maximum_combo": 7777,
+            "replays_watched_by_others": 654321,
+            "is_ranked": True,
+            "grade_counts": {"ss": 100, "ssh": 200, "s": 3000, "sh": 4000, "a": 5000},
+            "country_rank": 42,
+            "rank": {"country": 42},
+        },
+        "user_achievements": [{"achieved_at": "2016-01-01T00:00:00+00:00", "achievement_id": i} for i in range(200)],
+    }
+
+
+def beatmap_payload(beatmap_id: int = 129891) -> Dict[str, Any]:
+    return {
+        "beatmapset_id": 39804,
+        "difficulty_rating": 6.12,
+        "id": beatmap_id,
+        "mode": "osu",
+        "status": "ranked",
+        "total_length": 230,
+        "user_id": 2,
+        "version": "FOUR DIMENSIONS",
+        "accuracy": 9,
+        "ar": 9.3,
+        "bpm": 200,
+        "convert": False,
+        "count_circles": 1500,
+        "count_sliders": 400,
+        "count_spinners": 2,
+        "cs": 4,
+        "deleted_at": None,
+        "drain": 6,
+        "hit_length": 220,
+        "is_scoreable": True,
+        "last_updated": "2014-05-18T17:22:13Z",
+        "mode_int": 0,
+        "passcount": 123456,
+        "playcount": 9876543,
+        "ranked": 1,
+        "url": f"https://osu.ppy.sh/beatmaps/{beatmap_id}",
+        "checksum": "da8aae79c8f3306b5d65ec951874a7fb",
+        "max_combo": 2385,
+        "beatmapset": {
+            "artist": "xi",
+            "artist_unicode": "xi",
+            "covers": {name: f"https://assets.ppy.sh/beatmaps/39804/covers/{name}.jpg" for name in ("cover", "cover@2x", "card", "card@2x", "list", "list@2x", "slimcover", "slimcover@2x")},
+            "creator": "Nakagawa-Kanon",
+            "favourite_count": 12345,
+            "hype": None,
+            "id": 39804,
+            "nsfw": False,
+            "offset": 0,
+            "play_count": 9999999,
+            "preview_url": "//b.ppy.sh/preview/39804.mp3",
+            "source": "BMS",
+            "spotlight": False,
+            "status": "ranked",
+            "title": "FREEDOM DiVE",
+            "title_unicode": "FREEDOM DiVE",
+            "track_id": None,
+            "user_id": 2,
+            "video": False,
+            "bpm": 222.22,
+            "ranked_date": "2012-01-01T00:00:00Z",
+            "submitted_date": "2011-12-01T00:00:00Z",
+            "tags": "tag " * 40,
+        },
+    }
+
+
+def bench_decode(name: str, raw: bytes, decode: Callable[[bytes], Any], number: int = 5_000):
+    best = min(timeit.repeat(lambda: decode(raw), number=number, repeat=5))
+    print(f"  {name:<28} {best / number * 1_000_000:8.2f} us/object")
+
+
+def bench_memory(name: str, raw: bytes, decode: Callable[[bytes], Any], count: int = 2_000):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept: List[Any] = [decode(raw) for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"  {name:<28} {(after - before) / len(kept):8.0f} bytes/object kept alive")
+
+
+def main():
+    cases = (
+        ("User", json.dumps(user_payload()).encode(), legacy_models.User, old_osu.User),
+        ("Beatmap", json.dumps(beatmap_payload()).encode(), legacy_models.Beatmap, old_osu.Beatmap),
+    )
+    for name, raw, legacy, current in cases:
+        print(f"{name} ({len(raw):,} byte payload)")
+        # The old client decoded with aiohttp's resp.json(), which is the stdlib json module
+        legacy_decode = lambda body, cls=legacy: cls(json.loads(body))
+        current_decode = lambda body, cls=current: cls(old_osu._loads(body))
+        bench_decode("legacy decode", raw, legacy_decode)
+        bench_decode("slotted decode", raw, current_decode)
+        bench_memory("legacy", raw, legacy_decode)
+        bench_memory("slotted", raw, current_decode)
+
+
+if __name__ == "__main__":
+    main()
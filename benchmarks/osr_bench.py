@@ -0,0 +1,60 @@
+"""Micro-benchmark for the .osr header parser in utils/osr.py
+
+Run from the repository root with ``python -m benchmarks.osr_bench``.
+"""
+from __future__ import annotations
+import os
+import struct
+import timeit
+from utils.osr import ReplayHeaderParser, parse_replay_header
+
+
+def _string(value: str) -> bytes:
+    if not value:
+        return b"\x00"
+    raw = value.encode()
+    length = bytearray()
+    size = len(raw)
+    while True:
+        byte = size & 0x7F
+        size >>= 7
+        length.append(byte | (0x80 if size else 0))
+        if not size:
+            break
+    return b"\x0b" + bytes(length) + raw
+
+
+def build_replay(*, mode: int = 0, mods: int = 0, player: str = "peppy", data_size: int = 150_000, life_bar_points: int = 400) -> bytes:
+    """A structurally valid replay, the replay data itself is random bytes"""
+    life_bar = ",".join(f"{i * 1000}|1" for i in range(life_bar_points))
+    return b"".join((
+        struct.pack("<Bi", mode, 20230326),
+        _string("a" * 32),
+        _string(player),
+        _string("b" * 32),
+        struct.pack("<6H", 1000, 50, 2, 200, 30, 1),
+        struct.pack("<iHBi", 123456789, 1500, 0, mods),
+        _string(life_bar),
+        struct.pack("<qi", 638155000000000000, data_size),
+        os.urandom(data_size),
+        struct.pack("<q", 4000000000),
+    ))
+
+
+def bench(number: int = 20_000):
+    replay = build_replay()
+    chunks = [replay[i:i + 64 * 1024] for i in range(0, len(replay), 64 * 1024)]
+
+    def streamed():
+        parser = ReplayHeaderParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser.close()
+
+    for name, func in (("parse_replay_header", lambda: parse_replay_header(replay)), ("ReplayHeaderParser (64KB chunks)", streamed)):
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print(f"{name:<34} {best / number * 1_000_000:8.2f} us/replay")
+
+
+if __name__ == "__main__":
+    bench()
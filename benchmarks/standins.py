@@ -0,0 +1,235 @@
+"""Local stand-ins for every service the bot talks to, served from one aiohttp app
+
+- ``/oauth/token`` and ``/api/v2/...``: the osu! API
+- ``/osu/{id}``: .osu files (the beatmap mirror)
+- ``/ordr/...`` and ``/socket.io``: the o!rdr REST API and websocket
+- ``/replays/{name}.osr``: replay attachments
+- ``/discord/api/v10/...``: the few Discord REST routes the bot uses outside of interactions
+
+Every request is counted by upstream and route, see ``StandIns.calls``.
+"""
+from __future__ import annotations
+import asyncio
+import collections
+import copy
+import datetime
+import hashlib
+import itertools
+import json
+from typing import Any, Counter, Dict, Optional
+import socketio
+from aiohttp import web
+from .difficulty_bench import build_map
+from .models_bench import beatmap_payload, user_payload
+from .osr_bench import build_replay
+
+__all__ = ("StandIns",)
+
+BEATMAP_FILES = [build_map(300, 180, 1), build_map(1_200, 200, 2), build_map(2_000, 190, 3)]
+COMPACT_USER_FIELDS = {
+    "avatar_url", "country_code", "default_group", "id", "is_active", "is_bot", "is_deleted", "is_online",
+    "is_supporter", "last_visit", "pm_friends_only", "profile_colour", "username", "country", "cover", "groups"
+}
+BOT_USER = {"id": "1000", "username": "Aswo", "discriminator": "0", "global_name": None, "avatar": None, "bot": True, "flags": 0}
+
+
+def _discord_json(data: Dict[str, Any]) -> web.Response:
+    # discord.py only parses bodies whose content type is exactly application/json, no charset
+    return web.Response(body=json.dumps(data).encode(), content_type="application/json")
+
+
+def _user_id(name: str) -> int:
+    return int(name) if name.isdigit() else int(hashlib.md5(name.lower().encode()).hexdigest()[:7], 16)
+
+
+class StandIns:
+    def __init__(self, *, host: str = "127.0.0.1", port: int = 0, latency: float = 0.02, render_time: float = 0.5):
+        self.host = host
+        self.port = port
+        # Added to every upstream response so coalescing and batching have something to save
+        self.latency = latency
+        self.render_time = render_time
+        self.calls: Counter[str] = collections.Counter()
+        self._snowflakes = itertools.count(int(datetime.datetime(2023, 1, 1).timestamp() * 1000 - 1420070400000) << 22)
+        self._render_ids = itertools.count(1)
+        self.finished: Dict[int, str] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self._tasks = set()
+        self.sio = socketio.AsyncServer(async_mode="aiohttp")
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def config(self) -> Dict[str, Any]:
+        """Config overrides that point the bot at these stand-ins"""
+        return {
+            "OSU_API_URL": f"{self.url}/api/v2",
+            "OSU_TOKEN_URL": f"{self.url}/oauth/token",
+            "BEATMAP_MIRROR_URL": f"{self.url}/osu/{{}}",
+            "ORDR_API_URL": f"{self.url}/ordr",
+            "ORDR_WS_URL": self.url,
+        }
+
+    @property
+    def discord_url(self) -> str:
+        return f"{self.url}/discord/api/v10"
+
+    async def start(self):
+        app = web.Application(middlewares=[self._count])
+        self.sio.attach(app)
+        app.router.add_post("/oauth/token", self.token)
+        app.router.add_get("/api/v2/users", self.users)
+        app.router.add_get("/api/v2/users/{user}/scores/{type}", self.scores)
+        app.router.add_get("/api/v2/users/{user}", self.user)
+        app.router.add_get("/api/v2/users/{user}/{mode}", self.user)
+        app.router.add_get("/api/v2/beatmaps", self.beatmaps)
+        app.router.add_get("/api/v2/beatmaps/{beatmap}", self.beatmap)
+        app.router.add_get("/osu/{beatmap}", self.osu_file)
+        app.router.add_get("/ordr/skins", self.skins)
+        app.router.add_post("/ordr/renders", self.render)
+        app.router.add_get("/ordr/renders", self.renders)
+        app.router.add_get("/replays/{name}.osr", self.replay)
+        app.router.add_get("/discord/api/v10/users/@me", self.discord_me)
+        app.router.add_get("/discord/api/v10/oauth2/applications/@me", self.discord_application)
+        app.router.add_post("/discord/api/v10/channels/{channel}/messages", self.discord_message)
+        app.router.add_patch("/discord/api/v10/channels/{channel}/messages/{message}", self.discord_message)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @web.middleware
+    async def _count(self, request: web.Request, handler):
+        if request.path.startswith("/socket.io"):
+            return await handler(request)
+
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        upstream = route.split("/")[1]
+        self.calls[f"{upstream} {request.method} {route}"] += 1
+        await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    # osu!
+
+    async def token(self, request: web.Request) -> web.Response:
+        return web.json_response({"token_type": "Bearer", "expires_in": 86400, "access_token": "bench"})
+
+    def _user(self, user: str) -> Dict[str, Any]:
+        data = user_payload(_user_id(user))
+        data["username"] = user if not user.isdigit() else f"player{user}"
+        return data
+
+    async def user(self, request: web.Request) -> web.Response:
+        return web.json_response(self._user(request.match_info["user"]))
+
+    def _compact_user(self, user: str) -> Dict[str, Any]:
+        # What /users?ids[] really returns, no profile fields and statistics per ruleset
+        full = self._user(user)
+        data = {key: value for key, value in full.items() if key in COMPACT_USER_FIELDS}
+        data["statistics_rulesets"] = {"osu": full["statistics"]}
+        return data
+
+    async def users(self, request: web.Request) -> web.Response:
+        return web.json_response({"users": [self._compact_user(user) for user in request.query.getall("ids[]", [])]})
+
+    async def scores(self, request: web.Request) -> web.Response:
+        return web.json_response([])
+
+    def _beatmap(self, beatmap_id: int) -> Dict[str, Any]:
+        data = copy.deepcopy(beatmap_payload(beatmap_id))
+        data["checksum"] = hashlib.md5(BEATMAP_FILES[beatmap_id % len(BEATMAP_FILES)]).hexdigest()
+        return data
+
+    async def beatmap(self, request: web.Request) -> web.Response:
+        return web.json_response(self._beatmap(int(request.match_info["beatmap"])))
+
+    async def beatmaps(self, request: web.Request) -> web.Response:
+        return web.json_response({"beatmaps": [self._beatmap(int(beatmap)) for beatmap in request.query.getall("ids[]", [])]})
+
+    async def osu_file(self, request: web.Request) -> web.Response:
+        return web.Response(body=BEATMAP_FILES[int(request.match_info["beatmap"]) % len(BEATMAP_FILES)])
+
+    # o!rdr
+
+    async def skins(self, request: web.Request) -> web.Response:
+        page, size = int(request.query.get("page", 1)), int(request.query.get("pageSize", 400))
+        total = 1200
+        skins = [
+            {"id": skin_id, "skin": f"Skin {skin_id}", "author": "bench", "highResPreview": f"{self.url}/skins/{skin_id}.png", "url": f"{self.url}/skins/{skin_id}.osk"}
+            for skin_id in range((page - 1) * size + 1, min(page * size, total) + 1)
+        ]
+        return web.json_response({"skins": skins, "maxSkins": total})
+
+    async def render(self, request: web.Request) -> web.Response:
+        render_id = next(self._render_ids)
+        task = asyncio.create_task(self._finish_render(render_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({"message": "Render added successfully", "renderID": render_id})
+
+    async def _finish_render(self, render_id: int):
+        await asyncio.sleep(self.render_time / 2)
+        await self.sio.emit("render_progress_json", {"renderID": render_id, "progress": "Rendering: 50%"})
+        await asyncio.sleep(self.render_time / 2)
+        self.finished[render_id] = f"{self.url}/videos/{render_id}.mp4"
+        await self.sio.emit("render_done_json", {"renderID": render_id, "videoUrl": self.finished[render_id]})
+
+    async def renders(self, request: web.Request) -> web.Response:
+        render_id = int(request.query.get("renderID", 0))
+        if render_id in self.finished:
+            render = {"renderID": render_id, "progress": "Done.", "videoUrl": self.finished[render_id], "errorCode": 0}
+        else:
+            render = {"renderID": render_id, "progress": "Rendering: 50%", "videoUrl": None, "errorCode": 0}
+        return web.json_response({"renders": [render], "maxRenders": 1})
+
+    async def replay(self, request: web.Request) -> web.Response:
+        # Each name is its own replay so renders don't get deduplicated
+        return web.Response(body=build_replay(player=request.match_info["name"][:16], data_size=20_000))
+
+    # Discord
+
+    async def discord_me(self, request: web.Request) -> web.Response:
+        return _discord_json(BOT_USER)
+
+    async def discord_application(self, request: web.Request) -> web.Response:
+        return _discord_json({
+            "id": BOT_USER["id"],
+            "name": "Aswo",
+            "icon": None,
+            "description": "",
+            "bot_public": True,
+            "bot_require_code_grant": False,
+            "owner": BOT_USER,
+            "summary": "",
+            "verify_key": "0" * 64,
+            "flags": 0,
+        })
+
+    async def discord_message(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        message_id = request.match_info.get("message") or str(next(self._snowflakes))
+        return _discord_json({
+            "id": message_id,
+            "channel_id": request.match_info["channel"],
+            "author": BOT_USER,
+            "content": payload.get("content") or "",
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": payload.get("embeds") or [],
+            "pinned": False,
+            "type": 0,
+        })
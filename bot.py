@@ -1,19 +1,20 @@
 from __future__ import annotations
 import datetime
+import math
 import sys
 from typing import TYPE_CHECKING
 from typing_extensions import Self
 import discord
 from discord.ext import commands, tasks
 import aiohttp
-import pkg_resources
+import asyncio
 import typing
 import logging
 import os
+import time
 import asyncpg
-import socketio
+import config
 from config import replay_key
-from osu import Client
 import utils
 
 
@@ -25,27 +26,94 @@ intents.members = True
 intents.typing = False
 
 
-class Aswo(commands.Bot):
+class Aswo(commands.AutoShardedBot):
     """Base aswo bot subclass!"""
     def __init__(
         self, 
         *, 
         session: aiohttp.ClientSession,
-        osu: Client,
-        pool: asyncpg.Pool
+        upstreams: utils.Upstreams,
+        osu: utils.Osu,
+        pool: asyncpg.Pool,
+        shard_ids: typing.Optional[typing.List[int]] = None,
+        shard_count: typing.Optional[int] = None,
+        cluster_id: typing.Optional[int] = None,
+        ipc_port: typing.Optional[int] = None,
+        startup: typing.Optional[utils.StartupTimer] = None
     ):
         self.session = session
+        # Named so it doesn't shadow discord.py's own bot.http
+        self.upstreams = upstreams
         self._connected = False
-        self.osu: Client = osu
+        self.osu: utils.Osu = osu
+        self.osu_cache = utils.OsuCache(osu)
+        self.beatmaps = utils.BeatmapStore(
+            upstreams.cdn,
+            getattr(config, "BEATMAP_STORE_PATH", "data/beatmaps"),
+            max_bytes=getattr(config, "BEATMAP_STORE_BYTES", 2 * 1024 ** 3),
+            mirror_url=getattr(config, "BEATMAP_MIRROR_URL", "https://osu.ppy.sh/osu/{}")
+        )
+        self.difficulty = utils.DifficultyCalculator(self.beatmaps)
         self.pool = pool
+        self.prefixes: typing.Dict[int, str] = {}
+        self.settings = utils.UserSettings(pool)
+        self.render_queue = utils.RenderQueue(
+            pool,
+            workers=getattr(config, "RENDER_WORKERS", 4),
+            per_user=getattr(config, "RENDER_PER_USER", 1),
+            per_guild=getattr(config, "RENDER_PER_GUILD", 2),
+            retry_for=datetime.timedelta(minutes=getattr(config, "RENDER_RETRY_MINUTES", 30))
+        )
+        self.stats_snapshots = utils.StatsSnapshotter(
+            pool,
+            osu,
+            stale_after=datetime.timedelta(hours=getattr(config, "STATS_STALE_HOURS", 6)),
+            batch_size=getattr(config, "STATS_BATCH_SIZE", 200)
+        )
+        self.tracker = utils.ScoreTracker(
+            pool,
+            osu,
+            # TRACKER_BUDGET is for the whole bot, players are split between the clusters. Without it the
+            # tracker takes what the osu! limiter leaves for background calls
+            budget=getattr(config, "TRACKER_BUDGET", None) and max(config.TRACKER_BUDGET // getattr(config, "CLUSTER_COUNT", 1), 1),
+            partition=(cluster_id or 0, getattr(config, "CLUSTER_COUNT", 1)),
+            store=self.beatmaps
+        )
+        self.analytics = utils.AnalyticsRecorder(
+            pool,
+            max_events=getattr(config, "ANALYTICS_BUFFER", 10_000),
+            interval=getattr(config, "ANALYTICS_FLUSH_INTERVAL", 10.0),
+            retention=datetime.timedelta(days=getattr(config, "ANALYTICS_RETENTION_DAYS", 30))
+        )
+        self.cache_listener = utils.CacheListener(
+            pool,
+            handlers={
+                "prefix": self._on_prefix_change,
+                "osu_user": self.settings.usernames.on_change,
+                "replay_config": self.settings.skins.on_change,
+                "score_subscriptions": self.tracker.on_change,
+            },
+            resync=self.resync_caches
+        )
         self.startup_time: typing.Optional[datetime.timedelta] = None
         self.start_time = discord.utils.utcnow()
+        self.startup = startup or utils.StartupTimer()
         self.logger = logging.getLogger(__name__)
         self.replay_key = replay_key
+        self.ordr_url = getattr(config, "ORDR_API_URL", "https://apis.issou.best/ordr")
+        self.ordr = utils.OrdrWebsocket(url=getattr(config, "ORDR_WS_URL", "https://ordr-ws.issou.best"), api_url=self.ordr_url, session=upstreams.ordr)
+        self.skins = utils.SkinCatalog(session=upstreams.ordr, url=f"{self.ordr_url}/skins")
+        self.cluster_id = cluster_id
+        # Every cluster serves its own metrics, one port per cluster
+        self.metrics = utils.MetricsServer(self, port=getattr(config, "METRICS_PORT", 3000) + (cluster_id or 0))
+        self.ipc: typing.Optional[utils.IPCClient] = None
+        if ipc_port is not None:
+            self.ipc = utils.IPCClient(cluster_id, port=ipc_port, stats=self.cluster_stats)
+            self.ipc.add_handler("invalidate", self._on_invalidate)
         os.environ["JISHAKU_NO_UNDERSCORE"] = "True"
         os.environ["JISHAKU_NO_DM_TRACEBACK"] = "True"
         
-        super().__init__(command_prefix=self.get_prefix,intents=intents, activity=discord.Activity(type=discord.ActivityType.playing, name="Click on the circles!"))
+        super().__init__(command_prefix=self.get_prefix,intents=intents, activity=discord.Activity(type=discord.ActivityType.playing, name="Click on the circles!"), shard_ids=shard_ids, shard_count=shard_count, tree_cls=utils.MetricsTree)
 
 
 
@@ -57,12 +125,123 @@ class Aswo(commands.Bot):
             return commands.when_mentioned_or(">>")(bot, message)
 
     async def setup_hook(self): 
+        with self.startup.phase("setup_hook"):
+            await self.metrics.start()
+            # Listen first so nothing changed while we're loading gets missed
+            await self.cache_listener.start()
+            self.ordr.start()
+            with self.startup.phase("warmup"):
+                # None of these depend on each other
+                await asyncio.gather(
+                    self.startup.timed("warmup.prefixes", self.load_prefixes()),
+                    self.startup.timed("warmup.settings", self.settings.load()),
+                    self.startup.timed("warmup.beatmap_store", self.beatmaps.load()),
+                    self.startup.timed("warmup.skins", self.skins.wait_until_loaded(timeout=10)),
+                    self.startup.timed("warmup.osu_token", self.warm_osu_token()),
+                )
+            self.stats_snapshots.start()
+            self.analytics.start()
+            if self.ipc is not None:
+                self.ipc.start()
+
+    async def warm_osu_token(self):
+        # Commands would fetch it on first use anyway, so a failure here isn't fatal
+        try:
+            await self.osu.tokens.get()
+        except Exception as e:
+            self.logger.warning(f"Could not get an osu! token at startup: {e!r}")
+
+    async def load_prefixes(self):
         query = await self.pool.fetch("SELECT * FROM prefix")
         self.prefixes = {
             x['guild_id']: x['prefix']
             for x in query
         }
 
+    async def resync_caches(self):
+        await asyncio.gather(self.load_prefixes(), self.settings.load())
+
+    def _on_prefix_change(self, op: str, row: dict):
+        if op == "DELETE":
+            self.prefixes.pop(row['guild_id'], None)
+        else:
+            self.prefixes[row['guild_id']] = row['prefix']
+
+    def cluster_stats(self) -> typing.Dict[str, typing.Any]:
+        # NaN until a shard has connected
+        latency = self.latency
+        return {
+            "shards": sorted(self.shards),
+            "guilds": len(self.guilds),
+            "users": len(self.users),
+            "latency": None if math.isnan(latency) else round(latency * 1000),
+        }
+
+    async def invalidate(self, kind: str, key: typing.Union[str, int]):
+        """Drops a cached osu! user or beatmap here and in every other cluster"""
+        self._on_invalidate({"kind": kind, "key": key})
+        if self.ipc is not None:
+            await self.ipc.publish("invalidate", {"kind": kind, "key": key})
+
+    def _on_invalidate(self, data: dict):
+        if data['kind'] == "user":
+            self.osu_cache.invalidate_user(data['key'], key="id" if isinstance(data['key'], int) else "username")
+        elif data['kind'] == "beatmap":
+            self.osu_cache.invalidate_beatmap(data['key'])
+
+    async def close(self):
+        if self.ipc is not None:
+            await self.ipc.close()
+        await self.cache_listener.close()
+        await self.stats_snapshots.close()
+        await self.analytics.close()
+        await self.ordr.close()
+        await self.metrics.close()
+        await super().close()
+
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        utils.observe_command(interaction, command)
+        self.record_interaction(interaction, command)
+
+    def record_interaction(self, interaction: discord.Interaction, command, error: typing.Optional[str] = None):
+        started = interaction.extras.get("started")
+        self.analytics.record(
+            "app",
+            command.qualified_name if command else "unknown",
+            guild_id=interaction.guild_id,
+            channel_id=interaction.channel_id,
+            user_id=interaction.user.id,
+            latency=time.perf_counter() - started if started is not None else None,
+            error=error,
+            upstreams=interaction.extras.get("upstreams")
+        )
+
+    async def invoke(self, ctx: utils.Context):
+        ctx.started = time.perf_counter()
+        ctx.upstreams = utils.track_upstream_calls()
+        await super().invoke(ctx)
+
+    def record_context(self, ctx: utils.Context, error: typing.Optional[str] = None):
+        self.analytics.record(
+            "prefix",
+            ctx.command.qualified_name,
+            guild_id=ctx.guild.id if ctx.guild else None,
+            channel_id=ctx.channel.id,
+            user_id=ctx.author.id,
+            latency=time.perf_counter() - ctx.started if ctx.started is not None else None,
+            error=error,
+            upstreams=ctx.upstreams
+        )
+
+    async def on_command_completion(self, ctx: utils.Context):
+        self.record_context(ctx)
+
+    async def on_command_error(self, ctx: utils.Context, error: commands.CommandError):
+        # Unknown commands are just messages that happened to start with the prefix
+        if ctx.command is not None:
+            self.record_context(ctx, getattr(error, "original", error).__class__.__name__)
+        await super().on_command_error(ctx, error)
+
     async def get_context(self, message, *, cls=utils.Context ):
         return await super().get_context(message, cls=cls)
 
@@ -76,11 +255,14 @@ class Aswo(commands.Bot):
         else:
             self._connected = True
             self.startup_time = discord.utils.utcnow() - self.start_time
+            self.startup.end("gateway")
+            self.startup.finish()
             msg = (
                 f"Successfully logged into {self.user}. ({round(self.latency * 1000)}ms)\n"
-                f"Discord.py Version: {discord.__version__} | {pkg_resources.get_distribution('discord.py').version}\n"
+                f"Discord.py Version: {discord.__version__}\n"
                 f"Python version: {sys.version}\n"
-                f"Startup Time: {self.startup_time.total_seconds():.2f} seconds."
+                f"Startup Time: {self.startup_time.total_seconds():.2f} seconds.\n"
+                f"Startup phases:\n{self.startup.report()}"
             )
             self.logger.info(f"{msg}")
             
@@ -1,157 +1,409 @@
 from __future__ import annotations
-import contextlib
+import asyncio
 import datetime
-from typing import Optional
+from typing import Literal, Optional
 import discord
 from discord.ext import commands
 from discord import app_commands
 from bot import Aswo
 import re
-from utils import default, error_codes, URL_RE
-from osu import User
-import socketio
-
-class UserSelect(discord.ui.Select):
-    def __init__(self, user: User):
-        self.user = user
+import time
+import aiohttp
+import utils
+from utils import default, error_codes, URL_RE, RenderFailed, ReplayTooLarge, InvalidReplay
+from utils import User
+
+def avatar_embed(user: User) -> discord.Embed:
+    embed = discord.Embed(title=f"{user.username}'s Osu avatar", color=0x2F3136)
+    embed.set_image(url=user.avatar_url)
+    return embed
+
+
+def statistics_embed(user: User) -> discord.Embed:
+    embed = discord.Embed(title=f"{user.username}'s Statistics", color=0x2F3136)
+    play_style = ', '.join(user.playstyle) if type(user.playstyle) is list else f"{user.username} has no playstyles selected"
+    embed.add_field(name="Total Statistics", value=f"Total Hits: {user.total_hits:,}\nTotal Score: {user.total_score:,}\nMaximum Combo: {user.max_combo:,}\nPlay Count: {user.play_count:,}", inline=True)
+    embed.add_field(name="Play Styles", value=f"Play Styles: {play_style}\nFavorite Play Mode: {user.playmode}", inline=True)
+    return embed
+
+
+def info_embed(user: User) -> discord.Embed:
+    ss_text = user.rank['ss']
+    ssh_text = user.rank['ssh']
+    s_text = user.rank['s']
+    sh_text = user.rank['sh']
+    a_text = user.rank['a']
+    profile_order = '\n ​ ​ ​ ​ ​ ​ ​ ​  - '.join(user.profile_order)
+    profile_order = profile_order.replace("_", " ")
+
+    embed = discord.Embed(description=f"**{user.country_emoji} | Profile for [{user.username}](https://osu.ppy.sh/users/{user.id})**\n\n▹ **Bancho Rank**: #{user.global_rank:,} ({user.country_code}#{user.country_rank:,})\n▹ **Join Date**: {user.joined_at}\n▹ **PP**: {int(user.pp):,} **Acc**: {user.accuracy}%\n▹ **Ranks**: ``SS {ss_text:,}`` | ``SSH {ssh_text:,}`` | ``S {s_text:,}`` | ``SH {sh_text:,}`` | ``A {a_text:,}``\n▹ **Profile Order**: \n** ​ ​ ​ ​ ​ ​ ​ ​  - {profile_order}**", color=0x2F3136)
+    embed.set_thumbnail(url=user.avatar_url)
+    return embed
+
+
+def score_embed(score, username: str, top: bool, stars: Optional[float] = None) -> discord.Embed:
+    mods = f" +{''.join(score.mods)}" if score.mods else ""
+    pp = f"{score.pp:,.2f}pp" if score.pp is not None else "No pp"
+    embed = discord.Embed(
+        title=f"{score.beatmapset.artist} - {score.beatmapset.title} [{score.beatmap.version}]{mods}",
+        url=f"https://osu.ppy.sh/b/{score.beatmap.id}",
+        description=f"▹ **{score.rank}** • {pp} • {score.accuracy * 100:.2f}%\n▹ {score.score:,} • x{score.max_combo:,} • {stars or score.beatmap.difficulty_rating:.2f}★",
+        timestamp=score.created_at,
+        color=0x2F3136
+    )
+    embed.set_author(name=f"New {'top' if top else 'recent'} play by {username}", url=f"https://osu.ppy.sh/users/{score.user_id}", icon_url=f"https://a.ppy.sh/{score.user_id}")
+    embed.set_thumbnail(url=score.beatmapset.covers("list@2x"))
+    return embed
+
+
+def mark_stale(embed: discord.Embed, age: Optional[float], command: str) -> discord.Embed:
+    """Footer for answers that fell back to an old cached copy because osu! couldn't be reached"""
+    if age is not None:
+        minutes = int(age // 60)
+        embed.set_footer(text=f"Stale • osu! is busy, this is from {minutes} minute{'s' if minutes != 1 else ''} ago")
+        utils.DEGRADED.inc("stale", command)
+    return embed
+
+
+def leaderboard_value(row, sort: str) -> str:
+    column, fmt, higher_is_better = {
+        "pp": ("pp", "{:,.0f}pp", True),
+        "rank": ("global_rank", "#{:,}", False),
+        "accuracy": ("accuracy", "{:.2f}%", True),
+        "play count": ("play_count", "{:,} plays", True),
+    }[sort]
+    value, previous = row[column], row[f"prev_{column}"]
+    if value is None:
+        return "Unranked"
+
+    text = fmt.format(value)
+    if previous is None or previous == value:
+        return text
+
+    change = value - previous if higher_is_better else previous - value
+    arrow = "▲" if change > 0 else "▼"
+    return f"{text} ({arrow}{abs(change):,.2f})" if sort == "accuracy" else f"{text} ({arrow}{abs(change):,.0f})"
+
+
+class UserSelect(discord.ui.DynamicItem[discord.ui.Select], template=r"osu:user:(?P<author_id>[0-9]+):(?P<user_id>[0-9]+)"):
+    """The /osu user dropdown, everything it needs lives in its custom_id so it keeps working after restarts"""
+    def __init__(self, author_id: int, user_id: int, username: Optional[str] = None):
+        self.author_id = author_id
+        self.user_id = user_id
+        name = username or "this user"
         options = [
-            discord.SelectOption(label='Account Avatar', description=f'Shows the avatar of: {self.user.username}'),
-            discord.SelectOption(label='Info', description=f'Info about: {self.user.username}'),
-            discord.SelectOption(label="Statistics", description=f"Statistics about {self.user.username}")
+            discord.SelectOption(label='Account Avatar', description=f'Shows the avatar of: {name}'),
+            discord.SelectOption(label='Info', description=f'Info about: {name}'),
+            discord.SelectOption(label="Statistics", description=f"Statistics about {name}")
         ]
 
-        super().__init__(min_values=1, max_values=1, options=options, custom_id="OsuSelectID")
-
-    async def callback(self, interaction: discord.Interaction):      
-        await interaction.response.defer()
+        super().__init__(discord.ui.Select(min_values=1, max_values=1, options=options, custom_id=f"osu:user:{author_id}:{user_id}"))
 
-        if self.values[0] == "Account Avatar":
-            embed = discord.Embed(color=0x2F3136)
-            avatar_url = self.user.avatar_url
-
-            embed.title = f"{self.user.username}'s Osu avatar"
-            embed.set_image(url=avatar_url)
-
-            await interaction.message.edit(embed=embed, view = DropdownView(interaction.user.id,self.user))
-
-        if self.values[0] == "Statistics":
-            embed = discord.Embed(title=f"{self.user.username}'s Statistics", color=0x2F3136)
-            max_combo = self.user.max_combo
-            play_style = ', '.join(self.user.playstyle) if type(self.user.playstyle) is list else f"{self.user.username} has no playstyles selected"
-            embed.add_field(name="Total Statistics", value=f"Total Hits: {self.user.total_hits:,}\nTotal Score: {self.user.total_score:,}\nMaximum Combo: {max_combo:,}\nPlay Count: {self.user.play_count:,}", inline=True)
-            embed.add_field(name="Play Styles", value=f"Play Styles: {play_style}\nFavorite Play Mode: {self.user.playmode}", inline=True)
-            await interaction.message.edit(embed=embed, view = DropdownView(interaction.user.id,self.user))    
-
-        if self.values[0] == "Info":
-            embed = discord.Embed(color=0x2F3136)
-            view = DropdownView(interaction.user.id,self.user)
-
-            ss_text = self.user.rank['ss']
-            ssh_text = self.user.rank['ssh']
-            s_text = self.user.rank['s']
-            sh_text = self.user.rank['sh']
-            a_text = self.user.rank['a']
-            profile_order = '\n ​ ​ ​ ​ ​ ​ ​ ​  - '.join(self.user.profile_order)
-            profile_order = profile_order.replace("_", " ")
-
-            embed.description = f"**{self.user.country_emoji} | Profile for [{self.user.username}](https://osu.ppy.sh/users/{self.user.id})**\n\n▹ **Bancho Rank**: #{self.user.global_rank:,} ({self.user.country_code}#{self.user.country_rank:,})\n▹ **Join Date**: {self.user.joined_at}\n▹ **PP**: {int(self.user.pp):,} **Acc**: {self.user.accuracy}%\n▹ **Ranks**: ``SS {ss_text:,}`` | ``SSH {ssh_text:,}`` | ``S {s_text:,}`` | ``SH {sh_text:,}`` | ``A {a_text:,}``\n▹ **Profile Order**: \n** ​ ​ ​ ​ ​ ​ ​ ​  - {profile_order}**"
-            embed.set_thumbnail(url=self.user.avatar_url)
-            await interaction.message.edit(embed=embed, view=view)
-
-class DropdownView(discord.ui.View):
-    def __init__(self, author_id: int ,user: User):
-        super().__init__(timeout=None)
-        self.user = user
-        self.author_id = author_id
-        # Adds the dropdown to our view object.
-        self.add_item(UserSelect(self.user))
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Select, match: re.Match[str]):
+        return cls(int(match['author_id']), int(match['user_id']))
 
+    @classmethod
+    def make_view(cls, author_id: int, user: User) -> discord.ui.View:
+        view = discord.ui.View(timeout=None)
+        view.add_item(cls(author_id, user.id, user.username))
+        return view
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id == self.author_id:
             return True
-        await interaction.response.defer()
-        await interaction.followup.send(f"You cant use this as you're not the command invoker, only the author (<@{interaction.guild.get_member(self.author_id).id}>) Can Do This!", ephemeral=True)
+        await interaction.response.send_message(f"You cant use this as you're not the command invoker, only the author (<@{self.author_id}>) Can Do This!", ephemeral=True)
         return False
 
+    async def callback(self, interaction: discord.Interaction):      
+        await interaction.response.defer()
+
+        bot: Aswo = interaction.client
+        user = await bot.osu_cache.fetch_user(self.user_id, key="id")
+        builders = {"Account Avatar": avatar_embed, "Info": info_embed, "Statistics": statistics_embed}
+        embed = builders[self.item.values[0]](user)
+        await interaction.message.edit(embed=embed, view=self.make_view(self.author_id, user))
+
 
 class osu(commands.Cog):
     def __init__(self, bot: Aswo):
         self.bot = bot
-        self.cached_skins = {}
+        self.renders = utils.RenderCache(bot.pool)
+        self.submissions = utils.SingleFlight()
     
     osu = app_commands.Group(name="osu", description="All osu commands")
     set = app_commands.Group(name="set", description="allows you to set various things for osu", parent=osu)
     replay = app_commands.Group(name="replay", description="Allows you to control various aspects of replay uploading", parent=osu)
+    track = app_commands.Group(name="track", description="Posts new plays of osu! players in a channel", parent=osu, default_permissions=discord.Permissions(manage_channels=True), guild_only=True)
 
     
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        with contextlib.suppress(IndexError):
-            osr = message.attachments[0].url
-            if osr.endswith('.osr') or URL_RE.findall(message.content):
-                skin = await self.bot.pool.fetchval("SELECT skin_id FROM replay_config WHERE user_id = $1", message.author.id) or 1
-
-
-                self.bot.logger.info(f"Skin : {skin}")
+    async def cog_load(self):
+        self.bot.add_dynamic_items(UserSelect)
+        self.bot.render_queue.start(self.process_job)
+        await self.bot.tracker.start(self.post_score)
 
-                async with self.bot.session.post("https://apis.issou.best/ordr/renders", data={"replayURL":osr, "username":"Aswo", "resolution":"1280x720", "skin": skin,"verificationKey":self.bot.replay_key}) as resp:
-                    ordr_json = await resp.json()
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(UserSelect)
+        await self.bot.render_queue.stop()
+        await self.bot.tracker.stop()
 
-                if ordr_json['errorCode'] in error_codes:
-                    return await message.channel.send(error_codes.get(ordr_json['errorCode']))
-
-                mes = await message.channel.send("Osu replay file detected, a rendered replay will be sent shortly! May take up to a minute while its uploading so sit back and relax :D!\nIll ping you when its finished!")
-                self.bot.logger.info(ordr_json)
-                render_id = ordr_json['renderID']
-
-                sio = socketio.AsyncClient()
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.author.bot:
+            return
+
+        urls = [attachment.url for attachment in message.attachments if attachment.filename.lower().endswith('.osr')]
+        urls.extend(url for url in URL_RE.findall(message.content) if url not in urls)
+        if not urls:
+            return
+
+        skin = await self.bot.settings.get_skin(message.author.id) or 1
+        self.bot.logger.info(f"Skin : {skin}")
+
+        # Only queue here, the render workers do the downloading and waiting
+        for url in urls:
+            started = time.perf_counter()
+            mes = await message.channel.send("Osu replay file detected, a rendered replay will be sent shortly! May take up to a minute while its uploading so sit back and relax :D!\nIll ping you when its finished!")
+            job_id = await self.bot.render_queue.enqueue(
+                user_id=message.author.id,
+                guild_id=message.guild.id if message.guild else None,
+                channel_id=message.channel.id,
+                message_id=mes.id,
+                replay_url=url,
+                skin_id=skin
+            )
+            position = await self.bot.render_queue.position(job_id)
+            if position > self.bot.render_queue.workers:
+                eta = await self.bot.render_queue.eta(position)
+                await mes.edit(content=f"{mes.content}\nYou're #{position} in the render queue, it should start {discord.utils.format_dt(discord.utils.utcnow() + eta, style='R')}.")
+
+            self.bot.analytics.record(
+                "replay",
+                "replay submit",
+                guild_id=message.guild.id if message.guild else None,
+                channel_id=message.channel.id,
+                user_id=message.author.id,
+                latency=time.perf_counter() - started
+            )
+
+    async def submit_replay(self, url: str, skin: int) -> int:
+        async with self.bot.upstreams.ordr.post(f"{self.bot.ordr_url}/renders", data={"replayURL":url, "username":"Aswo", "resolution":"1280x720", "skin": skin,"verificationKey":self.bot.replay_key}) as resp:
+            ordr_json = await resp.json()
+
+        self.bot.logger.info(ordr_json)
+        if ordr_json.get('errorCode') in error_codes:
+            raise RenderFailed(error_codes[ordr_json['errorCode']], ordr_json['errorCode'])
+
+        return ordr_json['renderID']
+
+    async def process_job(self, job) -> bool:
+        """Renders one queued replay, called by the render queue workers"""
+        mes = self.bot.get_partial_messageable(job['channel_id']).get_partial_message(job['message_id'])
+        mention = f"<@{job['user_id']}>"
+        skin = job['skin_id']
+        replay_hash = job['replay_hash']
+        render_id = job['render_id']
+        last_edit = 0.0
+
+        async def on_progress(data: dict):
+            nonlocal last_edit
+            # Progress events come in every few seconds, dont hit the edit ratelimit with them
+            if time.monotonic() - last_edit < 15:
+                return
+            last_edit = time.monotonic()
+            await mes.edit(content=f"Rendering your replay {mention}... ({data.get('progress', 'working on it')})")
+
+        # render_id is already set when we're picking up a job a previous run didn't finish
+        if render_id is not None:
+            waiter = self.bot.ordr.register(render_id, on_progress=on_progress)
+            # It might have finished while we were down, the websocket won't send that again
+            await self.bot.ordr.check([render_id])
+        else:
+            try:
+                replay_hash, header = await utils.read_replay(self.bot.upstreams.cdn, job['replay_url'])
+            except InvalidReplay as e:
+                await mes.edit(content=str(e))
+                return False
+            except utils.UpstreamUnavailable as e:
+                return await self.retry_later(job, mes, e, f"Couldn't read that replay: {e}")
+            except (ReplayTooLarge, aiohttp.ClientError) as e:
+                await mes.edit(content=f"Couldn't read that replay: {e}")
+                return False
+
+            self.bot.logger.info(f"Replay by {header.player_name} on {header.beatmap_md5} (mods {header.mods})")
+
+            existing = await self.renders.lookup(replay_hash, skin)
+            if existing is not None and existing['video_url']:
+                await mes.edit(content=f"Here's your rendered video {mention}! (this replay was already rendered)\n{existing['video_url']}")
+                return True
+
+            if existing is not None:
+                # Someone already sent this replay and it's still rendering, wait on that render instead
+                render_id = existing['render_id']
+                waiter = self.bot.ordr.register(render_id, on_progress=on_progress)
+                # Their job may have gotten the done event before we started listening
+                await self.bot.ordr.check([render_id])
+            else:
+                try:
+                    # Identical replays sent at the same time share one submission
+                    render_id = await self.submissions.do((replay_hash, skin), lambda: self.submit_replay(job['replay_url'], skin))
+                except utils.UpstreamUnavailable as e:
+                    return await self.retry_later(job, mes, e, str(e))
+                except RenderFailed as e:
+                    await mes.edit(content=str(e))
+                    return False
+
+                # Before anything else awaits, so a quick render_done_json can't come and go unseen
+                waiter = self.bot.ordr.register(render_id, on_progress=on_progress)
 
-                @sio.event
-                async def render_done_json(data):
-                    if data['renderID'] == render_id:
-                        data = data
-                        self.bot.logger.info(data)
-                        await mes.edit(content=f"Here's your rendered video {message.author.mention}!\n{data['videoUrl']}")
+            try:
+                if existing is None:
+                    await self.renders.claim(replay_hash, skin, render_id)
+                await self.bot.render_queue.set_render(job['id'], replay_hash, render_id)
+            except BaseException:
+                # Nobody is left to wait on it
+                waiter.cancel()
+                raise
 
-                with contextlib.suppress(socketio.exceptions.ConnectionError):
-                    await sio.connect('https://ordr-ws.issou.best')
-                    await sio.wait()
+        try:
+            data = await waiter
+        except asyncio.TimeoutError:
+            await mes.edit(content=f"Sorry {mention}, o!rdr took too long to render your replay!")
+            return False
+        except RenderFailed as e:
+            await self.renders.forget(replay_hash, skin, render_id)
+            await mes.edit(content=f"Sorry {mention}, your replay failed to render: {e}")
+            return False
+
+        self.bot.logger.info(data)
+        await self.renders.complete(replay_hash, skin, render_id, data['videoUrl'])
+        await mes.edit(content=f"Here's your rendered video {mention}!\n{data['videoUrl']}")
+        return True
+
+    async def retry_later(self, job, mes: discord.PartialMessage, error: utils.UpstreamUnavailable, failed: str) -> bool:
+        """Puts the job back in the queue while an upstream is down or overloaded, fails it with ``failed`` once it's been too long"""
+        if not self.bot.render_queue.can_retry(job):
+            await mes.edit(content=failed)
+            return False
+
+        await mes.edit(content=f"Things are busy right now, your replay is still in the queue and will be retried {discord.utils.format_dt(discord.utils.utcnow() + datetime.timedelta(seconds=60), style='R')}!")
+        raise utils.RetryLater(str(error), delay=60)
+
+    async def post_score(self, score, top: bool, subscriptions):
+        stars = None
+        if score.mode == "osu":
+            # The API only has the nomod star rating
+            mods = 0
+            for mod in score.mods:
+                mods |= utils.MODS.get(mod, 0)
+            try:
+                stars = (await self.bot.difficulty.difficulty(score.beatmap.id, mods, checksum=score.beatmap.checksum)).stars
+            except Exception as e:
+                # The score is already marked as seen, post it with the nomod rating rather than lose it
+                self.bot.logger.info(f"No star rating for score {score.id}: {e!r}")
+
+        embed = score_embed(score, subscriptions[0]['osu_username'], top, stars)
+        for subscription in subscriptions:
+            # Partial channels send over REST, the channel doesn't have to be on one of our shards
+            channel = self.bot.get_partial_messageable(subscription['channel_id'])
+            try:
+                await channel.send(embed=embed)
+            except (discord.NotFound, discord.Forbidden):
+                await self.bot.tracker.unsubscribe(subscription['channel_id'], subscription['osu_id'])
+            except discord.HTTPException as e:
+                self.bot.logger.warning(f"Could not post score {score.id} in {subscription['channel_id']}: {e}")
+
+    @track.command(name="add", description="Posts an osu! player's new plays in this channel")
+    @app_commands.describe(username="osu! username to track", kind="Post every new pass or only new top plays")
+    async def track_add(self, itr: discord.Interaction, username: str, kind: Literal["recent", "best"] = "best"):
+        try:
+            user = await self.bot.osu_cache.fetch_user(username, key="username")
+        except Exception as e:
+            return await itr.response.send_message(f"{e}", ephemeral=True)
+
+        inserted = await self.bot.tracker.subscribe(channel_id=itr.channel_id, guild_id=itr.guild_id, osu_id=user.id, osu_username=user.username, kind=kind)
+        plays = "new top plays" if kind == "best" else "new plays"
+        if inserted:
+            await itr.response.send_message(f"Now posting {plays} by **{user.username}** in this channel!")
+        else:
+            await itr.response.send_message(f"Already tracking **{user.username}** here, now posting {plays}.")
+
+    @track.command(name="remove", description="Stops posting an osu! player's plays in this channel")
+    @app_commands.describe(username="osu! username to stop tracking")
+    async def track_remove(self, itr: discord.Interaction, username: str):
+        subscription = discord.utils.find(lambda row: row['osu_username'].lower() == username.lower(), await self.bot.tracker.subscriptions_for(itr.channel_id))
+        if subscription is None:
+            return await itr.response.send_message(f"**{username}** isn't tracked in this channel!", ephemeral=True)
+
+        await self.bot.tracker.unsubscribe(itr.channel_id, subscription['osu_id'])
+        await itr.response.send_message(f"Stopped tracking **{subscription['osu_username']}** here.")
+
+    @track.command(name="list", description="Lists the osu! players tracked in this channel")
+    async def track_list(self, itr: discord.Interaction):
+        subscriptions = await self.bot.tracker.subscriptions_for(itr.channel_id)
+        if not subscriptions:
+            return await itr.response.send_message("Nobody is tracked in this channel, use ``/osu track add``!", ephemeral=True)
+
+        lines = [f"▹ [{row['osu_username']}](https://osu.ppy.sh/users/{row['osu_id']}) • {'top plays' if row['kind'] == 'best' else 'all plays'}" for row in subscriptions]
+        embed = discord.Embed(title="Tracked players", description="\n".join(lines[:50]), color=0x2F3136)
+        await itr.response.send_message(embed=embed, ephemeral=True)
+
+    @replay.command(name="queue", description="Shows where your replays are in the render queue")
+    async def queue(self, itr: discord.Interaction):
+        jobs = await self.bot.render_queue.pending_for(itr.user.id)
+        if not jobs:
+            return await itr.response.send_message("You don't have any replays waiting to be rendered!", ephemeral=True)
+
+        lines = []
+        for job in jobs:
+            if job['status'] == 'rendering':
+                lines.append(f"▹ [Replay]({job['replay_url']}): rendering now")
+                continue
+
+            position = await self.bot.render_queue.position(job['id'])
+            eta = await self.bot.render_queue.eta(position)
+            lines.append(f"▹ [Replay]({job['replay_url']}): #{position} in queue, starts {discord.utils.format_dt(discord.utils.utcnow() + eta, style='R')}")
+
+        embed = discord.Embed(title="Your render queue", description="\n".join(lines), color=0x2F3136)
+        await itr.response.send_message(embed=embed, ephemeral=True)
             
     @osu.command()
     async def user(self, interaction: discord.Interaction, username: Optional[str]):
         """Gets info on osu account"""
 
-        user_query = await self.bot.pool.fetchrow("SELECT osu_username FROM osu_user WHERE user_id = $1", interaction.user.id)
+        osu_username = await self.bot.settings.get_osu_username(interaction.user.id)
+        if osu_username is None and username is None:
+            username = interaction.user.display_name
+        elif osu_username is not None and username is None:
+            username = osu_username
+
         try:
-            if user_query is None and username is None:
-                user = await self.bot.osu.fetch_user(interaction.user.display_name, key="username")
-            elif user_query is not None and username is None:
-                user = await self.bot.osu.fetch_user(user_query.get("osu_username"), key="username")
-            else:
-                user = await self.bot.osu.fetch_user(username, key="username")
+            # Waiting on a slow osu! shouldn't let the interaction expire
+            user, age = await utils.defer_if_slow(interaction, self.bot.osu_cache.fetch_user_cached(username, key="username"))
         except Exception as e:
-            return await interaction.response.send_message(f"{e}", ephemeral=True)
+            return await utils.respond(interaction, f"{e}", ephemeral=True)
 
+        await utils.respond(interaction, embed=mark_stale(info_embed(user), age, "osu user"), view=UserSelect.make_view(interaction.user.id, user))
 
-        ss_text = user.rank['ss']
-        ssh_text = user.rank['ssh']
-        s_text = user.rank['s']
-        sh_text = user.rank['sh']
-        a_text = user.rank['a']
-        profile_order = '\n ​ ​ ​ ​ ​ ​ ​ ​  - '.join(user.profile_order)
-        profile_order = profile_order.replace("_", " ")
+    @osu.command(description="Shows how this server's linked osu! players stack up")
+    @app_commands.describe(sort="What to rank players by")
+    @app_commands.guild_only()
+    async def leaderboard(self, itr: discord.Interaction, sort: Literal["pp", "rank", "accuracy", "play count"] = "pp"):
+        rows = await self.bot.stats_snapshots.leaderboard([member.id for member in itr.guild.members], sort)
+        if not rows:
+            return await itr.response.send_message("Nobody here has linked an osu! account yet (or their stats haven't been fetched), try ``/osu set user``!", ephemeral=True)
 
-        view = DropdownView(interaction.user.id,user)
+        lines = []
+        for place, row in enumerate(rows, start=1):
+            lines.append(f"``#{place}`` [{row['osu_username']}](https://osu.ppy.sh/users/{row['osu_id']}) • {leaderboard_value(row, sort)}")
 
-
-        embed = discord.Embed(description=f"**{user.country_emoji} | Profile for [{user.username}](https://osu.ppy.sh/users/{user.id})**\n\n▹ **Bancho Rank**: #{user.global_rank:,} ({user.country_code}#{user.country_rank:,})\n▹ **Join Date**: {user.joined_at}\n▹ **PP**: {int(user.pp):,} **Acc**: {user.accuracy}%\n▹ **Ranks**: ``SS {ss_text:,}`` | ``SSH {ssh_text:,}`` | ``S {s_text:,}`` | ``SH {sh_text:,}`` | ``A {a_text:,}``\n▹ **Profile Order**: \n** ​ ​ ​ ​ ​ ​ ​ ​  - {profile_order}**", color=0x2F3136)
-        embed.set_thumbnail(url=user.avatar_url)
-        await interaction.response.send_message(embed=embed, view=view)
+        embed = discord.Embed(title=f"{itr.guild.name} leaderboard ({sort})", description="\n".join(lines), color=0x2F3136)
+        embed.set_footer(text="Changes are since each player's previous snapshot")
+        await itr.response.send_message(embed=embed)
 
     @osu.command(description="Finds info on a beatmap")
-    @app_commands.describe(beatmap="Beatmap to get info on")
-    async def beatmap(self, itr: discord.Interaction, beatmap: str):
+    @app_commands.describe(beatmap="Beatmap to get info on", mods="Mods to calculate star rating and pp with, like HDDT", acc="Accuracy to calculate pp for")
+    async def beatmap(self, itr: discord.Interaction, beatmap: str, mods: Optional[str] = None, acc: Optional[app_commands.Range[float, 0.0, 100.0]] = None):
         matches = re.findall(r"\d+", beatmap)
         if not matches:
             return await itr.response.send_message("Could not find a beatmap with that url/id!\nMake sure to use the second id in the beatmap url (thats the beatmap id) and not the first one (thats the beatmapset id)", ephemeral=True)
@@ -162,51 +414,79 @@ class osu(commands.Cog):
             beatmapid = matches[0]
 
         try:
-            rbeatmap = await self.bot.osu.fetch_beatmap(beatmapid)
+            rbeatmap, age = await utils.defer_if_slow(itr, self.bot.osu_cache.fetch_beatmap_cached(beatmapid))
+        except utils.UpstreamUnavailable as e:
+            return await utils.respond(itr, f"{e}", ephemeral=True)
         except Exception as e:
-            return await  itr.response.send_message(f"{e}\nMake sure to use the second id in the beatmap url (thats the beatmap id) and not the first one (thats the beatmapset id)", ephemeral=True)
+            return await utils.respond(itr, f"{e}\nMake sure to use the second id in the beatmap url (thats the beatmap id) and not the first one (thats the beatmapset id)", ephemeral=True)
+
+        try:
+            mod_bits = utils.parse_mods(mods or "")
+        except utils.WrongType as e:
+            return await utils.respond(itr, f"{e}", ephemeral=True)
+
+        calculate = mods is not None or acc is not None
+        if calculate and not itr.response.is_done():
+            # Might have to download the .osu file, don't let the interaction expire
+            await itr.response.defer()
         
         ranked = discord.utils.format_dt(rbeatmap.ranked_date, style = "R") if rbeatmap.ranked_date else "Not ranked!"
         updated = discord.utils.format_dt(rbeatmap.last_updated, style = "R") if rbeatmap.last_updated else "Has not been updated"
         submitted = discord.utils.format_dt(rbeatmap.submitted_date, style = "R") if rbeatmap.submitted_date else "Not Submitted!"
-        creator = await self.bot.osu.fetch_user(rbeatmap.creator, key="username")
+        try:
+            creator = await utils.defer_if_slow(itr, self.bot.osu_cache.fetch_user(rbeatmap.creator, key="username"))
+            creator_text = f"[{creator.username}](https://osu.ppy.sh/users/{creator.id})"
+        except utils.NoUserFound:
+            # Mappers can rename or get restricted, the map still has the old name
+            creator_text = rbeatmap.creator
+        except utils.OsuBaseException as e:
+            return await utils.respond(itr, f"{e}", ephemeral=True)
 
 
         embed = discord.Embed(title=f"Info on {rbeatmap.title}", color=0x2F3136)
-        embed.add_field(name="Info", value=f"Creator of map: [{creator.username}](https://osu.ppy.sh/users/{creator.id})\nBeatmap ID: {rbeatmap.id}\nSong Artist: {rbeatmap.artist}\nStatus: {rbeatmap.status}\nFavorite count: {rbeatmap.favorite_count:,}\nPlayed count: {rbeatmap.play_count:,}\nMode: {rbeatmap.mode}")
+        embed.add_field(name="Info", value=f"Creator of map: {creator_text}\nBeatmap ID: {rbeatmap.id}\nSong Artist: {rbeatmap.artist}\nStatus: {rbeatmap.status}\nFavorite count: {rbeatmap.favorite_count:,}\nPlayed count: {rbeatmap.play_count:,}\nMode: {rbeatmap.mode}")
         embed.add_field(name="Gameplay", value=f"All info below was made for the ``{rbeatmap.difficulty} ({rbeatmap.difficulty_rating} stars)`` difficulty\nDrain: {rbeatmap.drain}\nAR: {rbeatmap.ar}\nCS: {rbeatmap.cs}\nBPM: {rbeatmap.bpm}\nMax Combo: {rbeatmap.max_combo:,}")
         embed.add_field(name="Dates", value=f"Ranked date: {ranked}\nSubmitted date: {submitted}\nLast updated: {updated}", inline=False)
         embed.add_field(name="Links", value=f"[Link to beatmap]({rbeatmap.url}) • [kitsu.moe](https://kitsu.moe/d/{rbeatmap.beatmapset_id})")
         embed.set_image(url=rbeatmap.covers("card@2x"))
+        mark_stale(embed, age, "osu beatmap")
 
-        await itr.response.send_message(embed=embed)
+        if calculate:
+            embed.insert_field_at(2, name=f"Performance (+{utils.mods_string(mod_bits)})", value=await self.performance_text(rbeatmap, mod_bits, acc), inline=False)
+        await utils.respond(itr, embed=embed)
+
+    async def performance_text(self, beatmap, mods: int, acc: Optional[float]) -> str:
+        if beatmap.mode != "osu":
+            return "Star rating and pp can only be calculated for osu!standard beatmaps"
+
+        try:
+            difficulty = await self.bot.difficulty.difficulty(beatmap.id, mods, checksum=beatmap.checksum)
+        except (utils.InvalidBeatmap, utils.UpstreamUnavailable) as e:
+            return f"{e}"
+
+        accuracies = [acc] if acc is not None else [95.0, 98.0, 99.0, 100.0]
+        results = [utils.calculate_performance(difficulty, accuracy=accuracy) for accuracy in accuracies]
+        lines = [f"{difficulty.stars:.2f} stars • AR {difficulty.ar:.1f} • OD {difficulty.od:.1f} • CS {difficulty.cs:.1f}"]
+        lines.extend(f"▹ {result.accuracy:.2f}% FC: **{result.pp:,.0f}pp**" for result in results)
+        return "\n".join(lines)
 
     @replay.command(description="Allows control on replay settings")
     @app_commands.describe(skin_id = "ID of a skin | https://ordr.issou.best/skins")
     async def config(self, itr: discord.Interaction, skin_id: int):
         try: 
-            async with self.bot.session.get("https://apis.issou.best/ordr/skins", params={"pageSize": 400, "page":1}) as resp:
-                skins = (await resp.json())['skins']
-                self.bot.logger.info((await resp.json())['maxSkins'])
-
-            query = """
-                INSERT INTO replay_config (skin_id, user_id) VALUES($1, $2)
-                ON CONFLICT(user_id) DO 
-                UPDATE SET skin_id = excluded.skin_id
-                RETURNING skin_id
-            """
-        
-            await self.bot.pool.execute(query, skin_id, itr.user.id)
-            skin_info = {skin['id']:{'preview': skin['highResPreview'], 'skin':skin['skin'], 'download': skin['url'], "author": skin['author']} for skin in skins}
-            try:
-                skin = skin_info[skin_id]
-            except KeyError:
+            if not await self.bot.skins.wait_until_loaded(timeout=2.5):
+                return await itr.response.send_message("Couldn't reach o!rdr to get the skin list, try again in a bit!", ephemeral=True)
+
+            skin = self.bot.skins.get(skin_id)
+            if skin is None:
                 return await itr.response.send_message("That skin is not accessable or for some reason the ordr api did not give us it, Sorry!", ephemeral=True)
 
-            embed = discord.Embed(title=f"Succesfully made replay skin to {skin['skin']}!")
-            embed.add_field(name='Download link', value=f"[Click here to download]({skin['download']})")
-            embed.add_field(name="Author", value=skin['author'])
-            embed.set_image(url=skin['preview'])
+            await self.bot.settings.set_skin(itr.user.id, skin_id)
+
+            embed = discord.Embed(title=f"Succesfully made replay skin to {skin.name}!")
+            embed.add_field(name='Download link', value=f"[Click here to download]({skin.download})")
+            embed.add_field(name="Author", value=skin.author)
+            embed.set_image(url=skin.preview)
 
             return await itr.response.send_message(embed=embed)
 
@@ -215,17 +495,10 @@ class osu(commands.Cog):
 
     @config.autocomplete('skin_id')
     async def id(self, itr: discord.Interaction, current: str):
-        if current in self.cached_skins:
-            return self.cached_skins[current] if current else self.cached_skins
-        async with self.bot.session.get("https://apis.issou.best/ordr/skins", params={"pageSize": 400, "page":1}) as resp:
-            skins = (await resp.json())['skins']
-
-        if not current:
-            return [app_commands.Choice(name=skin['skin'], value=skin['id']) for skin in skins[1:25]]
+        if not await self.bot.skins.wait_until_loaded(timeout=2.0):
+            return []
 
-        self.cached_skins[current] = [app_commands.Choice(name=skin['skin'], value=skin['id']) for skin in skins]
-
-        return [app_commands.Choice(name=skin['skin'], value=skin['id']) for skin in skins[:25] if skin['id'] == int(current)]
+        return [app_commands.Choice(name=f"{skin.name} ({skin.id})"[:100], value=skin.id) for skin in self.bot.skins.search(current)]
 
 
 
@@ -233,13 +506,7 @@ class osu(commands.Cog):
     async def user(self, interaction: discord.Interaction, username: str): 
         """Allows you to set your username""" 
         try:
-            query = """
-                INSERT INTO osu_user (osu_username, user_id) VALUES($1, $2)
-                ON CONFLICT(user_id) DO 
-                UPDATE SET osu_username = excluded.osu_username
-            """
-
-            await self.bot.pool.execute(query, username, interaction.user.id)
+            await self.bot.settings.set_osu_username(interaction.user.id, username)
 
             await interaction.response.send_message(f"Sucessfullly set your osu username to: {username}")
         except Exception as e:
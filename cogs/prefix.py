@@ -1,10 +1,13 @@
+import datetime
 import inspect
+import io
 import json
-from typing import Optional
+from typing import Literal, Optional
 import discord
 from discord.ext import commands
 from bot import Aswo
 from utils.subclasses import Context
+from utils.helpers import codeblock_maker
 
 
 class testinng(commands.Cog):
@@ -31,6 +34,61 @@ class testinng(commands.Cog):
         data = json.dumps(await self.bot.http.get_message(ctx.channel.id, msg.id), indent=4)
         await ctx.send(f"```json\n{data}```")
 
+    @commands.command()
+    @commands.is_owner()
+    async def clusters(self, ctx: Context):
+        if self.bot.ipc is None:
+            stats = {"0": self.bot.cluster_stats()}
+        else:
+            stats = self.bot.ipc.cluster_stats
+
+        lines = [
+            f"Cluster {cluster}: shards {data['shards']} | {data['guilds']:,} guilds | {data['users']:,} users | {'connecting' if data['latency'] is None else str(data['latency']) + 'ms'}"
+            for cluster, data in sorted(stats.items())
+        ]
+        total = sum(data['guilds'] for data in stats.values())
+        await ctx.send(codeblock_maker("\n".join(lines) + f"\n\nTotal guilds: {total:,}"))
+
+    @commands.command()
+    @commands.is_owner()
+    async def invalidate(self, ctx: Context, kind: Literal["user", "beatmap"], *, key: str):
+        await self.bot.invalidate(kind, int(key) if key.isdigit() else key)
+        await ctx.send(f"Dropped {kind} ``{key}`` from every cluster's cache")
+
+    @commands.command()
+    @commands.is_owner()
+    async def cachestats(self, ctx: Context):
+        stats = {
+            "osu": self.bot.osu_cache.stats,
+            "ratelimit": self.bot.osu.limiter.stats,
+            "tokens": self.bot.osu.tokens.stats,
+            "batching": {"users": self.bot.osu.user_loader.stats, "beatmaps": self.bot.osu.beatmap_loader.stats},
+            "settings": self.bot.settings.stats,
+            "tracker": self.bot.tracker.stats,
+            "difficulty": self.bot.difficulty.stats,
+            "upstreams": self.bot.upstreams.stats,
+            "analytics": self.bot.analytics.stats,
+        }
+        data = json.dumps(stats, indent=4)
+        if len(data) <= 1980:
+            return await ctx.send(f"```json\n{data}```")
+
+        # Way past the 2000 character limit with every upstream and cache in there
+        await ctx.send(file=discord.File(io.BytesIO(data.encode()), filename="cachestats.json"))
+
+    @commands.command()
+    @commands.is_owner()
+    async def analytics(self, ctx: Context, kind: Literal["top", "errors", "guilds", "upstreams"] = "top", days: int = 7):
+        rows = await self.bot.analytics.rollup(kind, since=datetime.timedelta(days=days))
+        if not rows:
+            return await ctx.send(f"No {kind} data in the last {days} days")
+
+        columns = list(rows[0].keys())
+        table = [columns] + [["-" if row[column] is None else str(row[column]) for column in columns] for row in rows]
+        widths = [max(len(line[index]) for line in table) for index in range(len(columns))]
+        lines = ["  ".join(value.ljust(width) for value, width in zip(line, widths)) for line in table]
+        await ctx.send(codeblock_maker("\n".join(lines)))
+
 
 async def setup(bot: Aswo):
     await bot.add_cog(testinng(bot))
\ No newline at end of file
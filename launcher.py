@@ -1,27 +1,150 @@
+import time
+# Taken before anything else is imported so the startup report includes imports
+STARTED = time.perf_counter()
+
 from bot import Aswo
 import asyncio
 import discord
 import aiohttp
 import config
-import osu
 import os
+import logging
+import multiprocessing
+import signal
+import typing
 import asyncpg
+import utils
+from utils import RateLimiter, IPCServer, Osu
+
+logger = logging.getLogger("launcher")
+
 
-discord.utils.setup_logging()
+async def run_bot(*, shard_ids: typing.Optional[typing.List[int]] = None, shard_count: typing.Optional[int] = None, cluster_id: typing.Optional[int] = None, ipc_port: typing.Optional[int] = None):
+    # OSU_RATE_LIMIT is for the whole bot, every cluster gets its share of it
+    clusters = getattr(config, "CLUSTER_COUNT", 1) if cluster_id is not None else 1
+    burst = getattr(config, "OSU_RATE_BURST", None)
+    osu_limiter = RateLimiter(
+        rate=getattr(config, "OSU_RATE_LIMIT", 60) / clusters,
+        per=60,
+        burst=max(burst // clusters, 1) if burst is not None else None
+    )
+    startup = utils.StartupTimer(STARTED)
+    startup.since("imports", STARTED)
+    with startup.phase("pool"):
+        pool = await asyncpg.create_pool(config.POSTGRES_URI, connection_class=utils.InstrumentedConnection)
 
-async def main():
-    async with (aiohttp.ClientSession() as session, asyncpg.create_pool(config.POSTGRES_URI) as pool, osu.Client(client_id=config.OSU_CLIENT_ID, client_secret=config.OSU_CLIENT_SECRET) as osu_client, Aswo(session=session, osu=osu_client,pool=pool ) as bot):
-        await bot.load_extension("jishaku")
+    trace_configs = [utils.http_trace_config()]
+    async with (aiohttp.ClientSession(trace_configs=trace_configs) as session, utils.Upstreams(getattr(config, "UPSTREAMS", None), trace_configs=trace_configs) as upstreams, pool, Osu(client_id=config.OSU_CLIENT_ID, client_secret=config.OSU_CLIENT_SECRET, session=upstreams.osu, limiter=osu_limiter, api_url=getattr(config, "OSU_API_URL", "https://osu.ppy.sh/api/v2"), token_url=getattr(config, "OSU_TOKEN_URL", "https://osu.ppy.sh/oauth/token")) as osu_client, Aswo(session=session, upstreams=upstreams, osu=osu_client,pool=pool, shard_ids=shard_ids, shard_count=shard_count, cluster_id=cluster_id, ipc_port=ipc_port, startup=startup) as bot):
+        utils.instrument_pool(pool)
         exts = [
             f"cogs.{ext[:-3] if ext.endswith('.py') else ext}"
             for ext in os.listdir("cogs")
             if not ext.startswith("_")
         ]
-        for ext in exts:
-            await bot.load_extension(ext)
+        with startup.phase("extensions"):
+            # Cogs don't depend on each other, so their cog_load()s can overlap
+            await asyncio.gather(*(startup.timed(f"extensions.{ext}", bot.load_extension(ext)) for ext in ["jishaku", *exts]))
+
+        # What bot.start() does, split so logging in (and setup_hook) is timed apart from the gateway
+        with startup.phase("login"):
+            await bot.login(config.TOKEN)
+        startup.begin("gateway")
+        await bot.connect(reconnect=True)
+
+
+def run_cluster(cluster_id: int, shard_ids: typing.List[int], shard_count: int, ipc_port: int):
+    """Entry point of a cluster process"""
+    discord.utils.setup_logging()
+    logger.info(f"Cluster {cluster_id} starting with shards {shard_ids[0]}-{shard_ids[-1]} of {shard_count}")
+    asyncio.run(run_bot(shard_ids=shard_ids, shard_count=shard_count, cluster_id=cluster_id, ipc_port=ipc_port))
+
+
+async def fetch_shard_count() -> int:
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {config.TOKEN}"}) as resp:
+            resp.raise_for_status()
+            return (await resp.json())['shards']
+
+
+def shard_ranges(shard_count: int, cluster_count: int) -> typing.List[typing.List[int]]:
+    """Splits shards into contiguous ranges, earlier clusters get the remainder"""
+    size, extra = divmod(shard_count, cluster_count)
+    ranges = []
+    start = 0
+    for cluster_id in range(cluster_count):
+        end = start + size + (1 if cluster_id < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+async def supervise(cluster_count: int):
+    shard_count = getattr(config, "SHARD_COUNT", None) or await fetch_shard_count()
+    cluster_count = min(cluster_count, shard_count)
+    ranges = shard_ranges(shard_count, cluster_count)
+
+    ipc = IPCServer()
+    ipc_port = await ipc.start()
+    context = multiprocessing.get_context("spawn")
+    processes: typing.Dict[int, multiprocessing.Process] = {}
+    started_at: typing.Dict[int, float] = {}
+    failures: typing.Dict[int, int] = {cluster_id: 0 for cluster_id in range(cluster_count)}
+    restart_at: typing.Dict[int, float] = {cluster_id: 0.0 for cluster_id in range(cluster_count)}
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    logger.info(f"Running {shard_count} shards over {cluster_count} clusters")
+    try:
+        while not stopping.is_set():
+            now = time.monotonic()
+            for cluster_id, shard_ids in enumerate(ranges):
+                process = processes.get(cluster_id)
+                if process is not None and process.is_alive():
+                    # Counts as stable after 5 minutes, forget old crashes
+                    if now - started_at[cluster_id] > 300:
+                        failures[cluster_id] = 0
+                    continue
+
+                if process is not None:
+                    failures[cluster_id] += 1
+                    delay = min(2 ** failures[cluster_id], 60)
+                    restart_at[cluster_id] = now + delay
+                    logger.warning(f"Cluster {cluster_id} exited with code {process.exitcode}, restarting in {delay} seconds")
+                    processes.pop(cluster_id)
+                    continue
+
+                if now < restart_at[cluster_id]:
+                    continue
+
+                process = context.Process(target=run_cluster, args=(cluster_id, shard_ids, shard_count, ipc_port), name=f"aswo-cluster-{cluster_id}")
+                process.start()
+                processes[cluster_id] = process
+                started_at[cluster_id] = now
+
+            try:
+                await asyncio.wait_for(stopping.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        logger.info("Stopping all clusters")
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=30)
+        await ipc.close()
+
 
-        await bot.start(config.TOKEN, reconnect=True)
+def main():
+    discord.utils.setup_logging()
+    cluster_count = getattr(config, "CLUSTER_COUNT", 1)
+    if cluster_count > 1:
+        asyncio.run(supervise(cluster_count))
+    else:
+        asyncio.run(run_bot(shard_count=getattr(config, "SHARD_COUNT", None)))
 
-    
 
-asyncio.run(main())
\ No newline at end of file
+if __name__ == "__main__":
+    main()
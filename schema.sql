@@ -14,3 +14,116 @@ CREATE TABLE replay_config (
    	user_id BIGINT PRIMARY KEY,
     skin_id INT
 );
+
+-- Lets every running process keep its prefix/settings caches in sync (see utils/notify.py)
+CREATE OR REPLACE FUNCTION notify_cache_change() RETURNS trigger AS $$
+DECLARE
+    changed RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+
+    PERFORM pg_notify('aswo_cache', json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'row', row_to_json(changed))::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER prefix_cache_notify AFTER INSERT OR UPDATE OR DELETE ON prefix
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change();
+
+CREATE TRIGGER osu_user_cache_notify AFTER INSERT OR UPDATE OR DELETE ON osu_user
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change();
+
+CREATE TRIGGER replay_config_cache_notify AFTER INSERT OR UPDATE OR DELETE ON replay_config
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change();
+
+CREATE TABLE replay_renders (
+    replay_hash BYTEA,
+    skin_id INT,
+    render_id INT,
+    video_url TEXT,
+    created_at TIMESTAMP DEFAULT (now() at time zone 'utc'),
+    PRIMARY KEY (replay_hash, skin_id)
+);
+
+CREATE TABLE render_jobs (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    guild_id BIGINT,
+    channel_id BIGINT NOT NULL,
+    message_id BIGINT,
+    replay_url TEXT NOT NULL,
+    skin_id INT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    replay_hash BYTEA,
+    render_id INT,
+    leased_until TIMESTAMP,
+    created_at TIMESTAMP DEFAULT (now() at time zone 'utc'),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX render_jobs_pending_idx ON render_jobs (id) WHERE status IN ('queued', 'rendering');
+CREATE INDEX render_jobs_user_idx ON render_jobs (user_id) WHERE status = 'rendering';
+CREATE INDEX render_jobs_guild_idx ON render_jobs (guild_id) WHERE status = 'rendering';
+CREATE INDEX render_jobs_finished_idx ON render_jobs (finished_at) WHERE status = 'done';
+
+CREATE TABLE osu_stats (
+    user_id BIGINT PRIMARY KEY,
+    osu_username TEXT,
+    osu_id BIGINT,
+    pp REAL,
+    global_rank INT,
+    accuracy REAL,
+    play_count INT,
+    prev_pp REAL,
+    prev_global_rank INT,
+    prev_accuracy REAL,
+    prev_play_count INT,
+    updated_at TIMESTAMP,
+    previous_at TIMESTAMP,
+    claimed_until TIMESTAMP
+);
+
+CREATE INDEX osu_stats_updated_idx ON osu_stats (updated_at NULLS FIRST);
+
+CREATE TABLE score_subscriptions (
+    channel_id BIGINT,
+    guild_id BIGINT,
+    osu_id BIGINT,
+    osu_username TEXT,
+    kind TEXT NOT NULL DEFAULT 'recent',
+    created_at TIMESTAMP DEFAULT (now() at time zone 'utc'),
+    PRIMARY KEY (channel_id, osu_id)
+);
+
+CREATE INDEX score_subscriptions_osu_idx ON score_subscriptions (osu_id);
+
+CREATE TRIGGER score_subscriptions_cache_notify AFTER INSERT OR UPDATE OR DELETE ON score_subscriptions
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_change();
+
+CREATE TABLE seen_scores (
+    score_id BIGINT PRIMARY KEY,
+    osu_id BIGINT,
+    seen_at TIMESTAMP DEFAULT (now() at time zone 'utc')
+);
+
+CREATE INDEX seen_scores_seen_idx ON seen_scores (seen_at);
+
+CREATE TABLE command_events (
+    created_at TIMESTAMP NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    guild_id BIGINT,
+    channel_id BIGINT,
+    user_id BIGINT,
+    latency_ms REAL,
+    error TEXT,
+    upstreams TEXT[]
+);
+
+-- Append only and always read by time range, a BRIN index is a fraction of a btree's size
+CREATE INDEX command_events_created_idx ON command_events USING BRIN (created_at);
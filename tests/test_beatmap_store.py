@@ -0,0 +1,121 @@
+"""BeatmapStore against the beatmap mirror stand-in from the benchmarks"""
+import asyncio
+import hashlib
+import os
+import time
+import aiohttp
+import pytest
+from benchmarks.standins import BEATMAP_FILES, StandIns
+from utils import BeatmapStore, InvalidBeatmap
+
+
+def checksum_of(beatmap_id: int) -> str:
+    return hashlib.md5(BEATMAP_FILES[beatmap_id % len(BEATMAP_FILES)]).hexdigest()
+
+
+def run(test, root, **kwargs):
+    """Runs ``test(store, standins)`` with a store in ``root`` that downloads from the stand-in mirror"""
+    async def main():
+        standins = StandIns(latency=0)
+        await standins.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                store = BeatmapStore(session, str(root), mirror_url=f"{standins.url}/osu/{{}}", **kwargs)
+                return await test(store, standins)
+        finally:
+            await standins.close()
+
+    return asyncio.run(main())
+
+
+def mirror_calls(standins: StandIns) -> int:
+    return sum(count for route, count in standins.calls.items() if "/osu/" in route)
+
+
+def test_miss_then_hit(tmp_path):
+    async def test(store, standins):
+        with await store.fetch(0, checksum_of(0)) as data:
+            assert data[:] == BEATMAP_FILES[0]
+        assert (store.misses, store.hits, store.downloads) == (1, 0, 1)
+        assert os.path.exists(store.path(checksum_of(0)))
+
+        # Known by checksum, and by id from the download
+        with await store.fetch(0, checksum_of(0)) as data:
+            assert data[:] == BEATMAP_FILES[0]
+        with await store.fetch(0) as data:
+            assert data[:] == BEATMAP_FILES[0]
+        assert (store.misses, store.hits) == (1, 2)
+        assert mirror_calls(standins) == 1
+
+    run(test, tmp_path)
+
+
+def test_checksum_mismatch_is_rejected(tmp_path):
+    async def test(store, standins):
+        with pytest.raises(InvalidBeatmap):
+            await store.fetch(0, checksum_of(1))
+        # Neither stored nor remembered for the id
+        assert store.stats["files"] == 0
+        assert not os.path.exists(store.path(checksum_of(0)))
+        assert not os.path.exists(store.path(checksum_of(1)))
+
+        with await store.fetch(0) as data:
+            assert data[:] == BEATMAP_FILES[0]
+
+    run(test, tmp_path)
+
+
+def test_eviction_by_bytes(tmp_path):
+    sizes = [len(data) for data in BEATMAP_FILES]
+
+    async def test(store, standins):
+        for beatmap_id in range(3):
+            (await store.fetch(beatmap_id)).close()
+
+        # Only the newest two fit, the oldest goes first
+        assert store.evictions == 1
+        assert checksum_of(0) not in store
+        assert checksum_of(1) in store and checksum_of(2) in store
+        assert store.size == sizes[1] + sizes[2] <= store.max_bytes
+        assert not os.path.exists(store.path(checksum_of(0)))
+
+        # Reading 1 makes 2 the least recently used
+        (await store.fetch(1, checksum_of(1))).close()
+        (await store.fetch(0, checksum_of(0))).close()
+        assert checksum_of(2) not in store
+        assert checksum_of(0) in store and checksum_of(1) in store
+
+    run(test, tmp_path, max_bytes=sizes[1] + sizes[2])
+
+
+def test_restart_reindexes_disk(tmp_path):
+    async def fill(store, standins):
+        for beatmap_id in range(3):
+            (await store.fetch(beatmap_id)).close()
+        return store.size
+
+    size = run(fill, tmp_path)
+
+    # A write that died long ago, and one another cluster is still doing
+    directory = os.path.dirname(BeatmapStore(None, str(tmp_path)).path(checksum_of(0)))
+    abandoned = os.path.join(directory, "abandoned.tmp")
+    in_progress = os.path.join(directory, "in_progress.tmp")
+    for path in (abandoned, in_progress):
+        with open(path, "wb") as f:
+            f.write(b"osu file format v14")
+    old = time.time() - 7200
+    os.utime(abandoned, (old, old))
+
+    async def restart(store, standins):
+        await store.load()
+        assert store.stats["files"] == 3
+        assert store.size == size
+        for beatmap_id in range(3):
+            with await store.fetch(beatmap_id, checksum_of(beatmap_id)) as data:
+                assert data[:] == BEATMAP_FILES[beatmap_id]
+        assert store.hits == 3
+        assert mirror_calls(standins) == 0
+
+    run(restart, tmp_path)
+    assert not os.path.exists(abandoned)
+    assert os.path.exists(in_progress)
@@ -2,4 +2,26 @@ from .subclasses import *
 from .default import *
 from .osu_errors import *
 from .constants import *
-from .helpers import *
\ No newline at end of file
+from .helpers import *
+from .ordr import *
+from .skins import *
+from .cache import *
+from .singleflight import *
+from .ratelimit import *
+from .settings import *
+from .notify import *
+from .replays import *
+from .osr import *
+from .render_queue import *
+from .ipc import *
+from .old_osu import *
+from .batcher import *
+from .leaderboard import *
+from .tracker import *
+from .difficulty import *
+from .beatmap_store import *
+from .metrics import *
+from .startup import *
+from .upstream import *
+from .analytics import *
+from .governor import *
\ No newline at end of file
@@ -0,0 +1,176 @@
+from __future__ import annotations
+import asyncio
+import collections
+import contextvars
+import datetime
+import logging
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+import asyncpg
+
+__all__ = (
+    "AnalyticsRecorder",
+    "track_upstream_calls",
+    "note_upstream_call",
+)
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("created_at", "kind", "name", "guild_id", "channel_id", "user_id", "latency_ms", "error", "upstreams")
+
+# (time.time(), kind, name, guild_id, channel_id, user_id, latency in seconds, error, upstream names)
+Event = Tuple[float, str, str, Optional[int], Optional[int], Optional[int], Optional[float], Optional[str], Optional[List[str]]]
+
+# Upstream names called while handling the current command, set per task when a command starts
+_upstream_calls: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("upstream_calls", default=None)
+
+
+def track_upstream_calls() -> List[str]:
+    """Starts collecting the upstreams the current task calls, returns the list they're added to"""
+    calls: List[str] = []
+    _upstream_calls.set(calls)
+    return calls
+
+
+def note_upstream_call(name: str):
+    calls = _upstream_calls.get()
+    if calls is not None:
+        calls.append(name)
+
+
+ROLLUPS = {
+    "top": """
+        SELECT name, kind, count(*) AS uses, count(DISTINCT user_id) AS users, count(DISTINCT guild_id) AS guilds
+        FROM command_events WHERE created_at > (now() at time zone 'utc') - $1::interval
+        GROUP BY name, kind ORDER BY uses DESC LIMIT $2
+    """,
+    "errors": """
+        SELECT name, count(*) AS uses, count(error) AS errors,
+            round(count(error) * 100.0 / count(*), 2) AS error_pct,
+            mode() WITHIN GROUP (ORDER BY error) AS top_error
+        FROM command_events WHERE created_at > (now() at time zone 'utc') - $1::interval
+        GROUP BY name HAVING count(error) > 0 ORDER BY errors DESC LIMIT $2
+    """,
+    "guilds": """
+        SELECT guild_id, count(*) AS uses,
+            round(percentile_cont(0.5) WITHIN GROUP (ORDER BY latency_ms)::numeric, 1) AS p50_ms,
+            round(percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms)::numeric, 1) AS p95_ms,
+            round(avg(coalesce(cardinality(upstreams), 0)), 2) AS upstream_calls
+        FROM command_events WHERE created_at > (now() at time zone 'utc') - $1::interval AND guild_id IS NOT NULL
+        GROUP BY guild_id ORDER BY uses DESC LIMIT $2
+    """,
+    "upstreams": """
+        SELECT upstream, name, count(*) AS calls
+        FROM command_events, unnest(upstreams) AS upstream
+        WHERE created_at > (now() at time zone 'utc') - $1::interval
+        GROUP BY upstream, name ORDER BY calls DESC LIMIT $2
+    """,
+}
+
+
+class AnalyticsRecorder:
+    """Buffers command usage in memory and writes it to command_events in batches with COPY
+
+    Recording is a single append, when the buffer is full the oldest events are dropped.
+    """
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        *,
+        max_events: int = 10_000,
+        interval: float = 10.0,
+        retention: datetime.timedelta = datetime.timedelta(days=30)
+    ):
+        self.pool = pool
+        self.interval = interval
+        self.retention = retention
+        self._events: Deque[Event] = collections.deque(maxlen=max_events)
+        self._tasks: List[asyncio.Task] = []
+        self._flush_lock = asyncio.Lock()
+        self.recorded = 0
+        self.flushed = 0
+        self.failed = 0
+
+    @property
+    def dropped(self) -> int:
+        # Everything recorded is either written, waiting, lost to a failed COPY or pushed out of the deque
+        return self.recorded - self.flushed - self.failed - len(self._events)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "buffered": len(self._events),
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+    def record(
+        self,
+        kind: str,
+        name: str,
+        *,
+        guild_id: Optional[int] = None,
+        channel_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+        latency: Optional[float] = None,
+        error: Optional[str] = None,
+        upstreams: Optional[List[str]] = None
+    ):
+        self.recorded += 1
+        self._events.append((time.time(), kind, name, guild_id, channel_id, user_id, latency, error, upstreams))
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._prune())]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Whatever is left would be lost otherwise
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._events:
+                return 0
+
+            events = list(self._events)
+            self._events.clear()
+            records = [
+                (datetime.datetime.fromtimestamp(created, datetime.timezone.utc).replace(tzinfo=None), kind, name, guild_id, channel_id, user_id, latency * 1000 if latency is not None else None, error, upstreams)
+                for created, kind, name, guild_id, channel_id, user_id, latency, error, upstreams in events
+            ]
+            try:
+                async with self.pool.acquire() as conn:
+                    await conn.copy_records_to_table("command_events", records=records, columns=COLUMNS)
+            except (asyncpg.PostgresError, OSError) as e:
+                # Losing a batch of analytics beats piling them up while the database is down
+                self.failed += len(records)
+                logger.warning(f"Could not write {len(records)} analytics events: {e!r}")
+                return 0
+
+            self.flushed += len(records)
+            return len(records)
+
+    async def _prune(self):
+        while True:
+            try:
+                await self.pool.execute("DELETE FROM command_events WHERE created_at < (now() at time zone 'utc') - $1::interval", self.retention)
+            except (asyncpg.PostgresError, OSError) as e:
+                logger.warning(f"Could not prune analytics events: {e!r}")
+            await asyncio.sleep(3600)
+
+    async def rollup(self, kind: str, *, since: datetime.timedelta = datetime.timedelta(days=7), limit: int = 15) -> List[asyncpg.Record]:
+        """``kind`` is one of top, errors, guilds or upstreams"""
+        # Include what's still buffered
+        await self.flush()
+        return await self.pool.fetch(ROLLUPS[kind], since, limit)
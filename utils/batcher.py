@@ -0,0 +1,88 @@
+from __future__ import annotations
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Iterable, List, Optional, TypeVar
+
+__all__ = (
+    "Batcher",
+)
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class Batcher(Generic[K, V]):
+    """Dataloader style batching, loads asked for within ``window`` seconds go out as one bulk call.
+
+    ``load_many`` gets up to ``max_batch`` unique keys and returns a dict of the
+    ones it found, keys it didn't return resolve to None.
+    """
+    def __init__(self, load_many: Callable[[List[K]], Awaitable[Dict[K, V]]], *, max_batch: int = 50, window: float = 0.005):
+        self.load_many_func = load_many
+        self.max_batch = max_batch
+        self.window = window
+        self._pending: Dict[K, asyncio.Future] = {}
+        # Keys already sent out, so asking again before the batch returns doesn't load them twice
+        self._in_flight: Dict[K, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        self.batches = 0
+        self.loads = 0
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "loads": self.loads,
+            "avg_batch": round(self.loads / self.batches, 2) if self.batches else 0.0,
+        }
+
+    async def load(self, key: K) -> Optional[V]:
+        future = self._pending.get(key) or self._in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.window, self._dispatch)
+
+        # Shielded so one caller giving up doesn't fail everyone else waiting on the same key
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable[K]) -> List[Optional[V]]:
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, {}
+        if batch:
+            self._in_flight.update(batch)
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: Dict[K, asyncio.Future]):
+        self.batches += 1
+        self.loads += len(batch)
+        try:
+            results = await self.load_many_func(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # Nobody might be left to look at it
+                    future.exception()
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(results.get(key))
+        finally:
+            for key, future in batch.items():
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
@@ -0,0 +1,227 @@
+from __future__ import annotations
+import asyncio
+import collections
+import contextlib
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import time
+from typing import Dict, Iterable, Optional, OrderedDict, Tuple
+import aiohttp
+from .osu_errors import InvalidBeatmap
+from .singleflight import SingleFlight
+from .upstream import HTTPSession
+
+__all__ = (
+    "BeatmapStore",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BeatmapStore:
+    """.osu files on disk, named by their MD5 checksum (what the API and .osr headers refer to)
+
+    Files live in ``root/ab/cd/abcd....osu``, are written atomically and evicted least recently
+    used first once the store goes over ``max_bytes``. Reads are memory-mapped.
+    """
+    def __init__(
+        self,
+        session: HTTPSession,
+        root: str = "data/beatmaps",
+        *,
+        max_bytes: int = 2 * 1024 ** 3,
+        mirror_url: str = "https://osu.ppy.sh/osu/{}",
+        concurrency: int = 4,
+        temp_grace: float = 3600.0
+    ):
+        self.session = session
+        self.root = root
+        self.max_bytes = max_bytes
+        self.mirror_url = mirror_url
+        # Every cluster shares the directory, a younger .tmp can be another cluster's write in progress
+        self.temp_grace = temp_grace
+        self.flights = SingleFlight()
+        self._downloads = asyncio.Semaphore(concurrency)
+        # checksum -> size, oldest access first
+        self._files: OrderedDict[str, int] = collections.OrderedDict()
+        # beatmap id -> checksum of the last file we saw for it
+        self._ids: Dict[int, str] = {}
+        self._loaded: Optional[asyncio.Task] = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.evictions = 0
+
+    def __contains__(self, checksum: str) -> bool:
+        return checksum in self._files
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "files": len(self._files),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "downloads": self.downloads,
+            "evictions": self.evictions,
+        }
+
+    def path(self, checksum: str) -> str:
+        return os.path.join(self.root, checksum[:2], checksum[2:4], f"{checksum}.osu")
+
+    async def load(self):
+        """Indexes what's already on disk, safe to call more than once"""
+        if self._loaded is None:
+            self._loaded = asyncio.create_task(asyncio.to_thread(self._scan))
+        await asyncio.shield(self._loaded)
+
+    def _scan(self):
+        found = []
+        now = time.time()
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                # Other clusters evict and replace files while we walk
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                if not name.endswith(".osu"):
+                    # Left over from a write that died before os.replace
+                    if name.endswith(".tmp") and now - stat.st_mtime > self.temp_grace:
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(path)
+                    continue
+
+                found.append((stat.st_mtime, name[:-4], stat.st_size))
+
+        for _, checksum, size in sorted(found):
+            self._files[checksum] = size
+            self.size += size
+        logger.info(f"Beatmap store has {len(self._files):,} files ({self.size / 1024 ** 2:.1f} MiB)")
+        self._evict()
+
+    def open(self, checksum: str) -> Optional[mmap.mmap]:
+        """Memory-maps a stored file, the caller closes it. Returns None if we don't have it"""
+        if checksum not in self._files:
+            return None
+
+        try:
+            with open(self.path(checksum), "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # Deleted behind our back, or empty
+            self.size -= self._files.pop(checksum)
+            return None
+
+        self._files.move_to_end(checksum)
+        return data
+
+    async def fetch(self, beatmap_id: int, checksum: Optional[str] = None) -> mmap.mmap:
+        """Returns the .osu file for a beatmap, downloading it from the mirror if it isn't stored"""
+        await self.load()
+        checksum = checksum or self._ids.get(beatmap_id)
+        data = self.open(checksum) if checksum else None
+        if data is not None:
+            self.hits += 1
+            self._touch(checksum)
+            return data
+
+        self.misses += 1
+        checksum = await self.flights.do(("beatmap", beatmap_id), lambda: self._download(beatmap_id, checksum))
+        data = self.open(checksum)
+        if data is None:
+            raise InvalidBeatmap(f"Beatmap {beatmap_id} was evicted before it could be read")
+        return data
+
+    async def prefetch(self, beatmaps: Iterable[Tuple[int, Optional[str]]]) -> int:
+        """Downloads every ``(beatmap_id, checksum)`` we don't have yet, returns how many were fetched"""
+        await self.load()
+        missing = {
+            beatmap_id: checksum
+            for beatmap_id, checksum in beatmaps
+            if (checksum or self._ids.get(beatmap_id)) not in self._files
+        }
+        if not missing:
+            return 0
+
+        results = await asyncio.gather(
+            *(self.flights.do(("beatmap", beatmap_id), lambda beatmap_id=beatmap_id, checksum=checksum: self._download(beatmap_id, checksum)) for beatmap_id, checksum in missing.items()),
+            return_exceptions=True
+        )
+        for beatmap_id, result in zip(missing, results):
+            if isinstance(result, BaseException):
+                logger.info(f"Could not prefetch beatmap {beatmap_id}: {result!r}")
+        return sum(1 for result in results if not isinstance(result, BaseException))
+
+    async def _download(self, beatmap_id: int, expected: Optional[str]) -> str:
+        async with self._downloads:
+            try:
+                async with self.session.get(self.mirror_url.format(beatmap_id)) as resp:
+                    if resp.status != 200:
+                        raise InvalidBeatmap(f"Couldn't download the .osu file for beatmap {beatmap_id} (status {resp.status})")
+                    data = await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Only the headers are retried, the body can still time out or get cut off
+                raise InvalidBeatmap(f"Couldn't download the .osu file for beatmap {beatmap_id}") from e
+
+        if not data:
+            raise InvalidBeatmap(f"osu! has no .osu file for beatmap {beatmap_id}")
+
+        checksum = hashlib.md5(data).hexdigest()
+        if expected is not None and checksum != expected:
+            # The map got updated since the caller looked it up (or the mirror is serving junk),
+            # stars and pp from this file would be for a different version than the one they asked about
+            raise InvalidBeatmap(f"Beatmap {beatmap_id} was updated since it was looked up, try again in a bit")
+
+        await asyncio.to_thread(self._write, checksum, data)
+        if checksum in self._files:
+            self.size -= self._files[checksum]
+        self._files[checksum] = len(data)
+        self._files.move_to_end(checksum)
+        self.size += len(data)
+        self.downloads += 1
+        self._ids[beatmap_id] = checksum
+        self._evict()
+        return checksum
+
+    def _write(self, checksum: str, data: bytes):
+        path = self.path(checksum)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Written next to the target and swapped in, so readers never see a partial file
+        fd, temp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp, path)
+        except BaseException:
+            # A scan can already have cleaned it up
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp)
+            raise
+
+    def _touch(self, checksum: str):
+        # The mtime is the LRU order after a restart, only bother updating it once an hour
+        path = self.path(checksum)
+        try:
+            if time.time() - os.stat(path).st_mtime > 3600:
+                os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._files) > 1:
+            checksum, size = self._files.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            try:
+                # Open mmaps stay valid after the unlink
+                os.remove(self.path(checksum))
+            except FileNotFoundError:
+                pass
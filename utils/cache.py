@@ -0,0 +1,287 @@
+from __future__ import annotations
+import asyncio
+import logging
+import sys
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Iterable, Optional, Set, Tuple, TypeVar, Union
+from .osu_errors import NoBeatMapFound, NoUserFound, UpstreamUnavailable
+from .ratelimit import Priority, RateLimiter, priority
+from .singleflight import SingleFlight
+
+__all__ = (
+    "TTLCache",
+    "OsuCache",
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def approximate_size(value: Any) -> int:
+    """Shallow size of an object plus its attributes, good enough to budget a cache with"""
+    size = sys.getsizeof(value)
+    attrs = getattr(value, "__dict__", None)
+    if attrs is not None:
+        size += sys.getsizeof(attrs) + sum(sys.getsizeof(v) for v in attrs.values())
+    for slot in getattr(type(value), "__slots__", ()):
+        size += sys.getsizeof(getattr(value, slot, None))
+    return size
+
+
+class _Entry(Generic[T]):
+    __slots__ = (
+        "value",
+        "expires_at",
+        "size",
+        "aliases"
+    )
+    def __init__(self, value: T, expires_at: float, size: int, aliases: Tuple[Hashable, ...]):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.aliases = aliases
+
+
+class TTLCache(Generic[T]):
+    """LRU cache bounded by entry count and approximate size, where expired entries are kept around as stale"""
+    def __init__(
+        self,
+        *,
+        ttl: float,
+        max_entries: int,
+        max_size: Optional[int] = None,
+        sizeof: Callable[[Any], int] = approximate_size
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self._entries: OrderedDict[Hashable, _Entry[T]] = OrderedDict()
+        self._aliases: Dict[Hashable, Hashable] = {}
+        self.size = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._aliases.get(key, key) in self._entries
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def get(self, key: Hashable) -> Tuple[Optional[T], bool]:
+        """Returns ``(value, fresh)``, value is None on a miss"""
+        key = self._aliases.get(key, key)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, False
+
+        self._entries.move_to_end(key)
+        if entry.expires_at > asyncio.get_running_loop().time():
+            self.hits += 1
+            return entry.value, True
+
+        self.stale_hits += 1
+        return entry.value, False
+
+    def age(self, key: Hashable) -> Optional[float]:
+        """Seconds since ``key`` was set, None if it isn't cached"""
+        entry = self._entries.get(self._aliases.get(key, key))
+        if entry is None:
+            return None
+        return asyncio.get_running_loop().time() - (entry.expires_at - self.ttl)
+
+    def set(self, key: Hashable, value: T, *, aliases: Iterable[Hashable] = ()):
+        self.pop(key)
+        aliases = tuple(alias for alias in aliases if alias != key)
+        # An alias can move to another entity, e.g. a username that changed owner
+        for alias in aliases:
+            self._aliases[alias] = key
+
+        entry = _Entry(value, asyncio.get_running_loop().time() + self.ttl, self.sizeof(value), aliases)
+        self._entries[key] = entry
+        self.size += entry.size
+        self._evict()
+
+    def pop(self, key: Hashable) -> Optional[T]:
+        key = self._aliases.get(key, key)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+
+        self.size -= entry.size
+        for alias in entry.aliases:
+            if self._aliases.get(alias) == key:
+                del self._aliases[alias]
+        return entry.value
+
+    def clear(self):
+        self._entries.clear()
+        self._aliases.clear()
+        self.size = 0
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_size is not None and self.size > self.max_size)
+        ):
+            key = next(iter(self._entries))
+            self.pop(key)
+            self.evictions += 1
+
+
+class OsuCache:
+    """Sits in front of the osu client and caches users and beatmaps
+
+    Entries up to ``stale_for`` seconds past their TTL are served while they refresh in the background.
+    Older ones are fetched again, and only served if osu! is down or shedding requests.
+    """
+    def __init__(
+        self,
+        client: Any,
+        *,
+        limiter: Optional[RateLimiter] = None,
+        user_ttl: float = 300.0,
+        beatmap_ttl: float = 3600.0,
+        max_entries: int = 10_000,
+        max_size: int = 64 * 1024 * 1024,
+        stale_for: float = 600.0
+    ):
+        self.client = client
+        self.limiter = limiter
+        self.stale_for = stale_for
+        self.users: TTLCache = TTLCache(ttl=user_ttl, max_entries=max_entries, max_size=max_size // 2)
+        self.beatmaps: TTLCache = TTLCache(ttl=beatmap_ttl, max_entries=max_entries, max_size=max_size // 2)
+        self.flights = SingleFlight()
+        self._refreshing: Set[Hashable] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        stats = {"users": self.users.stats, "beatmaps": self.beatmaps.stats, "coalescing": self.flights.stats}
+        if self.limiter is not None:
+            stats["ratelimit"] = self.limiter.stats
+        return stats
+
+    @staticmethod
+    def _user_key(user: Union[str, int], key: str) -> Hashable:
+        if key == "id":
+            return int(user)
+        return ("username", str(user).lower())
+
+    async def fetch_user(self, user: Union[str, int], *, key: str = "username") -> Any:
+        return (await self.fetch_user_cached(user, key=key))[0]
+
+    async def fetch_compact_user(self, user: int) -> Any:
+        """Looks a user up through the bulk endpoint, batched with every other id looked up around the same time.
+
+        These are compact users without profile only fields like join date, so they're kept apart from full profiles.
+        """
+        cache_key = ("compact", int(user))
+        # A full profile has everything a compact one does
+        value, fresh = self.users.get(int(user))
+        if fresh:
+            return value
+
+        async def fetch():
+            fetched = await self.client.load_user(int(user))
+            if fetched is None:
+                raise NoUserFound("No user was found by that id!")
+            self.users.set(cache_key, fetched)
+            return fetched
+
+        def load():
+            return self.flights.do(("user", cache_key), fetch)
+
+        return (await self._get(self.users, cache_key, load))[0]
+
+    async def fetch_user_cached(self, user: Union[str, int], *, key: str = "username") -> Tuple[Any, Optional[float]]:
+        """Like ``fetch_user`` but also returns how old the user is in seconds if osu! couldn't be reached and an old copy was served, otherwise None"""
+        cache_key = self._user_key(user, key)
+
+        async def fetch():
+            await self._acquire()
+            fetched = await self.client.fetch_user(user, key=key)
+            self.users.set(fetched.id, fetched, aliases=(cache_key, ("username", fetched.username.lower())))
+            return fetched
+
+        def load():
+            return self.flights.do(("user", cache_key), fetch)
+
+        return await self._get(self.users, cache_key, load)
+
+    async def fetch_beatmap(self, beatmap: Union[str, int]) -> Any:
+        return (await self.fetch_beatmap_cached(beatmap))[0]
+
+    async def fetch_beatmap_cached(self, beatmap: Union[str, int]) -> Tuple[Any, Optional[float]]:
+        """Like ``fetch_beatmap`` but also returns how old the beatmap is in seconds if osu! couldn't be reached and an old copy was served, otherwise None"""
+        cache_key = int(beatmap)
+
+        async def fetch():
+            fetched = await self.client.load_beatmap(cache_key)
+            if fetched is None:
+                raise NoBeatMapFound("No beatmap was found by that ID!")
+            self.beatmaps.set(cache_key, fetched)
+            return fetched
+
+        def load():
+            return self.flights.do(("beatmap", cache_key), fetch)
+
+        return await self._get(self.beatmaps, cache_key, load)
+
+    async def _acquire(self):
+        if self.limiter is not None:
+            await self.limiter.acquire()
+
+    def invalidate_user(self, user: Union[str, int], *, key: str = "username"):
+        self.users.pop(self._user_key(user, key))
+        if key == "id":
+            self.users.pop(("compact", int(user)))
+
+    def invalidate_beatmap(self, beatmap: Union[str, int]):
+        self.beatmaps.pop(int(beatmap))
+
+    async def _get(self, cache: TTLCache, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Tuple[Any, Optional[float]]:
+        value, fresh = cache.get(key)
+        if value is None:
+            return await load(), None
+        if fresh:
+            return value, None
+
+        age = cache.age(key)
+        if age is not None and age < cache.ttl + self.stale_for:
+            if (cache, key) not in self._refreshing:
+                self._refreshing.add((cache, key))
+                task = asyncio.create_task(self._refresh(cache, key, load))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return value, None
+
+        try:
+            return await load(), None
+        except UpstreamUnavailable:
+            # Too old to pass off as current, but better than no answer while osu! is struggling
+            return value, age
+
+    async def _refresh(self, cache: TTLCache, key: Hashable, load: Callable[[], Awaitable[Any]]):
+        try:
+            with priority(Priority.LOW):
+                await load()
+        except Exception as e:
+            logger.warning(f"Background refresh of {key!r} failed: {e!r}")
+        finally:
+            self._refreshing.discard((cache, key))
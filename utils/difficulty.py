@@ -0,0 +1,543 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import logging
+import math
+import mmap
+from typing import ByteString, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from .beatmap_store import BeatmapStore
+from .cache import TTLCache
+from .osu_errors import InvalidBeatmap, WrongType
+
+__all__ = (
+    "MODS",
+    "parse_mods",
+    "mods_string",
+    "BeatmapFile",
+    "Difficulty",
+    "Performance",
+    "parse_beatmap",
+    "calculate_difficulty",
+    "calculate_performance",
+    "DifficultyCalculator",
+)
+
+logger = logging.getLogger(__name__)
+
+MODS: Dict[str, int] = {
+    "NF": 1,
+    "EZ": 2,
+    "HD": 8,
+    "HR": 16,
+    "DT": 64,
+    "HT": 256,
+    "NC": 512,
+    "FL": 1024,
+    "SO": 4096,
+}
+
+# Strain constants from the osu!standard difficulty calculator (ppv2 as implemented by oppai)
+SPEED, AIM = 0, 1
+DECAY_BASE = (0.3, 0.15)
+WEIGHT_SCALING = (1400.0, 26.25)
+STRAIN_STEP = 400.0
+DECAY_WEIGHT = 0.9
+STAR_SCALING_FACTOR = 0.0675
+EXTREME_SCALING_FACTOR = 0.5
+PLAYFIELD_WIDTH = 512.0
+PLAYFIELD_CENTER = (256.0, 192.0)
+CIRCLESIZE_BUFF_THRESHOLD = 30.0
+SINGLE_SPACING = 125.0
+STREAM_SPACING = 110.0
+ALMOST_DIAMETER = 90.0
+
+# base ** -seconds has to fit in a float64, 0.15 ** -100 is about 1e82
+BLOCK_SECONDS = 100.0
+
+CIRCLE, SLIDER, SPINNER = 0, 1, 2
+
+
+def parse_mods(text: str) -> int:
+    """Turns something like ``"HDDT"`` or ``"+hd,dt"`` into mod bits"""
+    letters = "".join(char for char in text.upper() if char.isalpha())
+    if len(letters) % 2:
+        raise WrongType(f"Mods must be two letter acronyms like HDDT, choose from {', '.join(MODS)}")
+
+    bits = 0
+    for index in range(0, len(letters), 2):
+        acronym = letters[index:index + 2]
+        if acronym not in MODS:
+            raise WrongType(f"Unknown mod {acronym}, choose from {', '.join(MODS)}")
+        bits |= MODS[acronym]
+
+    if bits & MODS["EZ"] and bits & MODS["HR"]:
+        raise WrongType("EZ and HR can't be used together")
+    if bits & (MODS["DT"] | MODS["NC"]) and bits & MODS["HT"]:
+        raise WrongType("DT and HT can't be used together")
+    return bits
+
+
+def mods_string(bits: int) -> str:
+    names = [name for name, bit in MODS.items() if bits & bit]
+    # NC implies DT, only show the one the player picked
+    if "NC" in names and "DT" in names:
+        names.remove("DT")
+    return "".join(names) or "NM"
+
+
+class BeatmapFile:
+    """The parts of a .osu file the calculator needs, hit objects are kept as arrays"""
+    __slots__ = (
+        "checksum",
+        "artist",
+        "title",
+        "version",
+        "creator",
+        "cs",
+        "od",
+        "ar",
+        "hp",
+        "slider_multiplier",
+        "slider_tick_rate",
+        "times",
+        "positions",
+        "kinds",
+        "max_combo",
+    )
+
+    def __init__(self, checksum: str):
+        self.checksum = checksum
+        self.artist = ""
+        self.title = ""
+        self.version = ""
+        self.creator = ""
+        self.cs = 5.0
+        self.od = 5.0
+        self.ar: Optional[float] = None
+        self.hp = 5.0
+        self.slider_multiplier = 1.4
+        self.slider_tick_rate = 1.0
+        self.times = np.empty(0)
+        self.positions = np.empty((0, 2))
+        self.kinds = np.empty(0, dtype=np.int8)
+        self.max_combo = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.artist} - {self.title} [{self.version}], objects: {len(self)}>"
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def nbytes(self) -> int:
+        return self.times.nbytes + self.positions.nbytes + self.kinds.nbytes + 512
+
+    @property
+    def circles(self) -> int:
+        return int(np.count_nonzero(self.kinds == CIRCLE))
+
+
+class Difficulty:
+    __slots__ = ("checksum", "mods", "stars", "aim", "speed", "cs", "od", "ar", "hp", "objects", "circles", "max_combo")
+
+    def __init__(self, **kwargs):
+        for k in self.__slots__:
+            setattr(self, k, kwargs[k])
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} stars: {self.stars:.2f}, mods: {mods_string(self.mods)}>"
+
+
+class Performance:
+    __slots__ = ("difficulty", "pp", "aim", "speed", "acc", "accuracy", "combo", "misses")
+
+    def __init__(self, **kwargs):
+        for k in self.__slots__:
+            setattr(self, k, kwargs[k])
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} pp: {self.pp:.2f}, accuracy: {self.accuracy:.2f}, combo: {self.combo}>"
+
+
+def _float(value: str, default: float) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+def parse_beatmap(data: ByteString, checksum: Optional[str] = None) -> BeatmapFile:
+    """Parses an osu!standard .osu file, ``data`` can be anything bytes-like (e.g. an mmap)"""
+    beatmap = BeatmapFile(checksum or hashlib.md5(data).hexdigest())
+    text = str(data, "utf-8-sig", "replace")
+    section = None
+    timing: List[Tuple[float, float]] = []
+    times: List[float] = []
+    positions: List[Tuple[float, float]] = []
+    kinds: List[int] = []
+    # (object index, repeats, pixel length)
+    sliders: List[Tuple[int, int, float]] = []
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("//"):
+            continue
+
+        if line.startswith("[") and line.endswith("]"):
+            section = line[1:-1]
+            continue
+
+        if section in ("General", "Metadata", "Difficulty"):
+            key, _, value = line.partition(":")
+            key, value = key.strip(), value.strip()
+            if key == "Mode" and value != "0":
+                raise InvalidBeatmap("Only osu!standard beatmaps can be calculated")
+            elif key == "Artist":
+                beatmap.artist = value
+            elif key == "Title":
+                beatmap.title = value
+            elif key == "Version":
+                beatmap.version = value
+            elif key == "Creator":
+                beatmap.creator = value
+            elif key == "CircleSize":
+                beatmap.cs = _float(value, beatmap.cs)
+            elif key == "OverallDifficulty":
+                beatmap.od = _float(value, beatmap.od)
+            elif key == "ApproachRate":
+                beatmap.ar = _float(value, beatmap.od)
+            elif key == "HPDrainRate":
+                beatmap.hp = _float(value, beatmap.hp)
+            elif key == "SliderMultiplier":
+                beatmap.slider_multiplier = _float(value, beatmap.slider_multiplier)
+            elif key == "SliderTickRate":
+                beatmap.slider_tick_rate = _float(value, beatmap.slider_tick_rate)
+
+        elif section == "TimingPoints":
+            parts = line.split(",")
+            if len(parts) < 2:
+                continue
+            timing.append((_float(parts[0], 0.0), _float(parts[1], 1000.0)))
+
+        elif section == "HitObjects":
+            parts = line.split(",")
+            if len(parts) < 4:
+                raise InvalidBeatmap(f"Malformed hit object {line[:50]!r}")
+
+            try:
+                kind = int(parts[3])
+                time = float(parts[2])
+                position = PLAYFIELD_CENTER if kind & 8 else (float(parts[0]), float(parts[1]))
+                repeats = int(parts[6]) if kind & 2 and len(parts) > 6 else 1
+            except ValueError:
+                raise InvalidBeatmap(f"Malformed hit object {line[:50]!r}") from None
+
+            times.append(time)
+            positions.append(position)
+            if kind & 8:
+                kinds.append(SPINNER)
+            elif kind & 2:
+                kinds.append(SLIDER)
+                sliders.append((len(times) - 1, repeats, _float(parts[7], 0.0) if len(parts) > 7 else 0.0))
+            else:
+                kinds.append(CIRCLE)
+
+    if not times:
+        raise InvalidBeatmap("This beatmap has no hit objects")
+
+    if beatmap.ar is None:
+        # Old beatmaps only have OD, AR used to be the same value
+        beatmap.ar = beatmap.od
+
+    beatmap.times = np.asarray(times, dtype=np.float64)
+    beatmap.positions = np.asarray(positions, dtype=np.float64)
+    beatmap.kinds = np.asarray(kinds, dtype=np.int8)
+    if np.any(np.diff(beatmap.times) < 0):
+        # osu! sorts hit objects by time on load but the file doesn't have to, strains and peaks need them in order.
+        # Stable so objects on the same millisecond keep the order they were written in
+        order = np.argsort(beatmap.times, kind="stable")
+        beatmap.times = beatmap.times[order]
+        beatmap.positions = beatmap.positions[order]
+        beatmap.kinds = beatmap.kinds[order]
+        moved = np.empty_like(order)
+        moved[order] = np.arange(len(order))
+        sliders = [(int(moved[index]), repeats, length) for index, repeats, length in sliders]
+    beatmap.max_combo = len(times) + _slider_combo(beatmap, timing, sliders)
+    return beatmap
+
+
+def _slider_combo(beatmap: BeatmapFile, timing: List[Tuple[float, float]], sliders: List[Tuple[int, int, float]]) -> int:
+    """Extra combo from slider ticks, repeats and tails"""
+    if not sliders:
+        return 0
+
+    starts = beatmap.times[[index for index, _, _ in sliders]]
+    repeats = np.asarray([repeat for _, repeat, _ in sliders], dtype=np.float64)
+    lengths = np.asarray([length for _, _, length in sliders], dtype=np.float64)
+
+    multipliers = np.ones(len(sliders))
+    if timing:
+        point_times = np.asarray([time for time, _ in timing])
+        beat_lengths = np.asarray([beat for _, beat in timing])
+        # Inherited points carry the slider velocity as -100 / multiplier, uninherited ones reset it
+        inherited = beat_lengths < 0
+        velocity = np.where(inherited, np.clip(-100.0 / np.where(inherited, beat_lengths, -100.0), 0.1, 10.0), 1.0)
+        order = np.argsort(point_times, kind="stable")
+        point = np.searchsorted(point_times[order], starts, side="right") - 1
+        multipliers = np.where(point >= 0, velocity[order][np.maximum(point, 0)], 1.0)
+
+    tick_distance = beatmap.slider_multiplier * 100.0 * multipliers / beatmap.slider_tick_rate
+    ticks = np.maximum(np.ceil(lengths / tick_distance - 0.01) - 1, 0)
+    # Every span has its ticks plus the repeat or tail at its end, the head is counted with the objects
+    return int(np.sum(repeats * (ticks + 1)))
+
+
+def _adjusted_stats(beatmap: BeatmapFile, mods: int) -> Tuple[float, float, float, float, float]:
+    """Returns ``(speed, cs, od, ar, hp)`` after mods"""
+    speed = 1.0
+    if mods & (MODS["DT"] | MODS["NC"]):
+        speed = 1.5
+    elif mods & MODS["HT"]:
+        speed = 0.75
+
+    multiplier = 1.0
+    if mods & MODS["HR"]:
+        multiplier = 1.4
+    elif mods & MODS["EZ"]:
+        multiplier = 0.5
+
+    cs = beatmap.cs * (1.3 if mods & MODS["HR"] else 0.5 if mods & MODS["EZ"] else 1.0)
+    od = min(beatmap.od * multiplier, 10.0)
+    ar = min(beatmap.ar * multiplier, 10.0)
+    hp = min(beatmap.hp * multiplier, 10.0)
+
+    # Speed mods change the hit windows and approach time in milliseconds, convert back to the scale
+    ar_ms = (1800 - 120 * ar if ar < 5 else 1200 - 150 * (ar - 5)) / speed
+    ar = (1800 - ar_ms) / 120 if ar_ms > 1200 else 5 + (1200 - ar_ms) / 150
+    od = (80 - (80 - 6 * od) / speed) / 6
+    return speed, min(cs, 10.0), od, ar, hp
+
+
+def _strains(times: np.ndarray, impulses: np.ndarray, base: float) -> np.ndarray:
+    """Solves ``strain[i] = strain[i - 1] * base ** (dt / 1000) + impulses[i]`` without a per-object loop
+
+    Within a block the recurrence is ``base ** t * cumsum(impulses * base ** -t)``, blocks are kept
+    short enough for ``base ** -t`` to fit in a float64 and each one carries the last strain over.
+    """
+    strains = np.empty_like(impulses)
+    seconds = times / 1000.0
+    carry, carry_time = 0.0, seconds[0]
+    start = 0
+    while start < len(seconds):
+        end = int(np.searchsorted(seconds, seconds[start] + BLOCK_SECONDS, side="right"))
+        elapsed = seconds[start:end] - seconds[start]
+        scale = base ** -elapsed
+        strains[start:end] = np.cumsum(impulses[start:end] * scale) / scale + carry * base ** (seconds[start:end] - carry_time)
+        carry, carry_time = strains[end - 1], seconds[end - 1]
+        start = end
+
+    return strains
+
+
+def _peaks(times: np.ndarray, strains: np.ndarray, base: float) -> np.ndarray:
+    """Highest strain in every 400ms section, a section starts at the decayed strain of the object before it"""
+    first_end = math.ceil(times[0] / STRAIN_STEP) * STRAIN_STEP
+    sections = np.maximum(np.ceil((times - first_end) / STRAIN_STEP), 0).astype(np.int64)
+    peaks = np.zeros(int(sections[-1]) + 1)
+
+    if len(peaks) > 1:
+        section = np.arange(1, len(peaks))
+        previous = np.searchsorted(sections, section, side="left") - 1
+        section_start = first_end + (section - 1) * STRAIN_STEP
+        peaks[1:] = strains[previous] * base ** ((section_start - times[previous]) / 1000.0)
+
+    starts = np.flatnonzero(np.r_[True, sections[1:] != sections[:-1]])
+    occupied = sections[starts]
+    peaks[occupied] = np.maximum(peaks[occupied], np.maximum.reduceat(strains, starts))
+    return peaks
+
+
+def _skill(times: np.ndarray, impulses: np.ndarray, kind: int) -> float:
+    base = DECAY_BASE[kind]
+    peaks = np.sort(_peaks(times, _strains(times, impulses, base), base))[::-1]
+    return float(np.sum(peaks * DECAY_WEIGHT ** np.arange(len(peaks))))
+
+
+def _speed_weight(distance: np.ndarray) -> np.ndarray:
+    return np.select(
+        [distance > SINGLE_SPACING, distance > STREAM_SPACING, distance > ALMOST_DIAMETER, distance > ALMOST_DIAMETER / 2],
+        [
+            2.5,
+            1.6 + 0.9 * (distance - STREAM_SPACING) / (SINGLE_SPACING - STREAM_SPACING),
+            1.2 + 0.4 * (distance - ALMOST_DIAMETER) / (STREAM_SPACING - ALMOST_DIAMETER),
+            0.95 + 0.25 * (distance - ALMOST_DIAMETER / 2) / (ALMOST_DIAMETER / 2),
+        ],
+        0.95
+    )
+
+
+def calculate_difficulty(beatmap: BeatmapFile, mods: int = 0) -> Difficulty:
+    speed, cs, od, ar, hp = _adjusted_stats(beatmap, mods)
+
+    radius = (PLAYFIELD_WIDTH / 16) * (1 - 0.7 * (cs - 5) / 5)
+    scale = 52.0 / radius
+    if radius < CIRCLESIZE_BUFF_THRESHOLD:
+        scale *= 1 + min(CIRCLESIZE_BUFF_THRESHOLD - radius, 5) / 50
+
+    times = beatmap.times / speed
+    positions = beatmap.positions * scale
+    distance = np.zeros(len(times))
+    distance[1:] = np.hypot(*(positions[1:] - positions[:-1]).T)
+    elapsed = np.full(len(times), 50.0)
+    elapsed[1:] = np.maximum(np.diff(times), 50.0)
+    scores = beatmap.kinds != SPINNER
+
+    speed_impulses = np.where(scores, _speed_weight(distance) * WEIGHT_SCALING[SPEED] / elapsed, 0.0)
+    aim_impulses = np.where(scores, distance ** 0.99 * WEIGHT_SCALING[AIM] / elapsed, 0.0)
+    # The first object starts both skills at a strain of 1
+    speed_impulses[0] = aim_impulses[0] = 1.0
+
+    aim = math.sqrt(_skill(times, aim_impulses, AIM)) * STAR_SCALING_FACTOR
+    speed_stars = math.sqrt(_skill(times, speed_impulses, SPEED)) * STAR_SCALING_FACTOR
+    stars = aim + speed_stars + abs(speed_stars - aim) * EXTREME_SCALING_FACTOR
+
+    return Difficulty(
+        checksum=beatmap.checksum,
+        mods=mods,
+        stars=stars,
+        aim=aim,
+        speed=speed_stars,
+        cs=cs,
+        od=od,
+        ar=ar,
+        hp=hp,
+        objects=len(beatmap),
+        circles=beatmap.circles,
+        max_combo=beatmap.max_combo
+    )
+
+
+def _hits(accuracy: float, objects: int, misses: int) -> Tuple[int, int, int]:
+    """Closest ``(300s, 100s, 50s)`` to ``accuracy``, filling with 100s first"""
+    remaining = objects - misses
+    missing = (1 - accuracy / 100) * objects * 300 - misses * 300
+    # Each 100 costs 200 points against a 300, each 50 costs 250
+    n100 = min(max(round(missing / 200), 0), remaining)
+    n50 = 0
+    if n100 == remaining and missing > remaining * 200:
+        n50 = min(max(round((missing - remaining * 200) / 50), 0), remaining)
+        n100 = remaining - n50
+    return remaining - n100 - n50, n100, n50
+
+
+def calculate_performance(difficulty: Difficulty, *, accuracy: float = 100.0, combo: Optional[int] = None, misses: int = 0) -> Performance:
+    mods = difficulty.mods
+    objects = difficulty.objects
+    misses = min(misses, objects)
+    combo = difficulty.max_combo if combo is None else min(combo, difficulty.max_combo)
+    n300, n100, n50 = _hits(accuracy, objects, misses)
+    accuracy = (n300 * 300 + n100 * 100 + n50 * 50) / (objects * 300) if objects else 0.0
+
+    def base_strain(stars: float) -> float:
+        return (5 * max(1.0, stars / STAR_SCALING_FACTOR) - 4) ** 3 / 100000
+
+    length_bonus = 0.95 + 0.4 * min(1.0, objects / 2000) + (math.log10(objects / 2000) * 0.5 if objects > 2000 else 0.0)
+    miss_penalty = 0.97 ** misses
+    combo_break = min(combo ** 0.8 / difficulty.max_combo ** 0.8, 1.0) if difficulty.max_combo else 1.0
+
+    ar_bonus = 1.0
+    if difficulty.ar > 10.33:
+        ar_bonus += 0.45 * (difficulty.ar - 10.33)
+    elif difficulty.ar < 8:
+        ar_bonus += 0.01 * (8 - difficulty.ar) * (2 if mods & MODS["HD"] else 1)
+
+    hd_bonus = 1.18 if mods & MODS["HD"] else 1.0
+    fl_bonus = 1.0
+    if mods & MODS["FL"]:
+        fl_bonus = 1 + 0.35 * min(1.0, objects / 200)
+        if objects > 200:
+            fl_bonus += 0.3 * min(1.0, (objects - 200) / 300)
+        if objects > 500:
+            fl_bonus += (objects - 500) / 1200
+
+    od_bonus = 0.98 + difficulty.od ** 2 / 2500
+    acc_bonus = 0.5 + accuracy / 2
+    aim = base_strain(difficulty.aim) * length_bonus * miss_penalty * combo_break * ar_bonus * hd_bonus * fl_bonus * acc_bonus * od_bonus
+    speed = base_strain(difficulty.speed) * length_bonus * miss_penalty * combo_break * acc_bonus * od_bonus
+
+    # Accuracy pp only counts circles, sliders and spinners are assumed to be 300s
+    circles = difficulty.circles
+    circle_accuracy = 0.0
+    if circles:
+        circle_accuracy = max(((n300 - (objects - circles)) * 300 + n100 * 100 + n50 * 50) / (circles * 300), 0.0)
+    acc = 1.52163 ** difficulty.od * circle_accuracy ** 24 * 2.83 * min(1.15, (circles / 1000) ** 0.3)
+    if mods & MODS["HD"]:
+        acc *= 1.02
+    if mods & MODS["FL"]:
+        acc *= 1.02
+
+    multiplier = 1.12
+    if mods & MODS["NF"]:
+        multiplier *= 0.9
+    if mods & MODS["SO"]:
+        multiplier *= 0.95
+
+    pp = (aim ** 1.1 + speed ** 1.1 + acc ** 1.1) ** (1 / 1.1) * multiplier
+    return Performance(difficulty=difficulty, pp=pp, aim=aim, speed=speed, acc=acc, accuracy=accuracy * 100, combo=combo, misses=misses)
+
+
+class DifficultyCalculator:
+    """Parses .osu files from the beatmap store and memoizes their difficulty by ``(checksum, mods)``"""
+    def __init__(self, store: BeatmapStore, *, max_files: int = 256, max_results: int = 8192):
+        self.store = store
+        # Both are keyed by checksum, a beatmap that changes gets a new one so nothing here goes stale
+        self.files: TTLCache[BeatmapFile] = TTLCache(ttl=float("inf"), max_entries=max_files, sizeof=lambda file: file.nbytes)
+        self.results: TTLCache[Difficulty] = TTLCache(ttl=float("inf"), max_entries=max_results, sizeof=lambda result: 256)
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {"files": self.files.stats, "results": self.results.stats, "store": self.store.stats}
+
+    async def fetch_file(self, beatmap_id: int, checksum: Optional[str] = None) -> BeatmapFile:
+        beatmap, _ = self.files.get(checksum or ("id", beatmap_id))
+        if beatmap is not None:
+            return beatmap
+
+        data = await self.store.fetch(beatmap_id, checksum)
+        beatmap = await asyncio.to_thread(self._parse, data)
+        self.files.set(beatmap.checksum, beatmap, aliases=[("id", beatmap_id)])
+        return beatmap
+
+    @staticmethod
+    def _parse(data: mmap.mmap) -> BeatmapFile:
+        with data:
+            return parse_beatmap(data)
+
+    async def difficulty(self, beatmap_id: int, mods: int = 0, *, checksum: Optional[str] = None) -> Difficulty:
+        # With the checksum from the API a cached result needs no download at all
+        if checksum is not None:
+            result, _ = self.results.get((checksum, mods))
+            if result is not None:
+                return result
+
+        beatmap = await self.fetch_file(beatmap_id, checksum)
+        key: Hashable = (beatmap.checksum, mods)
+        result, _ = self.results.get(key)
+        if result is None:
+            result = await asyncio.to_thread(calculate_difficulty, beatmap, mods)
+            self.results.set(key, result)
+        return result
+
+    async def performance(
+        self,
+        beatmap_id: int,
+        mods: int = 0,
+        *,
+        checksum: Optional[str] = None,
+        accuracy: float = 100.0,
+        combo: Optional[int] = None,
+        misses: int = 0
+    ) -> Performance:
+        difficulty = await self.difficulty(beatmap_id, mods, checksum=checksum)
+        return calculate_performance(difficulty, accuracy=accuracy, combo=combo, misses=misses)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+import asyncio
+import collections
+import logging
+from typing import Awaitable, Deque, Dict, Optional, TypeVar, Union
+import discord
+from .metrics import DEGRADED
+from .ratelimit import Priority, _current_priority
+
+__all__ = (
+    "AdaptiveLimiter",
+    "defer_if_slow",
+    "respond",
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class AdaptiveLimiter:
+    """Concurrency limit for one upstream that follows its latency (AIMD)
+
+    Round trips are judged a window at a time (at least ``window`` seconds and ``min_samples`` calls).
+    A window whose average latency is over ``tolerance`` times the baseline, or whose error rate is over
+    ``max_error_rate``, cuts the limit by ``backoff``. Any other window grows it by one if it was used.
+    The baseline is a slow moving average of the windows, so it follows a lasting change in the
+    upstream instead of throttling it forever. Low priority callers only get ``1 - reserve`` of the
+    limit so background work can't crowd out commands.
+    """
+    def __init__(
+        self,
+        *,
+        initial: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        tolerance: float = 2.0,
+        max_error_rate: float = 0.2,
+        backoff: float = 0.7,
+        reserve: float = 0.25,
+        window: float = 1.0,
+        min_samples: int = 10,
+        smoothing: float = 0.05
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.max_error_rate = max_error_rate
+        self.backoff = backoff
+        self.reserve = reserve
+        self.window = window
+        self.min_samples = min_samples
+        self.smoothing = smoothing
+        self.baseline: Optional[float] = None
+        self.inflight = 0
+        self._waiters: Dict[Priority, Deque[asyncio.Future]] = {lane: collections.deque() for lane in Priority}
+        # The window being collected
+        self._started: Optional[float] = None
+        self._samples = 0
+        self._errors = 0
+        self._latency = 0.0
+        self._peak = 0
+        self.acquired = 0
+        self.waited = 0
+        self.shed = 0
+        self.cuts = 0
+
+    @property
+    def stats(self) -> Dict[str, Union[int, float]]:
+        return {
+            "limit": round(self.limit, 2),
+            "inflight": self.inflight,
+            "waiting": sum(map(len, self._waiters.values())),
+            "baseline_ms": round(self.baseline * 1000, 2) if self.baseline is not None else 0.0,
+            "window_samples": self._samples,
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "shed": self.shed,
+            "cuts": self.cuts,
+        }
+
+    def _capacity(self, lane: Priority) -> int:
+        limit = int(self.limit)
+        return limit if lane is Priority.HIGH else max(int(limit * (1 - self.reserve)), 1)
+
+    async def acquire(self, timeout: float) -> bool:
+        """Takes a slot, waiting up to ``timeout`` seconds for one. Returns False if it couldn't"""
+        lane = _current_priority.get()
+        if self.inflight < self._capacity(lane) and not self._waiting(lane):
+            self._take()
+            return True
+
+        if timeout <= 0:
+            self.shed += 1
+            return False
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters[lane].append(future)
+        self.waited += 1
+        handle = loop.call_later(timeout, lambda: future.done() or future.set_result(False))
+        try:
+            granted = await future
+        except asyncio.CancelledError:
+            # Handed a slot just as we got cancelled, pass it on
+            if future.done() and not future.cancelled() and future.result():
+                self.inflight -= 1
+                self._wake()
+            raise
+        finally:
+            handle.cancel()
+            try:
+                self._waiters[lane].remove(future)
+            except ValueError:
+                pass
+
+        if not granted:
+            self.shed += 1
+        return granted
+
+    def _take(self):
+        self.inflight += 1
+        self.acquired += 1
+        self._peak = max(self._peak, self.inflight)
+
+    def _waiting(self, lane: Priority) -> bool:
+        # Anyone queued in this lane or a more important one goes first
+        return any(self._waiters[other] for other in Priority if other <= lane)
+
+    def release(self):
+        self.inflight -= 1
+        self._wake()
+
+    def _wake(self):
+        for lane in Priority:
+            waiters = self._waiters[lane]
+            while waiters and self.inflight < self._capacity(lane):
+                future = waiters.popleft()
+                if future.done():
+                    continue
+                self._take()
+                future.set_result(True)
+            if waiters:
+                # Lower lanes wait until this one is empty
+                return
+
+    def sample(self, latency: float, ok: bool):
+        """Feeds one round trip back into the limit, ``ok`` is False for timeouts, 5xx and 429"""
+        now = asyncio.get_running_loop().time()
+        if self._started is None:
+            self._started = now
+        self._samples += 1
+        if ok:
+            self._latency += latency
+        else:
+            self._errors += 1
+
+        if self._samples >= self.min_samples and now - self._started >= self.window:
+            self._adjust()
+            self._started = now
+            self._samples = self._errors = 0
+            self._latency = 0.0
+            self._peak = self.inflight
+            self._wake()
+
+    def _adjust(self):
+        succeeded = self._samples - self._errors
+        average = self._latency / succeeded if succeeded else None
+        if average is not None and self.baseline is None:
+            self.baseline = average
+
+        slow = average is not None and average > self.baseline * self.tolerance
+        if slow or self._errors / self._samples > self.max_error_rate:
+            self.limit = max(self.limit * self.backoff, float(self.min_limit))
+            self.cuts += 1
+        elif self._peak * 2 >= self.limit:
+            # Only grow while the limit is actually being used
+            self.limit = min(self.limit + 1, float(self.max_limit))
+
+        if average is not None:
+            self.baseline += self.smoothing * (average - self.baseline)
+
+
+async def defer_if_slow(interaction: discord.Interaction, awaitable: Awaitable[T], *, after: float = 2.0, ephemeral: bool = False) -> T:
+    """Awaits ``awaitable``, deferring the interaction if it's still going ``after`` seconds after the interaction was created
+
+    Waiting on a busy upstream then costs a "thinking..." message instead of the interaction expiring.
+    The deadline is counted from the interaction, so several calls in one command share it.
+    Respond with ``respond`` afterwards since the interaction may have been deferred.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        # Clamped in case our clock is behind Discord's
+        elapsed = max((discord.utils.utcnow() - interaction.created_at).total_seconds(), 0)
+        done, _ = await asyncio.wait({task}, timeout=max(after - elapsed, 0))
+        if not done and not interaction.response.is_done():
+            await interaction.response.defer(ephemeral=ephemeral, thinking=True)
+            DEGRADED.inc("deferred", interaction.command.qualified_name if interaction.command else "unknown")
+        return await task
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+
+async def respond(interaction: discord.Interaction, content: Optional[str] = None, **kwargs):
+    """Sends the response, or a followup if the interaction was already deferred"""
+    if interaction.response.is_done():
+        await interaction.followup.send(content, **kwargs)
+    else:
+        await interaction.response.send_message(content, **kwargs)
@@ -0,0 +1,170 @@
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+__all__ = (
+    "IPCClient",
+    "IPCServer",
+)
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], Union[Awaitable[None], None]]
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class IPCServer:
+    """Runs in the cluster supervisor, relays messages between clusters over localhost.
+
+    Messages are newline separated json objects with an ``op``. ``stats``
+    messages are kept per cluster and the combined table is sent back to
+    everyone, anything else is forwarded to every other cluster as is.
+    """
+    def __init__(self, *, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self._writers: Dict[int, asyncio.StreamWriter] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Cluster IPC listening on {self.host}:{self.port}")
+        return self.port
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        cluster_id: Optional[int] = None
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if message.get("op") == "identify":
+                    cluster_id = message["cluster"]
+                    self._writers[cluster_id] = writer
+                    continue
+
+                if message.get("op") == "stats":
+                    self.stats[str(cluster_id)] = message["data"]
+                    await self._broadcast({"op": "stats", "cluster": None, "data": self.stats})
+                else:
+                    await self._broadcast(message, skip=cluster_id)
+        except (ConnectionError, json.JSONDecodeError) as e:
+            logger.warning(f"IPC connection from cluster {cluster_id} broke: {e!r}")
+        finally:
+            if cluster_id is not None and self._writers.get(cluster_id) is writer:
+                del self._writers[cluster_id]
+            writer.close()
+
+    async def _broadcast(self, message: Dict[str, Any], *, skip: Optional[int] = None):
+        payload = _encode(message)
+        for cluster_id, writer in list(self._writers.items()):
+            if cluster_id == skip:
+                continue
+            try:
+                writer.write(payload)
+                await writer.drain()
+            except ConnectionError:
+                self._writers.pop(cluster_id, None)
+
+
+class IPCClient:
+    """A cluster's connection to the supervisor, reconnects on its own"""
+    def __init__(
+        self,
+        cluster_id: int,
+        *,
+        port: int,
+        host: str = "127.0.0.1",
+        stats: Optional[Callable[[], Dict[str, Any]]] = None,
+        stats_interval: float = 30.0
+    ):
+        self.cluster_id = cluster_id
+        self.host = host
+        self.port = port
+        self.stats_provider = stats
+        self.stats_interval = stats_interval
+        self.cluster_stats: Dict[str, Dict[str, Any]] = {}
+        self.handlers: Dict[str, Handler] = {"stats": self._on_stats}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._tasks: list = []
+
+    def add_handler(self, op: str, handler: Handler):
+        self.handlers[op] = handler
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run())]
+            if self.stats_provider is not None:
+                self._tasks.append(asyncio.create_task(self._push_stats()))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def publish(self, op: str, data: Any = None):
+        """Sends ``op`` to every other cluster, dropped if we're not connected"""
+        if self._writer is None:
+            return
+
+        try:
+            self._writer.write(_encode({"op": op, "cluster": self.cluster_id, "data": data}))
+            await self._writer.drain()
+        except ConnectionError as e:
+            logger.warning(f"Could not publish {op} over IPC: {e!r}")
+
+    async def _run(self):
+        backoff = 1.0
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_connection(self.host, self.port)
+                self._writer.write(_encode({"op": "identify", "cluster": self.cluster_id}))
+                backoff = 1.0
+                async for line in reader:
+                    await self._dispatch(json.loads(line))
+            except (ConnectionError, json.JSONDecodeError) as e:
+                logger.warning(f"Cluster {self.cluster_id} lost its IPC connection: {e!r}")
+
+            self._writer = None
+            await asyncio.sleep(random.uniform(backoff / 2, backoff))
+            backoff = min(backoff * 2, 30.0)
+
+    async def _dispatch(self, message: Dict[str, Any]):
+        handler = self.handlers.get(message.get("op"))
+        if handler is None:
+            return
+
+        try:
+            result = handler(message.get("data"))
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            logger.warning(f"IPC handler for {message.get('op')} failed: {e!r}")
+
+    def _on_stats(self, data: Dict[str, Dict[str, Any]]):
+        self.cluster_stats = data
+
+    async def _push_stats(self):
+        while True:
+            try:
+                await self.publish("stats", self.stats_provider())
+            except Exception as e:
+                logger.exception("Could not publish cluster stats", exc_info=e)
+            await asyncio.sleep(self.stats_interval)
@@ -0,0 +1,148 @@
+from __future__ import annotations
+import asyncio
+import datetime
+import logging
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+import asyncpg
+from .osu_errors import OsuBaseException
+from .ratelimit import Priority, priority
+
+if TYPE_CHECKING:
+    from .old_osu import Osu, User
+
+__all__ = (
+    "StatsSnapshotter",
+    "LEADERBOARD_SORTS",
+)
+
+logger = logging.getLogger(__name__)
+
+# Sort name -> ORDER BY, every one of these is answered from the osu_stats table without calling osu!
+LEADERBOARD_SORTS: Dict[str, str] = {
+    "pp": "pp DESC NULLS LAST",
+    "rank": "global_rank ASC NULLS LAST",
+    "accuracy": "accuracy DESC NULLS LAST",
+    "play count": "play_count DESC NULLS LAST",
+}
+
+SYNC_QUERY = """
+    INSERT INTO osu_stats (user_id, osu_username)
+    SELECT u.user_id, u.osu_username FROM osu_user u
+    LEFT JOIN osu_stats s ON s.user_id = u.user_id
+    WHERE s.user_id IS NULL OR s.osu_username IS DISTINCT FROM u.osu_username
+    ON CONFLICT (user_id) DO
+    UPDATE SET osu_username = excluded.osu_username, osu_id = NULL, updated_at = NULL,
+        pp = NULL, global_rank = NULL, accuracy = NULL, play_count = NULL,
+        prev_pp = NULL, prev_global_rank = NULL, prev_accuracy = NULL, prev_play_count = NULL, previous_at = NULL
+"""
+
+CLAIM_QUERY = """
+    UPDATE osu_stats SET claimed_until = (now() at time zone 'utc') + $3::interval
+    WHERE user_id IN (
+        SELECT user_id FROM osu_stats
+        WHERE (updated_at IS NULL OR updated_at < (now() at time zone 'utc') - $1::interval)
+        AND (claimed_until IS NULL OR claimed_until < now() at time zone 'utc')
+        ORDER BY updated_at NULLS FIRST
+        FOR UPDATE SKIP LOCKED
+        LIMIT $2
+    )
+    RETURNING user_id, osu_username, osu_id
+"""
+
+# A username can move to another account, only keep the previous snapshot if it's the same player
+SNAPSHOT_QUERY = """
+    UPDATE osu_stats SET
+        prev_pp = CASE WHEN osu_id = $2 THEN pp END,
+        prev_global_rank = CASE WHEN osu_id = $2 THEN global_rank END,
+        prev_accuracy = CASE WHEN osu_id = $2 THEN accuracy END,
+        prev_play_count = CASE WHEN osu_id = $2 THEN play_count END,
+        previous_at = CASE WHEN osu_id = $2 THEN updated_at END,
+        osu_id = $2, pp = $3, global_rank = $4, accuracy = $5, play_count = $6,
+        updated_at = now() at time zone 'utc', claimed_until = NULL
+    WHERE user_id = $1
+"""
+
+
+class StatsSnapshotter:
+    """Keeps osu_stats filled with a recent snapshot of every linked user, refreshing the stalest rows in batches"""
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        osu: Osu,
+        *,
+        stale_after: datetime.timedelta = datetime.timedelta(hours=6),
+        batch_size: int = 200,
+        interval: float = 60.0
+    ):
+        self.pool = pool
+        self.osu = osu
+        self.stale_after = stale_after
+        self.batch_size = batch_size
+        self.interval = interval
+        self.refreshed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def leaderboard(self, user_ids: Sequence[int], sort: str, *, limit: int = 10) -> List[asyncpg.Record]:
+        query = f"""
+            SELECT * FROM osu_stats
+            WHERE user_id = ANY($1::bigint[]) AND updated_at IS NOT NULL
+            ORDER BY {LEADERBOARD_SORTS[sort]}
+            LIMIT $2
+        """
+        return await self.pool.fetch(query, list(user_ids), limit)
+
+    async def _run(self):
+        while True:
+            try:
+                # Background work, interactive commands get the api budget first
+                with priority(Priority.LOW):
+                    refreshed = await self.refresh_once()
+            except (asyncpg.PostgresError, OSError) as e:
+                logger.warning(f"Stat snapshot run failed: {e!r}")
+                refreshed = 0
+            except Exception as e:
+                # An osu! outage or a bad payload shouldn't end snapshots for the life of the process
+                logger.exception("Stat snapshot run crashed", exc_info=e)
+                refreshed = 0
+
+            # A full batch means there's more stale rows waiting, keep going
+            if refreshed < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    async def refresh_once(self) -> int:
+        await self.pool.execute(SYNC_QUERY)
+        rows = await self.pool.fetch(CLAIM_QUERY, self.stale_after, self.batch_size, datetime.timedelta(minutes=10))
+        if not rows:
+            return 0
+
+        users: Dict[int, User] = {}
+        known = [row['osu_id'] for row in rows if row['osu_id'] is not None]
+        for user in await self.osu.fetch_users(known):
+            users[user.id] = user
+
+        snapshots = []
+        for row in rows:
+            user = users.get(row['osu_id']) if row['osu_id'] is not None else None
+            if user is None:
+                # First time we see this username (or it changed), look it up by name once to learn the id
+                try:
+                    user = await self.osu.fetch_user(row['osu_username'], key="username")
+                except OsuBaseException as e:
+                    logger.info(f"Could not snapshot {row['osu_username']!r}: {e}")
+                    continue
+
+            pp = user.pp if isinstance(user.pp, (int, float)) else None
+            snapshots.append((row['user_id'], user.id, pp, user.global_rank or None, user.hit_accuracy, user.play_count))
+
+        await self.pool.executemany(SNAPSHOT_QUERY, snapshots)
+        self.refreshed += len(snapshots)
+        return len(rows)
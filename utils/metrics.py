@@ -0,0 +1,382 @@
+from __future__ import annotations
+import asyncio
+import bisect
+import contextlib
+import logging
+import re
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import aiohttp
+import asyncpg
+import discord
+from aiohttp import web
+from discord import app_commands
+from .analytics import track_upstream_calls
+from .osu_errors import UpstreamUnavailable
+
+if TYPE_CHECKING:
+    from bot import Aswo
+
+__all__ = (
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsRegistry",
+    "REGISTRY",
+    "COMMAND_LATENCY",
+    "COMMAND_ERRORS",
+    "UPSTREAM_LATENCY",
+    "UPSTREAM_ERRORS",
+    "POOL_ACQUIRE",
+    "QUERY_LATENCY",
+    "LOOP_LAG",
+    "STARTUP_PHASES",
+    "UPSTREAM_SHED",
+    "DEGRADED",
+    "http_trace_config",
+    "instrument_pool",
+    "InstrumentedConnection",
+    "MetricsTree",
+    "observe_command",
+    "MetricsServer",
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def _key(self, values: Sequence[Any]) -> Labels:
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {values}")
+        return tuple(str(value) for value in values)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: Any, amount: float = 1):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """Set directly, or filled in at scrape time by ``collect`` returning ``{labels: value}``"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), *, collect: Optional[Callable[[], Dict[Labels, float]]] = None):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Labels, float] = {}
+        self.collect = collect
+
+    def set(self, value: float, *labels: Any):
+        self._values[self._key(labels)] = value
+
+    def samples(self) -> Iterator[str]:
+        values = dict(self._values)
+        if self.collect is not None:
+            try:
+                values.update(self.collect())
+            except Exception:
+                logger.exception(f"Collecting {self.name} failed")
+
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), *, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per bucket counts with +Inf last, sum)
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: Any):
+        key = self._key(labels)
+        counts, total = self._values.get(key) or self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total[0])}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"{metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str):
+        self._metrics.pop(name, None)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+COMMAND_LATENCY: Histogram = REGISTRY.register(Histogram("aswo_app_command_seconds", "Time spent running app commands", ("command",)))
+COMMAND_ERRORS: Counter = REGISTRY.register(Counter("aswo_app_command_errors_total", "App commands that raised", ("command", "error")))
+UPSTREAM_LATENCY: Histogram = REGISTRY.register(Histogram("aswo_upstream_request_seconds", "Outgoing HTTP request latency", ("host", "method", "route", "status")))
+UPSTREAM_ERRORS: Counter = REGISTRY.register(Counter("aswo_upstream_request_errors_total", "Outgoing HTTP requests that never got a response", ("host", "method", "route", "error")))
+POOL_ACQUIRE: Histogram = REGISTRY.register(Histogram("aswo_db_pool_acquire_seconds", "Time spent waiting for a database connection"))
+QUERY_LATENCY: Histogram = REGISTRY.register(Histogram("aswo_db_query_seconds", "Database query latency", ("statement", "table")))
+LOOP_LAG: Histogram = REGISTRY.register(Histogram("aswo_event_loop_lag_seconds", "How late the event loop ran a timer", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)))
+STARTUP_PHASES: Gauge = REGISTRY.register(Gauge("aswo_startup_phase_seconds", "How long each startup phase of this process took", ("phase",)))
+UPSTREAM_SHED: Counter = REGISTRY.register(Counter("aswo_upstream_shed_total", "Requests refused because an upstream's concurrency limit stayed full", ("upstream",)))
+DEGRADED: Counter = REGISTRY.register(Counter("aswo_degraded_responses_total", "Commands answered with a fallback (deferred, stale data, requeued render)", ("fallback", "command")))
+
+# Ids and usernames would give every user their own series
+_ROUTE_RES = (
+    (re.compile(r"/users/[^/]+"), "/users/{user}"),
+    (re.compile(r"/\d+(?=/|$)"), "/{id}"),
+)
+
+
+def _route(path: str) -> str:
+    for pattern, replacement in _ROUTE_RES:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+def http_trace_config() -> aiohttp.TraceConfig:
+    """Times every request made through a session, so the osu! client, o!rdr and the beatmap mirror all get covered"""
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params: aiohttp.TraceRequestStartParams):
+        context.start = time.perf_counter()
+
+    async def on_request_end(session, context, params: aiohttp.TraceRequestEndParams):
+        UPSTREAM_LATENCY.observe(time.perf_counter() - context.start, params.url.host, params.method, _route(params.url.path), params.response.status)
+
+    async def on_request_exception(session, context, params: aiohttp.TraceRequestExceptionParams):
+        UPSTREAM_ERRORS.inc(params.url.host, params.method, _route(params.url.path), params.exception.__class__.__name__)
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_exception)
+    return trace
+
+
+_STATEMENT_RE = re.compile(r"^\s*(\w+)", re.ASCII)
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+
+
+def _query_labels(query: str) -> Tuple[str, str]:
+    statement = _STATEMENT_RE.match(query)
+    table = _TABLE_RE.search(query)
+    return (statement.group(1).upper() if statement else "?", table.group(1).lower() if table else "")
+
+
+class InstrumentedConnection(asyncpg.Connection):
+    """Pass as ``connection_class`` to ``asyncpg.create_pool`` to time every query by statement and table"""
+
+    async def execute(self, query: str, *args, **kwargs):
+        with QUERY_LATENCY.time(*_query_labels(query)):
+            return await super().execute(query, *args, **kwargs)
+
+    async def executemany(self, command: str, args, **kwargs):
+        with QUERY_LATENCY.time(*_query_labels(command)):
+            return await super().executemany(command, args, **kwargs)
+
+    async def fetch(self, query: str, *args, **kwargs):
+        with QUERY_LATENCY.time(*_query_labels(query)):
+            return await super().fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        with QUERY_LATENCY.time(*_query_labels(query)):
+            return await super().fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        with QUERY_LATENCY.time(*_query_labels(query)):
+            return await super().fetchval(query, *args, **kwargs)
+
+
+def instrument_pool(pool: asyncpg.Pool) -> asyncpg.Pool:
+    """Times how long callers wait for a connection, and exposes the pool's size"""
+    # Pool has __slots__, but every acquire path (pool.fetch, async with pool.acquire(), await pool.acquire())
+    # waits on its queue of free connections, and that is a plain object
+    queue = pool._queue
+    get = queue.get
+
+    async def timed_get():
+        with POOL_ACQUIRE.time():
+            return await get()
+
+    queue.get = timed_get
+    REGISTRY.unregister("aswo_db_pool_connections")
+    REGISTRY.register(Gauge(
+        "aswo_db_pool_connections",
+        "Database connections by state",
+        ("state",),
+        collect=lambda: {("open",): pool.get_size(), ("idle",): pool.get_idle_size()}
+    ))
+    return pool
+
+
+class MetricsTree(app_commands.CommandTree):
+    """Command tree that times every app command, completion is recorded from ``on_app_command_completion``
+
+    Errors from an upstream being down are answered with their message instead of being logged.
+    """
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras["started"] = time.perf_counter()
+        interaction.extras["upstreams"] = track_upstream_calls()
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        name = interaction.command.qualified_name if interaction.command else "unknown"
+        original = getattr(error, "original", error)
+        COMMAND_ERRORS.inc(name, original.__class__.__name__)
+        observe_command(interaction, interaction.command)
+        self.client.record_interaction(interaction, interaction.command, original.__class__.__name__)
+        if isinstance(original, UpstreamUnavailable):
+            # Expected while an upstream is down, tell the user instead of logging a traceback
+            send = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
+            await send(str(original), ephemeral=True)
+            return
+        await super().on_error(interaction, error)
+
+
+def observe_command(interaction: discord.Interaction, command: Optional[Any]):
+    started = interaction.extras.get("started")
+    if started is not None and command is not None:
+        COMMAND_LATENCY.observe(time.perf_counter() - started, command.qualified_name)
+
+
+def _flatten(prefix: str, stats: Dict[str, Any]) -> Iterable[Tuple[str, str, float]]:
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _flatten(f"{prefix}.{key}", value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield prefix, key, value
+
+
+class MetricsServer:
+    """Serves ``/metrics`` in the Prometheus text format and samples event loop lag"""
+    def __init__(self, bot: Aswo, *, host: str = "0.0.0.0", port: int = 3000, lag_interval: float = 0.5):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+        self._runner: Optional[web.AppRunner] = None
+        self._lag_task: Optional[asyncio.Task] = None
+
+        for name in ("aswo_gateway_latency_seconds", "aswo_cache_stat"):
+            REGISTRY.unregister(name)
+        REGISTRY.register(Gauge("aswo_gateway_latency_seconds", "Heartbeat latency per shard", ("shard",), collect=self._gateway_latency))
+        REGISTRY.register(Gauge("aswo_cache_stat", "Numbers from the bot's caches and queues", ("cache", "stat"), collect=self._cache_stats))
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._lag_task = asyncio.create_task(self._measure_lag())
+        logger.info(f"Serving metrics on {self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+    async def _measure_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            LOOP_LAG.observe(max(loop.time() - expected, 0.0))
+
+    def _gateway_latency(self) -> Dict[Labels, float]:
+        return {(str(shard_id),): latency for shard_id, latency in self.bot.latencies if latency == latency}
+
+    def _cache_stats(self) -> Dict[Labels, float]:
+        sources = {
+            "osu": lambda: self.bot.osu_cache.stats,
+            "ratelimit": lambda: self.bot.osu.limiter.stats,
+            "tokens": lambda: self.bot.osu.tokens.stats,
+            "batching.users": lambda: self.bot.osu.user_loader.stats,
+            "batching.beatmaps": lambda: self.bot.osu.beatmap_loader.stats,
+            "settings": lambda: self.bot.settings.stats,
+            "tracker": lambda: self.bot.tracker.stats,
+            "difficulty": lambda: self.bot.difficulty.stats,
+            "render_queue": lambda: self.bot.render_queue.stats,
+            "upstreams": lambda: self.bot.upstreams.stats,
+            "analytics": lambda: self.bot.analytics.stats,
+        }
+        values = {}
+        for name, source in sources.items():
+            for cache, stat, value in _flatten(name, source()):
+                values[(cache, stat)] = value
+        return values
@@ -0,0 +1,118 @@
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncpg
+
+__all__ = (
+    "CacheListener",
+)
+
+logger = logging.getLogger(__name__)
+
+ChangeHandler = Callable[[str, Dict[str, Any]], None]
+
+_CONNECTION_ERRORS = (asyncpg.PostgresError, asyncpg.InterfaceError, asyncio.TimeoutError, OSError)
+
+
+class CacheListener:
+    """Holds a LISTEN connection from the pool and applies row changes other processes make to our caches.
+
+    ``handlers`` maps a table name to a callback taking the operation
+    (INSERT/UPDATE/DELETE) and the row. When the connection drops we
+    reconnect with backoff and call ``resync`` since notifications sent
+    while we were gone are lost.
+    """
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        *,
+        handlers: Dict[str, ChangeHandler],
+        resync: Callable[[], Awaitable[None]],
+        channel: str = "aswo_cache",
+        ping_interval: float = 60.0,
+        max_backoff: float = 60.0
+    ):
+        self.pool = pool
+        self.handlers = handlers
+        self.resync = resync
+        self.channel = channel
+        self.ping_interval = ping_interval
+        self.max_backoff = max_backoff
+        self.notifications = 0
+        self.resyncs = 0
+        self._conn: Optional[asyncpg.Connection] = None
+        self._lost = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Starts listening, changes made after this returns won't be missed"""
+        await self._connect()
+        self._runner = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+        await self._release()
+
+    async def _connect(self):
+        self._lost.clear()
+        self._conn = await self.pool.acquire()
+        self._conn.add_termination_listener(lambda _: self._lost.set())
+        await self._conn.add_listener(self.channel, self._on_notification)
+
+    async def _release(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+
+        try:
+            if not conn.is_closed():
+                await conn.remove_listener(self.channel, self._on_notification)
+            await self.pool.release(conn)
+        except _CONNECTION_ERRORS as e:
+            logger.debug(f"Could not cleanly release the listener connection: {e!r}")
+
+    async def _run(self):
+        while True:
+            await self._watch()
+            logger.warning("Lost the postgres LISTEN connection, reconnecting")
+            await self._release()
+
+            backoff = 1.0
+            while True:
+                try:
+                    await self._connect()
+                    await self.resync()
+                    self.resyncs += 1
+                    break
+                except _CONNECTION_ERRORS as e:
+                    delay = random.uniform(backoff / 2, backoff)
+                    logger.warning(f"Reconnecting the LISTEN connection failed ({e!r}), retrying in {delay:.1f} seconds")
+                    await self._release()
+                    await asyncio.sleep(delay)
+                    backoff = min(backoff * 2, self.max_backoff)
+
+    async def _watch(self):
+        # An idle connection can die without us being told, so ping it every now and then
+        while not self._lost.is_set():
+            try:
+                await asyncio.wait_for(self._lost.wait(), self.ping_interval)
+            except asyncio.TimeoutError:
+                try:
+                    await self._conn.execute("SELECT 1")
+                except _CONNECTION_ERRORS:
+                    return
+
+    def _on_notification(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str):
+        self.notifications += 1
+        try:
+            change = json.loads(payload)
+            handler = self.handlers.get(change['table'])
+            if handler is not None:
+                handler(change['op'], change['row'])
+        except Exception as e:
+            logger.warning(f"Could not apply cache change {payload!r}: {e!r}")
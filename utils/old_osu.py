@@ -1,30 +1,106 @@
 from __future__ import annotations
+import asyncio
 import datetime
+import email.utils
 import logging
-from typing import Dict, List, Union
-import aiohttp
+from typing import Dict, Iterable, List, Optional, Union
+from .batcher import Batcher
 from .default import date
+from .ratelimit import RateLimiter
+from .singleflight import SingleFlight, request_key
+from .upstream import HTTPSession
 from .osu_errors import *
 
+try:
+    import orjson
+except ImportError:
+    import json
+    _loads = json.loads
+else:
+    _loads = orjson.loads
+
+__all__ = (
+    "Osu",
+    "TokenManager",
+    "User",
+    "TestUser",
+    "Beatmap",
+    "BeatmapCompact",
+    "Beatmapset",
+    "Score",
+)
+
 logger = logging.getLogger(__name__)
 
-class Osu:
-    def __init__(self, *, client_id: int, client_secret: str, session: aiohttp.ClientSession):
+
+def _retry_after(value: Optional[str], default: float = 60.0) -> float:
+    """Retry-After is either a number of seconds or an HTTP date"""
+    if value is None:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max((when - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+class TokenManager:
+    """Holds the client credentials token until it expires and refreshes it in the background"""
+    def __init__(
+        self,
+        *,
+        client_id: int,
+        client_secret: str,
+        session: HTTPSession,
+        url: str,
+        refresh_margin: float = 60.0
+    ):
         self.id = client_id
         self.secret = client_secret
-        self.session: aiohttp.ClientSession = session
-        self.API_URL = "https://osu.ppy.sh/api/v2"
-        self.TOKEN_URL = "https://osu.ppy.sh/oauth/token"
-        self.beatmap_types = ['favourite', 'graveyard', 'loved', 'most_played', 'pending', 'ranked']
-        self.special_types = ['most_played']
-        self.score_types = ['best', 'firsts', 'recent']
-    
-    async def _request(self, method: str, url: str, **kwargs):
-        async with self.session.request(method, url,**kwargs) as resp:
-            json = await resp.json()
+        self.session = session
+        self.url = url
+        self.refresh_margin = refresh_margin
+        self._token: Optional[str] = None
+        self._expires_at: float = 0.0
+        self._refresh_task: Optional[asyncio.Task[str]] = None
+        self._refresh_handle: Optional[asyncio.TimerHandle] = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
 
-        return json
-    async def get_token(self):
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "refreshes": self.refreshes}
+
+    @property
+    def is_valid(self) -> bool:
+        return self._token is not None and asyncio.get_running_loop().time() < self._expires_at
+
+    async def get(self) -> str:
+        if self.is_valid:
+            self.hits += 1
+            return self._token
+
+        self.misses += 1
+        return await self.refresh()
+
+    async def refresh(self, *, stale: Optional[str] = None) -> str:
+        # Someone else already replaced the token that got rejected, so just use theirs
+        if stale is not None and self._token != stale and self.is_valid:
+            return self._token
+
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+
+        # Shielded so a cancelled caller doesn't cancel the refresh everyone else is waiting on
+        return await asyncio.shield(self._refresh_task)
+
+    async def _fetch(self) -> str:
         data = {
             "client_id": self.id,
             "client_secret": self.secret,
@@ -32,36 +108,145 @@ class Osu:
             'scope':"public",
         }
 
-        async with self.session.post(self.TOKEN_URL,data=data) as response:
-            return (await response.json())['access_token']
+        async with self.session.post(self.url, data=data) as response:
+            json = await response.json()
+
+        if response.status != 200 or 'access_token' not in json:
+            raise TokenRefreshFailed(f"Could not get an osu! token ({response.status}): {json.get('error', json)}")
+
+        loop = asyncio.get_running_loop()
+        expires_in = float(json.get('expires_in', 86400))
+        self._token = json['access_token']
+        self._expires_at = loop.time() + expires_in
+        self.refreshes += 1
+
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel()
+        self._refresh_handle = loop.call_later(max(expires_in - self.refresh_margin, 0), self._refresh_in_background)
+
+        logger.debug(f"Got a new osu! token, expires in {expires_in:.0f} seconds")
+        return self._token
+
+    def _refresh_in_background(self):
+        self._refresh_handle = None
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+            self._refresh_task.add_done_callback(self._log_background_failure)
+
+    def _log_background_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Background osu! token refresh failed: {task.exception()}")
+
+    def close(self):
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel()
+            self._refresh_handle = None
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+
+
+class Osu:
+    BULK_LIMIT = 50
+
+    def __init__(
+        self,
+        *,
+        client_id: int,
+        client_secret: str,
+        session: HTTPSession,
+        limiter: Optional[RateLimiter] = None,
+        max_retries: int = 3,
+        api_url: str = "https://osu.ppy.sh/api/v2",
+        token_url: str = "https://osu.ppy.sh/oauth/token"
+    ):
+        self.id = client_id
+        self.secret = client_secret
+        self.session: HTTPSession = session
+        self.API_URL = api_url
+        self.TOKEN_URL = token_url
+        self.beatmap_types = ['favourite', 'graveyard', 'loved', 'most_played', 'pending', 'ranked']
+        self.special_types = ['most_played']
+        self.score_types = ['best', 'firsts', 'recent']
+        self.tokens = TokenManager(client_id=client_id, client_secret=client_secret, session=session, url=self.TOKEN_URL)
+        self.flights = SingleFlight()
+        # osu! asks for no more than 60 requests a minute unless you've asked them for more
+        self.limiter = limiter or RateLimiter(rate=60, per=60)
+        self.max_retries = max_retries
+        # Single lookups made within a few ms of each other go out as one bulk request
+        self.user_loader: Batcher[int, User] = Batcher(self._load_users, max_batch=self.BULK_LIMIT)
+        self.beatmap_loader: Batcher[int, Beatmap] = Batcher(self._load_beatmaps, max_batch=self.BULK_LIMIT)
     
-    async def make_headers(self):
-        authorization = await self.get_token()
+    async def _request(self, method: str, url: str, **kwargs):
+        # Identical GETs already in flight share one round trip and one json decode
+        if method.upper() == "GET":
+            key = request_key(method, url, kwargs.get("params"))
+            return await self.flights.do(key, lambda: self._send(method, url, **kwargs))
+
+        return await self._send(method, url, **kwargs)
+
+    async def _send(self, method: str, url: str, **kwargs):
+        token = await self.tokens.get()
+        refreshed = False
+
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            headers = self.make_headers(token)
+            async with self.session.request(method, url, headers=headers, **kwargs) as resp:
+                # The token can be revoked before it expires, refresh once and try again
+                if resp.status == 401 and not refreshed:
+                    refreshed = True
+                    token = await self.tokens.refresh(stale=token)
+                    continue
+
+                if resp.status == 429:
+                    self.limiter.retry_after(_retry_after(resp.headers.get("Retry-After")))
+                    if attempt < self.max_retries:
+                        continue
+                    raise UpstreamUnavailable("osu! is ratelimiting us right now, try again in a minute!", "osu")
+
+                body = await resp.read()
+
+            # Decoded straight from the bytes, orjson is a lot quicker than aiohttp's json.loads on big user payloads
+            return _loads(body)
+
+        raise TokenRefreshFailed("osu! keeps rejecting our token")
+
+    async def get_token(self) -> str:
+        return await self.tokens.get()
+    
+    def make_headers(self, token: str) -> Dict[str, str]:
         headers = {
             "Content-Type": "application/json",
             "Accept": "application/json",
-            "Authorization": f"Bearer {authorization}"
+            "Authorization": f"Bearer {token}"
         }
 
         return headers
 
-    async def fetch_user(self, user: Union[str, int]) -> User:
-        headers = await self.make_headers()
+    def close(self):
+        self.tokens.close()
+
+    async def __aenter__(self) -> Osu:
+        return self
 
+    async def __aexit__(self, *args):
+        self.close()
+
+    async def fetch_user(self, user: Union[str, int], *, key: Optional[str] = None) -> User:
         params = {
             "limit":5
         }
-        json = await self._request("GET", url=self.API_URL+f"/users/{user}", headers=headers, params=params)
+        if key is not None:
+            params["key"] = key
+        json = await self._request("GET", url=self.API_URL+f"/users/{user}", params=params)
 
         if 'error' in json.keys() and json['error'] is None:
             raise NoUserFound("No user was found by that name!")
 
-        return TestUser(json)
+        return User(json)
 
     async def tests(self, method: str, /, endpoint: str, params: dict = None):
-        headers = await self.make_headers()
-        async with self.session.request(method, self.API_URL + endpoint, params=params, headers=headers) as resp:
-            json = await resp.json()
+        json = await self._request(method, self.API_URL + endpoint, params=params)
 
         return json
 
@@ -70,15 +255,15 @@ class Osu:
             types = ', '.join(self.score_types)
             raise WrongType(f"Score type must be in {types}")
 
-        headers = await self.make_headers()
-
         params = {
             "limit": limit,
             "include_fails": f"{0 if include_fails is not True else 1}"
         }
 
-        async with self.session.get(self.API_URL+f"/users/{user}/scores/{type}", headers=headers, params=params) as response:
-            json = await response.json()
+        json = await self._request("GET", self.API_URL+f"/users/{user}/scores/{type}", params=params)
+
+        if isinstance(json, dict) and 'error' in json.keys():
+            raise NoUserFound("No user was found by that name!")
 
         beatmaps = []
 
@@ -88,7 +273,6 @@ class Osu:
         return beatmaps
 
     async def fetch_user_beatmaps(self, /, user: str, type: str, limit: int) -> List[Beatmapset]:
-        headers = await self.make_headers()
         params = {
             "limit": limit
         }
@@ -97,8 +281,7 @@ class Osu:
             types = ', '.join(self.beatmap_types)
             raise WrongType(f"Beatmap type must be in {types}")
 
-        async with self.session.get(self.API_URL + f"/users/{user}/beatmapsets/{type}",headers=headers,params=params) as response:
-            json = await response.json()
+        json = await self._request("GET", self.API_URL + f"/users/{user}/beatmapsets/{type}", params=params)
     
         beatmaps = []
         
@@ -110,17 +293,52 @@ class Osu:
                 
         return beatmaps
     
-    async def get_beatmap(self, beatmap: Union[str, int]): 
-        headers = await self.make_headers()
-
-        async with self.session.get(self.API_URL+f"/beatmaps/{beatmap}", headers=headers) as resp:
-            json = await resp.json()
+    async def fetch_beatmap(self, beatmap: Union[str, int]) -> Beatmap: 
+        json = await self._request("GET", self.API_URL+f"/beatmaps/{beatmap}")
 
         if 'error' in json.keys():
             raise NoBeatMapFound("No beatmap was found by that ID!")
 
         return Beatmap(json)
 
+    get_beatmap = fetch_beatmap
+
+    async def fetch_users(self, users: Iterable[int]) -> List[User]:
+        """Bulk lookup by id, 50 per request. These are compact users so profile only fields like join date are missing"""
+        users = list(dict.fromkeys(users))
+        fetched = []
+        for start in range(0, len(users), self.BULK_LIMIT):
+            params = [("ids[]", user) for user in users[start:start + self.BULK_LIMIT]]
+            json = await self._request("GET", self.API_URL + "/users", params=params)
+            fetched.extend(User(data) for data in json.get('users', []))
+        return fetched
+
+    async def fetch_beatmaps(self, beatmaps: Iterable[int]) -> List[Beatmap]:
+        beatmaps = list(dict.fromkeys(beatmaps))
+        fetched = []
+        for start in range(0, len(beatmaps), self.BULK_LIMIT):
+            params = [("ids[]", beatmap) for beatmap in beatmaps[start:start + self.BULK_LIMIT]]
+            json = await self._request("GET", self.API_URL + "/beatmaps", params=params)
+            fetched.extend(Beatmap(data) for data in json.get('beatmaps', []))
+        return fetched
+
+    async def load_user(self, user: int) -> Optional[User]:
+        """Like fetch_users for one id, batched together with every other load_user call made around the same time"""
+        return await self.user_loader.load(int(user))
+
+    async def load_beatmap(self, beatmap: int) -> Optional[Beatmap]:
+        return await self.beatmap_loader.load(int(beatmap))
+
+    async def _load_users(self, users: List[int]) -> Dict[int, User]:
+        return {user.id: user for user in await self.fetch_users(users)}
+
+    async def _load_beatmaps(self, beatmaps: List[int]) -> Dict[int, Beatmap]:
+        return {beatmap.id: beatmap for beatmap in await self.fetch_beatmaps(beatmaps)}
+
+
+def _parse_date(value: Optional[str]) -> Optional[datetime.datetime]:
+    return datetime.datetime.fromisoformat(value.replace('Z', '')) if value else None
+
 
 class _BaseUser:
     __slots__ = (
@@ -130,7 +348,7 @@ class _BaseUser:
         "avatar_url"
     )
     def __init__(self, data: dict):
-        self._upate(data)
+        self._update(data)
 
     def _update(self, data: dict):
         self.username = data['username']
@@ -140,6 +358,9 @@ class _BaseUser:
 
 
 class TestUser(_BaseUser):
+    __slots__ = (
+        "discord",
+    )
     def __init__(self, data: dict):
         super().__init__(data)
         self.discord = data['discord']
@@ -147,28 +368,54 @@ class TestUser(_BaseUser):
 
 
 class User:
-    def __init__(self, data):
-        self.data = data
+    # Only what we show is kept, the raw response is dropped so thousands of these can sit in a cache
+    __slots__ = (
+        "username",
+        "id",
+        "avatar_url",
+        "country_code",
+        "_country_name",
+        "playstyle",
+        "playmode",
+        "follower_count",
+        "_profile_order",
+        "_join_date",
+        "global_rank",
+        "country_rank",
+        "pp",
+        "_accuracy",
+        "_grades",
+        "max_combo",
+        "level",
+        "total_hits",
+        "total_score",
+        "play_count"
+    )
+    def __init__(self, data: dict):
+        # The bulk /users endpoint only has per mode statistics
+        statistics = data.get('statistics') or (data.get('statistics_rulesets') or {}).get(data.get('playmode') or 'osu') or {}
+        country = data.get('country') or {}
         self.username = data['username']
-        self.global_rank = data.get('statistics').get("global_rank") if data.get('statistics').get("global_rank") is not None else 0
-        self.pp = data.get("statistics").get("pp")  if data.get('statistics') else "None"
-        self._rank = data.get("statistics").get("grade_counts") if data.get('statistics') else "None"
-        self.accuracy = f"{data.get('statistics').get('hit_accuracy'):,.2f}"  if data.get('statistics') else "None"
-        self.country_rank = data.get('statistics').get("country_rank") if data.get('statistics').get("country_rank") is not None else 0
-        self._profile_order = data['profile_order'] if data['profile_order'] else "Cant Get Profile Order!"
-        self.country_emoji = f":flag_{data.get('country_code').lower()}:" if data.get("country_code") else "None"
-        self.country_code = data.get("country_code") if data.get("country_code") else "None"
-        self._country = data.get("country")
-        self.avatar_url = data.get("avatar_url")
         self.id = data.get("id")
-        self.playstyle = data.get("playstyle") 
+        self.avatar_url = data.get("avatar_url")
+        self.country_code = data.get("country_code") or "None"
+        self._country_name = country.get('name')
+        self.playstyle = data.get("playstyle")
         self.playmode = data.get("playmode")
-        self.max_combo = data.get("statistics").get("maximum_combo")
-        self.level = data.get("statistics").get("level")
         self.follower_count = data.get("follower_count")
-        self.total_hits = data.get("statistics").get("total_hits")
-        self.total_score = data.get("statistics").get("total_score")
-        self.play_count = data.get("statistics").get("play_count")
+        self._profile_order = tuple(data.get('profile_order') or ())
+        self._join_date = data.get("join_date")
+        self.global_rank = statistics.get("global_rank") or 0
+        self.country_rank = statistics.get("country_rank") or 0
+        self.pp = statistics.get("pp") if statistics else "None"
+        self._accuracy = statistics.get('hit_accuracy')
+        grades = statistics.get("grade_counts") or {}
+        self._grades = (grades.get('ss', 0), grades.get('ssh', 0), grades.get('s', 0), grades.get('sh', 0), grades.get('a', 0))
+        self.max_combo = statistics.get("maximum_combo")
+        self.level = (statistics.get("level") or {}).get("current")
+        self.total_hits = statistics.get("total_hits")
+        self.total_score = statistics.get("total_score")
+        self.play_count = statistics.get("play_count")
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} username: {self.username!r}, id: {self.id}>"
@@ -176,74 +423,125 @@ class User:
     def __str__(self) -> str:
         return self.username
 
+    @property
+    def accuracy(self) -> str:
+        return f"{self._accuracy:,.2f}" if self._accuracy is not None else "None"
+
+    @property
+    def hit_accuracy(self) -> Optional[float]:
+        return self._accuracy
+
+    @property
+    def country_emoji(self) -> str:
+        return f":flag_{self.country_code.lower()}:" if self.country_code != "None" else "None"
+
+    @property
+    def profile_order(self) -> List[str]:
+        return list(self._profile_order) or ["Cant Get Profile Order!"]
 
     @property
-    def profile_order(self) -> str:
-        profile_order ='\n ​ ​ ​ ​ ​ ​ ​ ​  - '.join(x for x in self._profile_order)
-        return profile_order.replace("_", " ")
+    def rank(self) -> Dict[str, int]:
+        return dict(zip(('ss', 'ssh', 's', 'sh', 'a'), self._grades))
 
     @property
     def ranks(self) -> str:
-        ss_text = self._rank['ss']
-        ssh_text = self._rank['ssh']
-        s_text = self._rank['s']
-        sh_text = self._rank['sh']
-        a_text = self._rank['a']
+        ss_text, ssh_text, s_text, sh_text, a_text = self._grades
         return f"``SS {ss_text:,}`` | ``SSH {ssh_text:,}`` | ``S {s_text:,}`` | ``SH {sh_text:,}`` | ``A {a_text:,}``"
 
     @property
-    def joined_at(self) -> str:
-        if self.data.get("join_date"):
-           return date(datetime.datetime.strptime(self.data.get('join_date'), '%Y-%m-%dT%H:%M:%S+00:00').timestamp(), ago=True)
+    def joined_at(self) -> Optional[str]:
+        if self._join_date:
+           return date(datetime.datetime.strptime(self._join_date, '%Y-%m-%dT%H:%M:%S+00:00').timestamp(), ago=True)
 
     @property
     def country(self):
-        return [self._country['code'], self._country['name']]
-
-    @property
-    def raw(self) -> Dict[str, any]:
-        return self.data
+        return [self.country_code, self._country_name]
 
 class Beatmap:
-    def __init__(self, data):
-        self.data = data
-        self.artist = data['beatmapset']['artist']
-        self.title = data['beatmapset']['title']
-        self.beatmapset = data['beatmapset']
+    __slots__ = (
+        "artist",
+        "title",
+        "creator",
+        "beatmapset_id",
+        "difficulty_rating",
+        "id",
+        "mode",
+        "status",
+        "difficulty",
+        "checksum",
+        "cs",
+        "drain",
+        "accuracy",
+        "ar",
+        "bpm",
+        "total_length",
+        "pass_count",
+        "play_count",
+        "url",
+        "favorite_count",
+        "nsfw",
+        "max_combo",
+        "_last_updated",
+        "_ranked_date",
+        "_submitted_date",
+        "_covers"
+    )
+    def __init__(self, data: dict):
+        beatmapset = data['beatmapset']
+        self.artist = beatmapset['artist']
+        self.title = beatmapset['title']
+        self.creator = beatmapset['creator']
         self.beatmapset_id = data['beatmapset_id']
         self.difficulty_rating = data['difficulty_rating']
         self.id = data['id']
         self.mode = data['mode']
         self.status = data['status']
         self.difficulty = data['version']
+        self.checksum = data.get('checksum')
         self.cs = data['cs']
         self.drain = data['drain']
-        self.last_updated = datetime.datetime.fromisoformat(data['last_updated'].replace('Z', '')) if data['last_updated'] else None
+        self.accuracy = data.get('accuracy')
+        self.ar = data['ar']
+        self.bpm = data['bpm']
+        self.total_length = data.get('total_length')
         self.pass_count = data['passcount']
         self.play_count = data['playcount']
         self.url = data['url']    
-        self.favorite_count = data['beatmapset']['favourite_count']
-        self.nsfw = data['beatmapset']['nsfw']
-        self.ranked_date = datetime.datetime.fromisoformat(data['beatmapset']['ranked_date'].replace('Z', '')) if data['beatmapset']['ranked_date'] else None
-        self.submitted_date = datetime.datetime.fromisoformat(data['beatmapset']['submitted_date'].replace('Z', ''))  if data['beatmapset']['submitted_date'] else None
+        self.favorite_count = beatmapset['favourite_count']
+        self.nsfw = beatmapset['nsfw']
         self.max_combo = data['max_combo']
-        self.creator = data['beatmapset']['creator']
-        self.ar = data['ar']
-        self.bpm = data['bpm']
+        # Dates are kept as the raw strings and only parsed when something asks for them
+        self._last_updated = data['last_updated']
+        self._ranked_date = beatmapset['ranked_date']
+        self._submitted_date = beatmapset['submitted_date']
+        self._covers = beatmapset['covers']
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} title: {self.title!r}, artist: {self.artist!r}>"
 
+    @property
+    def last_updated(self) -> Optional[datetime.datetime]:
+        return _parse_date(self._last_updated)
+
+    @property
+    def ranked_date(self) -> Optional[datetime.datetime]:
+        return _parse_date(self._ranked_date)
+
+    @property
+    def submitted_date(self) -> Optional[datetime.datetime]:
+        return _parse_date(self._submitted_date)
+
     def covers(self, cover: str) -> str:
-        if cover not in self.data['beatmapset']['covers']:
+        if cover not in self._covers:
             return "Cover not in covers"
 
-        cover_data = self.data['beatmapset']['covers'][cover]
+        cover_data = self._covers[cover]
         return cover_data
 
 class BeatmapCompact:
     __slots__ = (
         "beatmapset_id",
+        "checksum",
         "difficulty_rating",
         "id",
         "mode",
@@ -253,10 +551,8 @@ class BeatmapCompact:
         "version"
     )
     def __init__(self, data: dict):
-        keys = {k: v for k, v in data.items() if k in self.__slots__}
-        for k,v in keys.items():
-            setattr(self, k, v)
-            continue
+        for k in self.__slots__:
+            setattr(self, k, data.get(k))
 
 
 
@@ -280,30 +576,63 @@ class Beatmapset:
         "track_id",
         "user_id",
         "video",
+        "_covers",
     )
 
     def __init__(self, data: dict):
-        keys = {k: v for k, v in data.items() if k in self.__slots__}
-        for k,v in keys.items():
-            setattr(self, k, v)
-            continue
+        for k in self.__slots__[:-1]:
+            setattr(self, k, data.get(k))
 
-        self.data = data
+        self._covers = data.get('covers') or {}
 
     def covers(self, cover: str) -> str:
-        if cover not in self.data['covers']:
-            covers = ', '.join(self.data['covers'])
+        if cover not in self._covers:
+            covers = ', '.join(self._covers)
             return f"Cover not in covers!\nChoose from {covers}"
 
-        cover_data = self.data['covers'][cover]
+        cover_data = self._covers[cover]
         return cover_data
 
 class Score:
+    __slots__ = (
+        "id",
+        "best_id",
+        "user_id",
+        "accuracy",
+        "mods",
+        "score",
+        "max_combo",
+        "perfect",
+        "passed",
+        "pp",
+        "rank",
+        "mode",
+        "statistics",
+        "_created_at",
+        "beatmap",
+        "beatmapset"
+    )
     def __init__(self, data: dict):
-        keys = {k: v for k, v in data.items()}
-        for k, v in keys.items():
-            setattr(self, k, v)
-            continue
-
+        self.id = data.get('id')
+        self.best_id = data.get('best_id')
+        self.user_id = data.get('user_id')
+        self.accuracy = data.get('accuracy')
+        self.mods = data.get('mods', [])
+        self.score = data.get('score')
+        self.max_combo = data.get('max_combo')
+        self.perfect = data.get('perfect')
+        self.passed = data.get('passed')
+        self.pp = data.get('pp')
+        self.rank = data.get('rank')
+        self.mode = data.get('mode')
+        self.statistics = data.get('statistics')
+        self._created_at = data.get('created_at')
         self.beatmapset = Beatmapset(data['beatmapset'])
-        self.beatmap = BeatmapCompact(data['beatmap'])
\ No newline at end of file
+        self.beatmap = BeatmapCompact(data['beatmap'])
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} id: {self.id}, pp: {self.pp}, rank: {self.rank!r}>"
+
+    @property
+    def created_at(self) -> Optional[datetime.datetime]:
+        return _parse_date(self._created_at)
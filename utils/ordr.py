@@ -0,0 +1,232 @@
+from __future__ import annotations
+import asyncio
+import logging
+import random
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, List, Optional
+import aiohttp
+from .constants import error_codes
+from .osu_errors import OsuBaseException, RenderFailed
+
+if TYPE_CHECKING:
+    import socketio
+    from .upstream import HTTPSession
+
+__all__ = (
+    "OrdrWebsocket",
+    "PendingRender",
+)
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class PendingRender:
+    __slots__ = (
+        "render_id",
+        "future",
+        "deadline",
+        "callbacks",
+        "waiters"
+    )
+    def __init__(self, render_id: int, future: asyncio.Future, deadline: float):
+        self.render_id = render_id
+        self.future = future
+        self.deadline = deadline
+        self.callbacks: List[ProgressCallback] = []
+        self.waiters = 0
+
+
+class OrdrWebsocket:
+    """One long lived o!rdr websocket that hands render events to whoever is waiting on that renderID
+
+    Events sent while we weren't connected are never sent again, so with ``session`` and ``api_url``
+    the pending renders are looked up in o!rdr's render list after every (re)connect and on ``check``.
+    """
+    def __init__(
+        self,
+        *,
+        url: str = "https://ordr-ws.issou.best",
+        api_url: Optional[str] = None,
+        session: Optional[HTTPSession] = None,
+        render_timeout: float = 900.0,
+        max_backoff: float = 300.0
+    ):
+        self.url = url
+        self.api_url = api_url
+        self.session = session
+        self.render_timeout = render_timeout
+        self.max_backoff = max_backoff
+        self.pending: Dict[int, PendingRender] = {}
+        self.reconnects = 0
+        self.recovered = 0
+        # socketio is slow to import, it's only needed once we connect
+        self._sio: Optional[socketio.AsyncClient] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._sweeper: Optional[asyncio.Task] = None
+        self._checker: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._sio is not None and self._sio.connected
+
+    def start(self):
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def close(self):
+        for task in (self._runner, self._sweeper):
+            if task is not None:
+                task.cancel()
+
+        self._runner = self._sweeper = None
+        if self._checker is not None:
+            self._checker.cancel()
+            self._checker = None
+        if self.connected:
+            await self._sio.disconnect()
+
+        for pending in self.pending.values():
+            if not pending.future.done():
+                pending.future.cancel()
+        self.pending.clear()
+
+    def register(self, render_id: int, *, on_progress: Optional[ProgressCallback] = None, timeout: Optional[float] = None) -> asyncio.Future:
+        """Returns a future that resolves with the render_done_json payload for ``render_id``
+
+        Every caller gets its own future, so one waiter being cancelled doesn't cancel the render for the others.
+        Call this as soon as the renderID is known, events that come in before it are lost.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.render_timeout)
+        pending = self.pending.get(render_id)
+        if pending is None:
+            pending = PendingRender(render_id, loop.create_future(), deadline)
+            # Mark the exception as retrieved in case every waiter was cancelled
+            pending.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+            self.pending[render_id] = pending
+        else:
+            pending.deadline = max(pending.deadline, deadline)
+
+        if on_progress is not None:
+            pending.callbacks.append(on_progress)
+        pending.waiters += 1
+        waiter = asyncio.shield(pending.future)
+        waiter.add_done_callback(lambda waiter: self._unregister(pending, on_progress, waiter))
+        return waiter
+
+    def _unregister(self, pending: PendingRender, on_progress: Optional[ProgressCallback], waiter: asyncio.Future):
+        pending.waiters -= 1
+        if not waiter.cancelled():
+            return
+
+        if on_progress is not None and on_progress in pending.callbacks:
+            pending.callbacks.remove(on_progress)
+        if pending.waiters == 0 and not pending.future.done():
+            # Nobody is waiting on this render anymore
+            if self.pending.get(pending.render_id) is pending:
+                del self.pending[pending.render_id]
+            pending.future.cancel()
+
+    async def check(self, render_ids: Optional[Iterable[int]] = None) -> int:
+        """Resolves pending renders that o!rdr's render list says are finished, returns how many were"""
+        if self.session is None or self.api_url is None:
+            return 0
+
+        resolved = 0
+        for render_id in list(self.pending if render_ids is None else render_ids):
+            if render_id not in self.pending:
+                continue
+            try:
+                async with self.session.get(f"{self.api_url}/renders", params={"renderID": render_id}) as resp:
+                    resp.raise_for_status()
+                    data = await resp.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, OsuBaseException) as e:
+                logger.warning(f"Could not look up render {render_id} on o!rdr: {e!r}")
+                continue
+
+            render = next((render for render in data.get("renders", []) if render.get("renderID") == render_id), None)
+            if render is None:
+                continue
+            if render.get("errorCode"):
+                await self._on_failed(render)
+            elif render.get("videoUrl") and str(render.get("progress", "")).startswith("Done"):
+                await self._on_done(render)
+            else:
+                continue
+            resolved += 1
+
+        self.recovered += resolved
+        return resolved
+
+    async def _check_all(self):
+        try:
+            resolved = await self.check()
+        except Exception as e:
+            logger.exception("Checking pending renders failed", exc_info=e)
+        else:
+            if resolved:
+                logger.info(f"Resolved {resolved} renders that finished while the websocket was down")
+
+    async def _run(self):
+        import socketio
+
+        if self._sio is None:
+            self._sio = socketio.AsyncClient(reconnection=False)
+            self._sio.on("render_progress_json", self._on_progress)
+            self._sio.on("render_done_json", self._on_done)
+            self._sio.on("render_failed_json", self._on_failed)
+
+        backoff = 1.0
+        while True:
+            try:
+                await self._sio.connect(self.url, transports=["websocket"])
+                logger.info(f"Connected to the o!rdr websocket ({len(self.pending)} renders pending)")
+                backoff = 1.0
+                if self.pending and (self._checker is None or self._checker.done()):
+                    # Anything that finished while we were disconnected won't be sent again
+                    self._checker = asyncio.create_task(self._check_all())
+                await self._sio.wait()
+            except socketio.exceptions.ConnectionError as e:
+                logger.warning(f"Could not connect to the o!rdr websocket: {e}")
+
+            self.reconnects += 1
+            delay = random.uniform(backoff / 2, backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+            logger.info(f"o!rdr websocket closed, reconnecting in {delay:.1f} seconds")
+            await asyncio.sleep(delay)
+
+    async def _sweep(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(30)
+            now = loop.time()
+            expired = [render_id for render_id, pending in self.pending.items() if pending.deadline <= now]
+            for render_id in expired:
+                pending = self.pending.pop(render_id)
+                if not pending.future.done():
+                    pending.future.set_exception(asyncio.TimeoutError(f"Render {render_id} timed out"))
+
+    async def _on_progress(self, data: Dict[str, Any]):
+        pending = self.pending.get(data.get("renderID"))
+        if pending is None:
+            return
+
+        for on_progress in list(pending.callbacks):
+            try:
+                await on_progress(data)
+            except Exception as e:
+                logger.warning(f"Render progress callback for {pending.render_id} failed: {e}")
+
+    async def _on_done(self, data: Dict[str, Any]):
+        pending = self.pending.pop(data.get("renderID"), None)
+        if pending is not None and not pending.future.done():
+            pending.future.set_result(data)
+
+    async def _on_failed(self, data: Dict[str, Any]):
+        pending = self.pending.pop(data.get("renderID"), None)
+        if pending is not None and not pending.future.done():
+            code = data.get("errorCode")
+            message = error_codes.get(code, data.get("errorMessage", "unknown error from o!rdr"))
+            pending.future.set_exception(RenderFailed(message, code))
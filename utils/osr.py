@@ -0,0 +1,189 @@
+from __future__ import annotations
+import datetime
+import re
+import struct
+from typing import Optional, Tuple, Union
+from .constants import error_codes
+from .osu_errors import InvalidReplay
+
+__all__ = (
+    "ReplayHeader",
+    "ReplayHeaderParser",
+    "parse_replay_header",
+)
+
+AUTOPLAY = 1 << 11
+CINEMA = 1 << 22
+# What osu! itself allows in a username
+USERNAME_RE = re.compile(r"^[A-Za-z0-9_\-\[\] ]{1,15}$")
+
+_BYTE = struct.Struct("<B")
+_INT = struct.Struct("<i")
+_SHORT_COUNTS = struct.Struct("<6H")
+_SCORE = struct.Struct("<iHBi")
+_TAIL = struct.Struct("<qi")
+# Windows ticks at the unix epoch
+_EPOCH_TICKS = 621355968000000000
+
+
+class _NeedMore(Exception):
+    pass
+
+
+class ReplayHeader:
+    __slots__ = (
+        "mode",
+        "version",
+        "beatmap_md5",
+        "player_name",
+        "replay_md5",
+        "count_300",
+        "count_100",
+        "count_50",
+        "count_geki",
+        "count_katu",
+        "count_miss",
+        "score",
+        "max_combo",
+        "perfect",
+        "mods",
+        "_ticks",
+        "replay_length",
+        "data_offset"
+    )
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} player: {self.player_name!r}, beatmap: {self.beatmap_md5}, mode: {self.mode}>"
+
+    @property
+    def timestamp(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp((self._ticks - _EPOCH_TICKS) / 10_000_000, datetime.timezone.utc)
+
+    @property
+    def size(self) -> int:
+        """How many bytes the replay should be up to the end of the replay data"""
+        return self.data_offset + self.replay_length
+
+    def check(self) -> Optional[int]:
+        """Returns the o!rdr error code this replay would fail with, if we can tell locally"""
+        if self.mode != 0:
+            return 6
+        if self.mods & (AUTOPLAY | CINEMA):
+            return 11
+        if self.replay_length <= 0:
+            return 7
+        if not USERNAME_RE.match(self.player_name):
+            return 12
+        return None
+
+    def validate(self):
+        code = self.check()
+        if code is not None:
+            raise InvalidReplay(error_codes[code], code)
+
+
+def _read_uleb128(data: memoryview, offset: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise _NeedMore
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, offset
+        shift += 7
+        if shift > 35:
+            raise InvalidReplay(error_codes[5], 5)
+
+
+def _read_string(data: memoryview, offset: int) -> Tuple[str, int]:
+    if offset >= len(data):
+        raise _NeedMore
+    marker = data[offset]
+    if marker == 0x00:
+        return "", offset + 1
+    if marker != 0x0B:
+        raise InvalidReplay(error_codes[5], 5)
+
+    length, offset = _read_uleb128(data, offset + 1)
+    end = offset + length
+    if end > len(data):
+        raise _NeedMore
+    try:
+        return str(data[offset:end], "utf-8"), end
+    except UnicodeDecodeError:
+        raise InvalidReplay(error_codes[5], 5) from None
+
+
+def _unpack(fmt: struct.Struct, data: memoryview, offset: int) -> Tuple[tuple, int]:
+    end = offset + fmt.size
+    if end > len(data):
+        raise _NeedMore
+    return fmt.unpack_from(data, offset), end
+
+
+def _parse(data: Union[bytes, bytearray, memoryview]) -> ReplayHeader:
+    view = memoryview(data)
+    header = ReplayHeader()
+    (header.mode,), offset = _unpack(_BYTE, view, 0)
+    (header.version,), offset = _unpack(_INT, view, offset)
+    header.beatmap_md5, offset = _read_string(view, offset)
+    header.player_name, offset = _read_string(view, offset)
+    header.replay_md5, offset = _read_string(view, offset)
+    (
+        header.count_300,
+        header.count_100,
+        header.count_50,
+        header.count_geki,
+        header.count_katu,
+        header.count_miss,
+    ), offset = _unpack(_SHORT_COUNTS, view, offset)
+    (header.score, header.max_combo, header.perfect, header.mods), offset = _unpack(_SCORE, view, offset)
+    _, offset = _read_string(view, offset)  # life bar graph, nobody needs it
+    (header._ticks, header.replay_length), offset = _unpack(_TAIL, view, offset)
+    header.data_offset = offset
+    return header
+
+
+def parse_replay_header(data: Union[bytes, bytearray, memoryview]) -> ReplayHeader:
+    """Parses the header of a complete (or at least header long) replay"""
+    try:
+        return _parse(data)
+    except _NeedMore:
+        raise InvalidReplay(error_codes[5], 5) from None
+
+
+class ReplayHeaderParser:
+    """Incremental header parser, feed it chunks as they download.
+
+    Only the header is buffered, once it's parsed the rest of the replay is
+    just counted so we can tell if the replay data got cut off.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self.header: Optional[ReplayHeader] = None
+        self.total = 0
+
+    def feed(self, chunk: bytes) -> Optional[ReplayHeader]:
+        self.total += len(chunk)
+        if self.header is not None:
+            return self.header
+
+        self._buffer += chunk
+        try:
+            self.header = _parse(self._buffer)
+        except _NeedMore:
+            return None
+
+        self._buffer = bytearray()
+        return self.header
+
+    def close(self) -> ReplayHeader:
+        """Call once the download finished, raises if the replay is truncated or fails the local checks"""
+        if self.header is None or self.total < self.header.size:
+            raise InvalidReplay(error_codes[5], 5)
+
+        self.header.validate()
+        return self.header
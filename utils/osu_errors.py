@@ -12,4 +12,44 @@ class NoBeatMapFound(OsuBaseException):
 
 class WrongType(OsuBaseException):
     """Returned when an wrong type for a Score or Beatmap is found"""
-    pass
\ No newline at end of file
+    pass
+
+class TokenRefreshFailed(OsuBaseException):
+    """Returned when the osu! oauth endpoint refuses to give us a token"""
+    pass
+
+class RenderFailed(OsuBaseException):
+    """Returned when o!rdr reports that a render failed"""
+    def __init__(self, message: str, error_code: int = None):
+        super().__init__(message)
+        self.error_code = error_code
+
+class ReplayTooLarge(OsuBaseException):
+    """Returned when a replay file is bigger than we're willing to download"""
+    pass
+
+class InvalidReplay(OsuBaseException):
+    """Returned when a replay fails our checks before it gets sent to o!rdr, ``error_code`` matches o!rdr's"""
+    def __init__(self, message: str, error_code: int):
+        super().__init__(message)
+        self.error_code = error_code
+
+class InvalidBeatmap(OsuBaseException):
+    """Returned when a .osu file can't be downloaded or parsed for difficulty calculation"""
+    pass
+
+class UpstreamUnavailable(OsuBaseException):
+    """Returned when osu!, o!rdr or a file host keeps failing or its circuit breaker is open, the message is safe to show users"""
+    def __init__(self, message: str, upstream: str):
+        super().__init__(message)
+        self.upstream = upstream
+
+class UpstreamOverloaded(UpstreamUnavailable):
+    """Returned when a request gave up waiting for a free slot in an upstream's concurrency limit"""
+    pass
+
+class RetryLater(OsuBaseException):
+    """Raised by a render job handler to put the job back in the queue for another try in ``delay`` seconds"""
+    def __init__(self, message: str, delay: float = 60.0):
+        super().__init__(message)
+        self.delay = delay
@@ -0,0 +1,166 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+import enum
+import heapq
+import itertools
+import logging
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+__all__ = (
+    "Priority",
+    "RateLimiter",
+    "priority",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    HIGH = 0
+    LOW = 1
+
+
+_current_priority: ContextVar[Priority] = ContextVar("osu_request_priority", default=Priority.HIGH)
+
+
+@contextlib.contextmanager
+def priority(lane: Priority) -> Iterator[None]:
+    """Runs every limited call made inside the block (and tasks created in it) in ``lane``"""
+    token = _current_priority.set(lane)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class RateLimiter:
+    """Token bucket where queued high priority calls always go before low priority ones.
+
+    Low priority calls also leave ``reserve`` tokens untouched, so interactive
+    commands still have headroom while background work is draining the bucket.
+    """
+    def __init__(self, *, rate: float, per: float = 60.0, burst: Optional[int] = None, reserve: float = 0.2):
+        self.rate = rate / per
+        self.burst = burst or max(int(rate), 1)
+        self.reserve = self.burst * reserve
+        self.tokens = float(self.burst)
+        self._updated: Optional[float] = None
+        self._paused_until = 0.0
+        self._waiters: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self.acquired = 0
+        self.queued = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        depth = {lane: 0 for lane in Priority}
+        for lane, _, _, future in self._waiters:
+            if not future.done():
+                depth[Priority(lane)] += 1
+
+        return {
+            "tokens": round(self.tokens, 2),
+            "queue_high": depth[Priority.HIGH],
+            "queue_low": depth[Priority.LOW],
+            "acquired": self.acquired,
+            "queued": self.queued,
+            "throttled": self.throttled,
+            "avg_wait_ms": round(self.total_wait / self.queued * 1000, 2) if self.queued else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+    def _refill(self, now: float):
+        if self._updated is None:
+            self._updated = now
+        elif now > self._updated:
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def _can_take(self, lane: Priority, now: float) -> bool:
+        if now < self._paused_until:
+            return False
+        return self.tokens >= (1 + self.reserve if lane is Priority.LOW else 1)
+
+    async def acquire(self, lane: Optional[Priority] = None):
+        lane = _current_priority.get() if lane is None else lane
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._refill(now)
+
+        if not self._waiters and self._can_take(lane, now):
+            self.tokens -= 1
+            self.acquired += 1
+            return
+
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (lane, next(self._counter), now, future))
+        self.queued += 1
+        self._schedule()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # We were handed a token right as we got cancelled, give it back
+            if future.done() and not future.cancelled():
+                self.tokens += 1
+                self._schedule()
+            raise
+
+    def retry_after(self, seconds: float):
+        """Stops handing out tokens for ``seconds``, used when upstream answers with a 429"""
+        loop = asyncio.get_running_loop()
+        self.throttled += 1
+        self.tokens = 0
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+        # Nothing refills while we're paused
+        self._updated = self._paused_until
+        logger.warning(f"osu! api throttled us, pausing requests for {seconds:.1f} seconds")
+        self._schedule()
+
+    def _schedule(self):
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+
+        while self._waiters and self._waiters[0][3].done():
+            heapq.heappop(self._waiters)
+
+        if not self._waiters:
+            return
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._refill(now)
+        lane = Priority(self._waiters[0][0])
+        needed = (1 + self.reserve if lane is Priority.LOW else 1) - self.tokens
+        delay = max(needed / self.rate, self._paused_until - now, 0)
+        self._wakeup = loop.call_later(delay, self._release)
+
+    def _release(self):
+        self._wakeup = None
+        now = asyncio.get_running_loop().time()
+        self._refill(now)
+
+        while self._waiters:
+            lane, _, enqueued, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_take(Priority(lane), now):
+                break
+
+            heapq.heappop(self._waiters)
+            self.tokens -= 1
+            self.acquired += 1
+            waited = now - enqueued
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            future.set_result(None)
+
+        self._schedule()
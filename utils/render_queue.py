@@ -0,0 +1,228 @@
+from __future__ import annotations
+import asyncio
+import datetime
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+import asyncpg
+from .metrics import DEGRADED
+from .osu_errors import RetryLater
+
+__all__ = (
+    "RenderQueue",
+)
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[asyncpg.Record], Awaitable[bool]]
+
+# Claims take this transaction lock first. The per user and guild caps are counts, two claims
+# running at once would both see room for the same user and go over them
+CLAIM_LOCK = 0x72656e64
+
+# A job is claimed with a lease that its worker keeps extending, if the process dies
+# the lease runs out and any process picks the job back up. A queued job's lease is when
+# it may be retried, for jobs put back because an upstream was overloaded
+CLAIM_QUERY = """
+    UPDATE render_jobs SET status = 'rendering', leased_until = (now() at time zone 'utc') + $3::interval,
+        started_at = COALESCE(started_at, now() at time zone 'utc')
+    WHERE id = (
+        SELECT j.id FROM render_jobs j
+        WHERE (
+            (j.status = 'queued' AND (j.leased_until IS NULL OR j.leased_until < now() at time zone 'utc'))
+            OR (j.status = 'rendering' AND j.leased_until < now() at time zone 'utc')
+        )
+        AND (
+            SELECT count(*) FROM render_jobs r
+            WHERE r.status = 'rendering' AND r.user_id = j.user_id AND r.leased_until > now() at time zone 'utc'
+        ) < $1
+        AND (j.guild_id IS NULL OR (
+            SELECT count(*) FROM render_jobs r
+            WHERE r.status = 'rendering' AND r.guild_id = j.guild_id AND r.leased_until > now() at time zone 'utc'
+        ) < $2)
+        ORDER BY j.id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING *
+"""
+
+
+class RenderQueue:
+    """Replay renders persisted in postgres and worked through by a fixed size pool of workers.
+
+    Each user and guild can only have so many renders running at once so one
+    busy server can't take every worker, and jobs outlive restarts.
+    """
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        *,
+        workers: int = 4,
+        per_user: int = 1,
+        per_guild: int = 2,
+        lease: datetime.timedelta = datetime.timedelta(minutes=2),
+        poll_interval: float = 5.0,
+        retry_for: datetime.timedelta = datetime.timedelta(minutes=30)
+    ):
+        self.pool = pool
+        self.workers = workers
+        self.per_user = per_user
+        self.per_guild = per_guild
+        self.lease = lease
+        self.poll_interval = poll_interval
+        # How long after being queued a job can still be put back with RetryLater
+        self.retry_for = retry_for
+        self._handler: Optional[JobHandler] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running: Set[int] = set()
+        self._wakeup = asyncio.Event()
+        self.processed = 0
+        self.failed = 0
+        self.requeued = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"workers": self.workers, "running": len(self._running), "processed": self.processed, "failed": self.failed, "requeued": self.requeued}
+
+    def start(self, handler: JobHandler):
+        """Starts the workers, ``handler`` renders one job and returns whether it succeeded
+
+        It can raise ``RetryLater`` to put the job back in the queue for another try later.
+        """
+        if self._tasks:
+            return
+
+        self._handler = handler
+        self._tasks = [asyncio.create_task(self._worker(number)) for number in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        # Cancelled workers drop their job from _running on the way out, so take it first
+        running = list(self._running)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # Hand our jobs back right away instead of making others wait out the lease
+        if running:
+            await self.pool.execute("UPDATE render_jobs SET leased_until = (now() at time zone 'utc') - interval '1 second' WHERE id = ANY($1::int[]) AND status = 'rendering'", running)
+        self._running.clear()
+
+    async def enqueue(self, *, user_id: int, guild_id: Optional[int], channel_id: int, message_id: int, replay_url: str, skin_id: int) -> int:
+        query = """
+            INSERT INTO render_jobs (user_id, guild_id, channel_id, message_id, replay_url, skin_id)
+            VALUES($1, $2, $3, $4, $5, $6)
+            RETURNING id
+        """
+        job_id = await self.pool.fetchval(query, user_id, guild_id, channel_id, message_id, replay_url, skin_id)
+        self._wakeup.set()
+        return job_id
+
+    async def set_render(self, job_id: int, replay_hash: bytes, render_id: int):
+        await self.pool.execute("UPDATE render_jobs SET replay_hash = $2, render_id = $3 WHERE id = $1", job_id, replay_hash, render_id)
+
+    async def position(self, job_id: int) -> int:
+        """1 based position among queued jobs"""
+        return await self.pool.fetchval("SELECT count(*) FROM render_jobs WHERE status = 'queued' AND id <= $1", job_id)
+
+    async def average_duration(self) -> datetime.timedelta:
+        query = """
+            SELECT avg(finished_at - started_at) FROM (
+                SELECT finished_at, started_at FROM render_jobs
+                WHERE status = 'done' ORDER BY finished_at DESC LIMIT 50
+            ) recent
+        """
+        return await self.pool.fetchval(query) or datetime.timedelta(minutes=1)
+
+    async def eta(self, position: int) -> datetime.timedelta:
+        rounds = -(-position // self.workers)
+        return await self.average_duration() * rounds
+
+    async def pending_for(self, user_id: int) -> List[asyncpg.Record]:
+        query = """
+            SELECT id, status, replay_url, created_at FROM render_jobs
+            WHERE user_id = $1 AND status IN ('queued', 'rendering')
+            ORDER BY id
+        """
+        return await self.pool.fetch(query, user_id)
+
+    def can_retry(self, job: asyncpg.Record) -> bool:
+        return job['created_at'] + self.retry_for > datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    async def _claim(self) -> Optional[asyncpg.Record]:
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", CLAIM_LOCK)
+                return await conn.fetchrow(CLAIM_QUERY, self.per_user, self.per_guild, self.lease)
+
+    async def _finish(self, job_id: int, status: str):
+        query = "UPDATE render_jobs SET status = $2, finished_at = now() at time zone 'utc', leased_until = NULL WHERE id = $1"
+        await self.pool.execute(query, job_id, status)
+
+    async def _requeue(self, job_id: int, delay: datetime.timedelta):
+        query = "UPDATE render_jobs SET status = 'queued', leased_until = (now() at time zone 'utc') + $2::interval WHERE id = $1"
+        await self.pool.execute(query, job_id, delay)
+
+    async def _worker(self, number: int):
+        while True:
+            try:
+                job = await self._claim()
+            except (asyncpg.PostgresError, OSError) as e:
+                logger.warning(f"Render worker {number} could not claim a job: {e!r}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._running.add(job['id'])
+            try:
+                succeeded = await self._handler(job)
+            except RetryLater as e:
+                logger.info(f"Render job {job['id']} retrying in {e.delay}s: {e}")
+                self.requeued += 1
+                DEGRADED.inc("requeued", "replay render")
+                try:
+                    await self._requeue(job['id'], datetime.timedelta(seconds=e.delay))
+                except (asyncpg.PostgresError, OSError) as e:
+                    # The lease runs out and the job gets picked up again anyway
+                    logger.warning(f"Could not requeue render job {job['id']}: {e!r}")
+                continue
+            except Exception as e:
+                logger.exception(f"Render job {job['id']} crashed", exc_info=e)
+                succeeded = False
+            finally:
+                self._running.discard(job['id'])
+
+            self.processed += 1
+            if not succeeded:
+                self.failed += 1
+            status = "done" if succeeded else "failed"
+            try:
+                await self._finish(job['id'], status)
+            except (asyncpg.PostgresError, OSError) as e:
+                # Same as a crash, the lease runs out and the job is retried
+                logger.warning(f"Could not mark render job {job['id']} {status}: {e!r}")
+            # A finished job might free up a user or guild that had more queued
+            self._wakeup.set()
+
+    async def _heartbeat(self):
+        interval = self.lease.total_seconds() / 3
+        while True:
+            await asyncio.sleep(interval)
+            if not self._running:
+                continue
+
+            try:
+                await self.pool.execute(
+                    "UPDATE render_jobs SET leased_until = (now() at time zone 'utc') + $2::interval WHERE id = ANY($1::int[])",
+                    list(self._running),
+                    self.lease
+                )
+            except (asyncpg.PostgresError, OSError) as e:
+                logger.warning(f"Could not extend render job leases: {e!r}")
@@ -0,0 +1,74 @@
+from __future__ import annotations
+import datetime
+import hashlib
+import logging
+from typing import Optional, Tuple
+import asyncpg
+from .osr import ReplayHeader, ReplayHeaderParser
+from .osu_errors import ReplayTooLarge
+from .upstream import HTTPSession
+
+__all__ = (
+    "RenderCache",
+    "read_replay",
+)
+
+logger = logging.getLogger(__name__)
+
+# Real replays are a few hundred KB at most, anything past this isn't worth downloading
+MAX_REPLAY_BYTES = 8 * 1024 * 1024
+
+
+async def read_replay(session: HTTPSession, url: str, *, max_bytes: int = MAX_REPLAY_BYTES) -> Tuple[bytes, ReplayHeader]:
+    """Streams the replay at ``url`` once, returning its sha256 and parsed header.
+
+    Raises InvalidReplay for replays o!rdr would reject anyway, so they never get submitted.
+    """
+    too_large = ReplayTooLarge(f"That replay is bigger than {max_bytes // 1024 // 1024}MB!")
+    digest = hashlib.sha256()
+    parser = ReplayHeaderParser()
+    async with session.get(url) as resp:
+        resp.raise_for_status()
+        if resp.content_length is not None and resp.content_length > max_bytes:
+            raise too_large
+
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            if parser.total + len(chunk) > max_bytes:
+                raise too_large
+            digest.update(chunk)
+            parser.feed(chunk)
+
+    return digest.digest(), parser.close()
+
+
+class RenderCache:
+    """``(replay hash, skin) -> render`` in postgres so reposted replays don't get rendered twice"""
+    def __init__(self, pool: asyncpg.Pool, *, pending_for: datetime.timedelta = datetime.timedelta(minutes=15)):
+        self.pool = pool
+        # How long a render without a video is trusted to still be in progress
+        self.pending_for = pending_for
+
+    async def lookup(self, replay_hash: bytes, skin_id: int) -> Optional[asyncpg.Record]:
+        """Returns the finished or still pending render for this replay, if there is one"""
+        query = """
+            SELECT render_id, video_url FROM replay_renders
+            WHERE replay_hash = $1 AND skin_id = $2
+            AND (video_url IS NOT NULL OR created_at > (now() at time zone 'utc') - $3::interval)
+        """
+        return await self.pool.fetchrow(query, replay_hash, skin_id, self.pending_for)
+
+    async def claim(self, replay_hash: bytes, skin_id: int, render_id: int):
+        query = """
+            INSERT INTO replay_renders (replay_hash, skin_id, render_id) VALUES($1, $2, $3)
+            ON CONFLICT(replay_hash, skin_id) DO
+            UPDATE SET render_id = excluded.render_id, video_url = NULL, created_at = excluded.created_at
+        """
+        await self.pool.execute(query, replay_hash, skin_id, render_id)
+
+    async def complete(self, replay_hash: bytes, skin_id: int, render_id: int, video_url: str):
+        query = "UPDATE replay_renders SET video_url = $4 WHERE replay_hash = $1 AND skin_id = $2 AND render_id = $3"
+        await self.pool.execute(query, replay_hash, skin_id, render_id, video_url)
+
+    async def forget(self, replay_hash: bytes, skin_id: int, render_id: int):
+        query = "DELETE FROM replay_renders WHERE replay_hash = $1 AND skin_id = $2 AND render_id = $3 AND video_url IS NULL"
+        await self.pool.execute(query, replay_hash, skin_id, render_id)
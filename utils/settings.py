@@ -0,0 +1,114 @@
+from __future__ import annotations
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import asyncpg
+
+__all__ = (
+    "UserSettings",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _SettingTable:
+    """One ``user_id -> value`` table kept in a bounded LRU, misses go to postgres lazily"""
+    def __init__(self, pool: asyncpg.Pool, table: str, column: str, max_entries: int):
+        self.pool = pool
+        self.table = table
+        self.column = column
+        self.max_entries = max_entries
+        self._values: OrderedDict[int, Any] = OrderedDict()
+        # True while every row of the table is in memory, then a miss means the user has no row
+        self.complete = False
+        # Changes applied while a load's SELECT is in flight, they're newer than what it returns
+        self._pending: Optional[Dict[int, Any]] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._values), "complete": self.complete, "hits": self.hits, "misses": self.misses}
+
+    async def load(self):
+        self._pending = {}
+        try:
+            rows = await self.pool.fetch(f"SELECT user_id, {self.column} FROM {self.table} LIMIT $1", self.max_entries + 1)
+            pending = self._pending
+        finally:
+            self._pending = None
+
+        self._values = OrderedDict((row['user_id'], row[self.column]) for row in rows[:self.max_entries])
+        self.complete = len(rows) <= self.max_entries
+        for user_id, value in pending.items():
+            self.apply(user_id, value)
+        logger.info(f"Loaded {len(self._values)} rows from {self.table} ({'complete' if self.complete else 'partial'})")
+
+    async def get(self, user_id: int) -> Any:
+        if user_id in self._values:
+            self.hits += 1
+            self._values.move_to_end(user_id)
+            return self._values[user_id]
+
+        if self.complete:
+            self.hits += 1
+            return None
+
+        self.misses += 1
+        value = await self.pool.fetchval(f"SELECT {self.column} FROM {self.table} WHERE user_id = $1", user_id)
+        # Negative results are cached too so users without settings don't hit postgres every time
+        self.apply(user_id, value)
+        return value
+
+    async def set(self, user_id: int, value: Any):
+        query = f"""
+            INSERT INTO {self.table} ({self.column}, user_id) VALUES($1, $2)
+            ON CONFLICT(user_id) DO 
+            UPDATE SET {self.column} = excluded.{self.column}
+        """
+        await self.pool.execute(query, value, user_id)
+        self.apply(user_id, value)
+
+    def apply(self, user_id: int, value: Any):
+        if self._pending is not None:
+            self._pending[user_id] = value
+        self._values[user_id] = value
+        self._values.move_to_end(user_id)
+        while len(self._values) > self.max_entries:
+            self._values.popitem(last=False)
+            self.complete = False
+
+    def on_change(self, op: str, row: Dict[str, Any]):
+        """Applies a row change made by another process, see utils/notify.py"""
+        self.apply(row['user_id'], None if op == "DELETE" else row[self.column])
+
+    def discard(self, user_id: int):
+        self._values.pop(user_id, None)
+        self.complete = False
+
+
+class UserSettings:
+    """Write-through cache for per-user settings (``osu_user`` and ``replay_config``)"""
+    def __init__(self, pool: asyncpg.Pool, *, max_entries: int = 100_000):
+        self.usernames = _SettingTable(pool, "osu_user", "osu_username", max_entries)
+        self.skins = _SettingTable(pool, "replay_config", "skin_id", max_entries)
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {"osu_user": self.usernames.stats, "replay_config": self.skins.stats}
+
+    async def load(self):
+        await asyncio.gather(self.usernames.load(), self.skins.load())
+
+    async def get_osu_username(self, user_id: int) -> Optional[str]:
+        return await self.usernames.get(user_id)
+
+    async def set_osu_username(self, user_id: int, username: str):
+        await self.usernames.set(user_id, username)
+
+    async def get_skin(self, user_id: int) -> Optional[int]:
+        return await self.skins.get(user_id)
+
+    async def set_skin(self, user_id: int, skin_id: int):
+        await self.skins.set(user_id, skin_id)
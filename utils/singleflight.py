@@ -0,0 +1,52 @@
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Sequence, Tuple, TypeVar, Union
+
+__all__ = (
+    "SingleFlight",
+    "request_key",
+)
+
+T = TypeVar("T")
+
+
+def request_key(method: str, url: str, params: Optional[Union[Dict[str, Any], Sequence[Tuple[str, Any]]]] = None) -> Hashable:
+    """Hashable key for a request, params order doesn't matter"""
+    items = params.items() if isinstance(params, dict) else (params or ())
+    frozen = tuple(sorted((str(k), str(v)) for k, v in items))
+    return (method.upper(), url, frozen)
+
+
+class SingleFlight:
+    """Makes concurrent calls with the same key share one in-flight awaitable"""
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls), "calls": self.calls, "shared": self.shared}
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.create_task(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+
+        # Shielded so one waiter getting cancelled doesn't cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
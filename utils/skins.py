@@ -0,0 +1,168 @@
+from __future__ import annotations
+import asyncio
+import bisect
+import logging
+import math
+from typing import Dict, List, Optional
+import aiohttp
+from .osu_errors import UpstreamUnavailable
+from .upstream import HTTPSession
+
+__all__ = (
+    "Skin",
+    "SkinCatalog",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Skin:
+    __slots__ = (
+        "id",
+        "name",
+        "author",
+        "preview",
+        "download"
+    )
+    def __init__(self, data: dict):
+        self.id: int = data['id']
+        self.name: str = data['skin']
+        self.author: str = data.get('author')
+        self.preview: str = data.get('highResPreview')
+        self.download: str = data.get('url')
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} id: {self.id}, name: {self.name!r}>"
+
+
+class SkinCatalog:
+    """Every o!rdr skin kept in memory, indexed by id and by name for autocomplete"""
+    def __init__(
+        self,
+        *,
+        session: HTTPSession,
+        url: str = "https://apis.issou.best/ordr/skins",
+        ttl: float = 3600.0,
+        page_size: int = 400
+    ):
+        self.session = session
+        self.url = url
+        self.ttl = ttl
+        self.page_size = page_size
+        self._by_id: Dict[int, Skin] = {}
+        self._ordered: List[Skin] = []
+        # (lowercase name, position in _ordered) sorted for prefix lookups via bisect
+        self._names: List[tuple] = []
+        # Every lowercase name joined by \0 so substring search is a single str.find scan in C
+        self._blob = ""
+        self._offsets: List[int] = []
+        self._synced_at: Optional[float] = None
+        self._sync_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._ordered)
+
+    @property
+    def loaded(self) -> bool:
+        return self._synced_at is not None
+
+    @property
+    def stale(self) -> bool:
+        return self._synced_at is None or asyncio.get_running_loop().time() - self._synced_at > self.ttl
+
+    def get(self, skin_id: int) -> Optional[Skin]:
+        self._refresh_if_stale()
+        return self._by_id.get(skin_id)
+
+    def search(self, query: str, *, limit: int = 25) -> List[Skin]:
+        self._refresh_if_stale()
+        query = query.strip().lower()
+        if not query:
+            return self._ordered[:limit]
+
+        results: List[Skin] = []
+        seen = set()
+
+        def add(skin: Skin) -> bool:
+            if skin.id not in seen:
+                seen.add(skin.id)
+                results.append(skin)
+            return len(results) >= limit
+
+        if query.isdecimal() and int(query) in self._by_id:
+            if add(self._by_id[int(query)]):
+                return results
+
+        start = bisect.bisect_left(self._names, (query,))
+        for name, position in self._names[start:]:
+            if not name.startswith(query):
+                break
+            if add(self._ordered[position]):
+                return results
+
+        found = self._blob.find(query)
+        while found != -1:
+            position = bisect.bisect_right(self._offsets, found) - 1
+            if add(self._ordered[position]):
+                break
+            # Skip to the next name, one match per skin is enough
+            found = self._blob.find(query, self._offsets[position + 1] if position + 1 < len(self._offsets) else len(self._blob))
+
+        return results
+
+    async def sync(self) -> None:
+        """Refreshes the catalog, concurrent callers share the same sync"""
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.create_task(self._sync())
+        await asyncio.shield(self._sync_task)
+
+    async def wait_until_loaded(self, timeout: float) -> bool:
+        if self.loaded:
+            return True
+
+        try:
+            await asyncio.wait_for(self.sync(), timeout)
+        except (asyncio.TimeoutError, aiohttp.ClientError, UpstreamUnavailable) as e:
+            logger.warning(f"Skin catalog is not loaded yet: {e!r}")
+        return self.loaded
+
+    def _refresh_if_stale(self):
+        if self.stale and (self._sync_task is None or self._sync_task.done()):
+            self._sync_task = asyncio.create_task(self._sync())
+            self._sync_task.add_done_callback(self._log_failure)
+
+    def _log_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Skin catalog sync failed: {task.exception()!r}")
+
+    async def _fetch_page(self, page: int) -> dict:
+        async with self.session.get(self.url, params={"pageSize": self.page_size, "page": page}) as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+    async def _sync(self):
+        first = await self._fetch_page(1)
+        pages = math.ceil(first.get('maxSkins', 0) / self.page_size)
+        rest = await asyncio.gather(*(self._fetch_page(page) for page in range(2, pages + 1)))
+
+        skins: Dict[int, Skin] = {}
+        for payload in (first, *rest):
+            for data in payload['skins']:
+                skins[data['id']] = Skin(data)
+
+        ordered = sorted(skins.values(), key=lambda skin: skin.id)
+        lowered = [skin.name.lower() for skin in ordered]
+        offsets = []
+        position = 0
+        for name in lowered:
+            offsets.append(position)
+            position += len(name) + 1
+
+        # Swap everything at once so readers never see half built indexes
+        self._by_id = skins
+        self._ordered = ordered
+        self._names = sorted((name, index) for index, name in enumerate(lowered))
+        self._blob = "\0".join(lowered)
+        self._offsets = offsets
+        self._synced_at = asyncio.get_running_loop().time()
+        logger.info(f"Synced {len(ordered)} o!rdr skins over {max(pages, 1)} pages")
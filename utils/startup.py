@@ -0,0 +1,64 @@
+from __future__ import annotations
+import contextlib
+import logging
+import time
+from typing import Awaitable, Dict, Iterator, Optional, TypeVar
+from .metrics import STARTUP_PHASES
+
+__all__ = (
+    "StartupTimer",
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class StartupTimer:
+    """Times each phase between the process starting and the bot taking its first command
+
+    Phases can overlap (warm-ups run concurrently), so they don't add up to the total.
+    """
+    def __init__(self, started: Optional[float] = None):
+        # perf_counter() from as early in the process as possible, so imports are counted
+        self.started = time.perf_counter() if started is None else started
+        self.phases: Dict[str, float] = {}
+        self.total: Optional[float] = None
+        self._open: Dict[str, float] = {}
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = seconds
+        STARTUP_PHASES.set(seconds, name)
+
+    def since(self, name: str, start: float):
+        self.record(name, time.perf_counter() - start)
+
+    def begin(self, name: str):
+        self._open[name] = time.perf_counter()
+
+    def end(self, name: str):
+        start = self._open.pop(name, None)
+        if start is not None:
+            self.since(name, start)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.since(name, start)
+
+    async def timed(self, name: str, awaitable: Awaitable[T]) -> T:
+        with self.phase(name):
+            return await awaitable
+
+    def finish(self):
+        """Called once the bot is ready, only the first call counts"""
+        if self.total is None:
+            self.since("total", self.started)
+            self.total = self.phases["total"]
+
+    def report(self) -> str:
+        width = max(map(len, self.phases), default=0)
+        return "\n".join(f"{name:<{width}} {seconds * 1000:>9.1f}ms" for name, seconds in self.phases.items())
@@ -1,7 +1,7 @@
 from typing import Optional
 import discord
 from discord.ext import commands
-from typing import Any, Union
+from typing import Any, List, Union
 from aiohttp import ClientSession
 from asyncpg import Pool, Connection
 from typing import TYPE_CHECKING
@@ -19,6 +19,9 @@ class Context(commands.Context):
         super().__init__(**kwargs)
         self.pool = self.bot.pool
         self._db: Optional[Union[Pool, Connection]]
+        # Set by Aswo.invoke for analytics
+        self.started: Optional[float] = None
+        self.upstreams: Optional[List[str]] = None
 
     def __repr__(self) -> str:
         return '<Context>'
@@ -0,0 +1,299 @@
+from __future__ import annotations
+import asyncio
+import datetime
+import heapq
+import logging
+import random
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncpg
+from .osu_errors import OsuBaseException
+from .ratelimit import Priority, RateLimiter, priority
+
+if TYPE_CHECKING:
+    from .beatmap_store import BeatmapStore
+    from .old_osu import Osu, Score
+
+__all__ = (
+    "ScoreTracker",
+    "TrackedPlayer",
+)
+
+logger = logging.getLogger(__name__)
+
+# score, whether it made the player's top 100, subscriptions that want it
+ScoreHandler = Callable[["Score", bool, List[asyncpg.Record]], Awaitable[Any]]
+
+
+def _utc(value: Any) -> datetime.datetime:
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    return value.replace(tzinfo=None)
+
+
+class TrackedPlayer:
+    __slots__ = ("osu_id", "since", "interval", "due", "last_score_at", "polls", "found")
+
+    def __init__(self, osu_id: int, since: datetime.datetime, interval: float):
+        self.osu_id = osu_id
+        # Only scores set after the first subscription get posted, so new subscriptions don't dump old plays
+        self.since = since
+        self.interval = interval
+        self.due = 0.0
+        self.last_score_at: Optional[datetime.datetime] = None
+        self.polls = 0
+        self.found = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} osu_id: {self.osu_id}, interval: {self.interval:.0f}s>"
+
+
+class ScoreTracker:
+    """Polls tracked players for new plays, most overdue first, within a fixed request budget
+
+    Players that just set a score are polled every ``min_interval`` seconds, every quiet poll
+    backs their interval off towards ``max_interval``. New score ids are deduplicated in
+    Postgres, so a score is only ever posted once no matter how many processes see it.
+    """
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        osu: Osu,
+        *,
+        budget: Optional[float] = None,
+        min_interval: float = 60.0,
+        max_interval: float = 3600.0,
+        backoff: float = 1.5,
+        jitter: float = 0.15,
+        workers: int = 4,
+        partition: Tuple[int, int] = (0, 1),
+        store: Optional[BeatmapStore] = None
+    ):
+        self.pool = pool
+        self.osu = osu
+        self.store = store
+        # Requests per minute the tracker may spend. Anything over what the client's limiter lets low
+        # priority calls have would just queue there, so that's the default and the ceiling
+        limiter = osu.limiter
+        low_share = limiter.rate * 60 * (1 - limiter.reserve / limiter.burst)
+        if budget is None:
+            budget = low_share
+        elif budget > low_share:
+            logger.warning(f"Tracker budget of {budget}/min is more than the osu! limiter allows background calls, using {low_share:.1f}/min")
+            budget = low_share
+        self.budget = RateLimiter(rate=max(budget, 1), per=60, reserve=0)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.workers = workers
+        self.partition = partition
+        self.players: Dict[int, TrackedPlayer] = {}
+        self.posted = 0
+        self._heap: List[Tuple[float, int]] = []
+        self._wakeup = asyncio.Event()
+        self._handler: Optional[ScoreHandler] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        now = asyncio.get_running_loop().time()
+        players = self.players.values()
+        return {
+            "players": len(self.players),
+            "overdue": sum(1 for player in players if player.due <= now),
+            "hot": sum(1 for player in players if player.interval <= self.min_interval),
+            "polls": sum(player.polls for player in players),
+            "posted": self.posted,
+            "budget": self.budget.stats,
+        }
+
+    async def start(self, handler: ScoreHandler):
+        if self._tasks:
+            return
+
+        self._handler = handler
+        index, count = self.partition
+        query = """
+            SELECT osu_id, min(created_at) AS since FROM score_subscriptions
+            WHERE osu_id % $2 = $1
+            GROUP BY osu_id
+        """
+        for row in await self.pool.fetch(query, index, count):
+            self.track(row['osu_id'], row['since'])
+
+        self._tasks = [asyncio.create_task(self._worker(number)) for number in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._prune()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def owns(self, osu_id: int) -> bool:
+        index, count = self.partition
+        return osu_id % count == index
+
+    def track(self, osu_id: int, since: Any):
+        if not self.owns(osu_id) or osu_id in self.players:
+            return
+
+        player = TrackedPlayer(osu_id, _utc(since), self.min_interval)
+        # Spread the first polls out so a restart doesn't poll everyone at once
+        self._schedule(player, random.uniform(0, self.min_interval))
+
+    def untrack(self, osu_id: int):
+        # The heap entry is dropped lazily once it comes up
+        self.players.pop(osu_id, None)
+
+    async def subscribe(self, *, channel_id: int, guild_id: Optional[int], osu_id: int, osu_username: str, kind: str) -> bool:
+        query = """
+            INSERT INTO score_subscriptions (channel_id, guild_id, osu_id, osu_username, kind) VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (channel_id, osu_id) DO UPDATE SET kind = excluded.kind
+            RETURNING (xmax = 0) AS inserted
+        """
+        inserted = await self.pool.fetchval(query, channel_id, guild_id, osu_id, osu_username, kind)
+        self.track(osu_id, datetime.datetime.utcnow())
+        return inserted
+
+    async def unsubscribe(self, channel_id: int, osu_id: int) -> bool:
+        status = await self.pool.execute("DELETE FROM score_subscriptions WHERE channel_id = $1 AND osu_id = $2", channel_id, osu_id)
+        await self._untrack_if_unused(osu_id)
+        return status != "DELETE 0"
+
+    async def subscriptions_for(self, channel_id: int) -> List[asyncpg.Record]:
+        return await self.pool.fetch("SELECT * FROM score_subscriptions WHERE channel_id = $1 ORDER BY osu_username", channel_id)
+
+    def on_change(self, op: str, row: Dict[str, Any]):
+        """Keeps the schedule in line with subscriptions added or removed by other processes, see utils/notify.py"""
+        if op == "DELETE":
+            asyncio.create_task(self._untrack_if_unused(row['osu_id']))
+        else:
+            self.track(row['osu_id'], row['created_at'])
+
+    async def _untrack_if_unused(self, osu_id: int):
+        if not await self.pool.fetchval("SELECT EXISTS(SELECT 1 FROM score_subscriptions WHERE osu_id = $1)", osu_id):
+            self.untrack(osu_id)
+
+    async def _prune(self):
+        # osu! only returns the last 24 hours of recent plays, older ids can never come back
+        while True:
+            try:
+                await self.pool.execute("DELETE FROM seen_scores WHERE seen_at < (now() at time zone 'utc') - interval '2 days'")
+            except (asyncpg.PostgresError, OSError) as e:
+                logger.warning(f"Could not prune seen scores: {e!r}")
+            await asyncio.sleep(3600)
+
+    def _schedule(self, player: TrackedPlayer, delay: float):
+        player.due = asyncio.get_running_loop().time() + delay
+        self.players[player.osu_id] = player
+        heapq.heappush(self._heap, (player.due, player.osu_id))
+        self._wakeup.set()
+
+    def _next_interval(self, player: TrackedPlayer, found: bool) -> float:
+        if found:
+            player.interval = self.min_interval
+        else:
+            player.interval = min(player.interval * self.backoff, self.max_interval)
+
+        return player.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _next_due(self) -> TrackedPlayer:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            due, osu_id = self._heap[0]
+            player = self.players.get(osu_id)
+            if player is None or player.due != due:
+                # Untracked or rescheduled since this entry was pushed
+                heapq.heappop(self._heap)
+                continue
+
+            delay = due - loop.time()
+            if delay <= 0:
+                heapq.heappop(self._heap)
+                return player
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self, number: int):
+        while True:
+            player = await self._next_due()
+            # Mark as in flight so no other worker picks it up before we reschedule
+            player.due = float("inf")
+            found = False
+            try:
+                with priority(Priority.LOW):
+                    found = await self.poll(player)
+            except (OsuBaseException, asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+                logger.warning(f"Score tracker worker {number} failed polling {player.osu_id}: {e!r}")
+            except Exception as e:
+                # Anything else still has to reschedule the player, or it stays due at inf forever
+                logger.exception(f"Score tracker worker {number} crashed polling {player.osu_id}", exc_info=e)
+
+            if self.players.get(player.osu_id) is player:
+                self._schedule(player, self._next_interval(player, found))
+
+    async def poll(self, player: TrackedPlayer) -> bool:
+        await self.budget.acquire()
+        player.polls += 1
+        recent = await self.osu.fetch_user_score(player.osu_id, type="recent", limit=10)
+        fresh = [
+            score for score in recent
+            if score.created_at is not None and _utc(score.created_at) > player.since
+        ]
+        if not fresh:
+            return False
+
+        player.last_score_at = max(_utc(score.created_at) for score in fresh)
+        new_ids = await self.pool.fetch(
+            """
+            INSERT INTO seen_scores (score_id, osu_id)
+            SELECT id, $2 FROM unnest($1::bigint[]) AS id
+            ON CONFLICT DO NOTHING
+            RETURNING score_id
+            """,
+            [score.id for score in fresh], player.osu_id
+        )
+        new = {row['score_id'] for row in new_ids}
+        scores = [score for score in fresh if score.id in new]
+        if not scores:
+            return False
+
+        player.found += len(scores)
+        subscriptions = await self.pool.fetch("SELECT * FROM score_subscriptions WHERE osu_id = $1", player.osu_id)
+        if not subscriptions:
+            return True
+
+        if self.store is not None:
+            # Handlers read the beatmap files, get all of them in one go instead of one per score
+            await self.store.prefetch((score.beatmap.id, score.beatmap.checksum) for score in scores if score.mode == "osu")
+
+        # Only spend a second request on top plays when a new pass exists and somebody wants them
+        top_ids = set()
+        if any(row['kind'] == "best" for row in subscriptions):
+            await self.budget.acquire()
+            best = await self.osu.fetch_user_score(player.osu_id, type="best", limit=100)
+            top_ids = {score.id for score in best}
+
+        for score in sorted(scores, key=lambda score: score.created_at):
+            top = score.id in top_ids
+            targets = [row for row in subscriptions if row['kind'] == "recent" or top]
+            if not targets:
+                continue
+
+            try:
+                await self._handler(score, top, targets)
+                self.posted += 1
+            except Exception:
+                logger.exception(f"Score handler failed for score {score.id}")
+
+        return True
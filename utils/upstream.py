@@ -0,0 +1,275 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+import logging
+import math
+import random
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Union
+import aiohttp
+from .analytics import note_upstream_call
+from .governor import AdaptiveLimiter
+from .metrics import UPSTREAM_SHED
+from .osu_errors import UpstreamOverloaded, UpstreamUnavailable
+from .ratelimit import Priority, _current_priority
+
+__all__ = (
+    "CircuitBreaker",
+    "Upstream",
+    "Upstreams",
+    "HTTPSession",
+    "UPSTREAM_DEFAULTS",
+)
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+# Per upstream settings, anything here can be overridden with config.UPSTREAMS = {"ordr": {"timeout": 20}}
+# concurrency is where the adaptive limit starts, queue_timeout how long a command waits for a slot
+UPSTREAM_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    # Commands answer straight from these calls, so the budget has to fit in an interaction's 3 seconds
+    "osu": {"label": "osu!", "limit": 32, "limit_per_host": 16, "timeout": 2.5, "budget": 2.9, "concurrency": 16, "max_concurrency": 32, "queue_timeout": 5.0},
+    # Renders are submitted by the render workers and skins are listed in the background
+    "ordr": {"label": "o!rdr", "limit": 8, "limit_per_host": 8, "timeout": 10.0, "budget": 20.0, "concurrency": 4, "max_concurrency": 8, "queue_timeout": 30.0},
+    # .osu files and replay attachments, big bodies so a long read timeout
+    "cdn": {"label": "The file host", "limit": 16, "limit_per_host": 8, "timeout": 30.0, "budget": 45.0, "concurrency": 8, "max_concurrency": 16, "queue_timeout": 10.0},
+}
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` failures in a row, lets one probe through every ``reset_after`` seconds until it succeeds"""
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+    def __init__(self, name: str, *, threshold: int = 5, reset_after: float = 30.0):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opens = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> int:
+        if self._opened_at is None:
+            return self.CLOSED
+        return self.OPEN if self.retry_in > 0 or self._probing else self.HALF_OPEN
+
+    @property
+    def retry_in(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(self._opened_at + self.reset_after - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if self.retry_in > 0 or self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.threshold:
+            if self._opened_at is None:
+                self.opens += 1
+                logger.warning(f"{self.name} circuit opened after {self.failures} failures in a row")
+            # A failed probe keeps it open for another reset_after
+            self._opened_at = time.monotonic()
+
+    def abandon(self):
+        """The request got cancelled before we learned anything, let the next one probe"""
+        self._probing = False
+
+
+class Upstream:
+    """One external service with its own connection pool, timeouts, retries and circuit breaker
+
+    ``request``, ``get`` and ``post`` work like the ``aiohttp.ClientSession`` ones (``async with``),
+    so anything written against a session can be handed an upstream instead. Only connecting and
+    getting the response headers is retried, bodies are left to the caller.
+
+    Requests hold a slot of an ``AdaptiveLimiter`` from sending until the response is released, when
+    none frees up within ``queue_timeout`` (``background_wait`` for low priority work) they're shed
+    with ``UpstreamOverloaded`` instead of piling onto an upstream that's already slow.
+    """
+    def __init__(
+        self,
+        name: str,
+        *,
+        label: Optional[str] = None,
+        limit: int = 32,
+        limit_per_host: int = 16,
+        keepalive: float = 30.0,
+        dns_ttl: int = 300,
+        timeout: float = 10.0,
+        connect_timeout: float = 2.0,
+        budget: Optional[float] = None,
+        retries: int = 2,
+        backoff: float = 0.2,
+        max_backoff: float = 2.0,
+        threshold: int = 5,
+        reset_after: float = 30.0,
+        concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_concurrency: Optional[int] = None,
+        queue_timeout: float = 5.0,
+        background_wait: float = 60.0,
+        trace_configs: Iterable[aiohttp.TraceConfig] = ()
+    ):
+        self.name = name
+        self.label = label or name
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        # Total time for every attempt and the waits between them
+        self.budget = budget or timeout * (retries + 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(name, threshold=threshold, reset_after=reset_after)
+        self.limiter = AdaptiveLimiter(initial=concurrency, min_limit=min_concurrency, max_limit=max_concurrency or limit)
+        self.queue_timeout = queue_timeout
+        self.background_wait = background_wait
+        self.connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host, keepalive_timeout=keepalive, ttl_dns_cache=dns_ttl)
+        self.session = aiohttp.ClientSession(
+            connector=self.connector,
+            timeout=aiohttp.ClientTimeout(total=timeout, connect=connect_timeout),
+            trace_configs=list(trace_configs)
+        )
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+        self.shed = 0
+
+    @property
+    def stats(self) -> Dict[str, Union[int, float]]:
+        return {
+            "requests": self.requests,
+            "retries": self.retried,
+            "failures": self.failed,
+            "rejected": self.rejected,
+            "shed": self.shed,
+            "circuit_state": self.breaker.state,
+            "circuit_opens": self.breaker.opens,
+            **{f"limiter_{key}": value for key, value in self.limiter.stats.items()},
+        }
+
+    @contextlib.asynccontextmanager
+    async def request(self, method: str, url: str, *, idempotent: Optional[bool] = None, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        wait = self.queue_timeout if _current_priority.get() is Priority.HIGH else self.background_wait
+        if not await self.limiter.acquire(wait):
+            self.shed += 1
+            UPSTREAM_SHED.inc(self.name)
+            raise UpstreamOverloaded(f"{self.label} is really busy right now, try again in a bit!", self.name)
+
+        try:
+            resp = await self._send(method.upper(), url, idempotent, kwargs)
+            try:
+                yield resp
+            finally:
+                resp.release()
+        finally:
+            self.limiter.release()
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def _unavailable(self) -> UpstreamUnavailable:
+        seconds = math.ceil(self.breaker.retry_in)
+        wait = f"in {seconds} second{'s' if seconds != 1 else ''}" if seconds > 0 else "in a bit"
+        return UpstreamUnavailable(f"{self.label} isn't responding right now, try again {wait}!", self.name)
+
+    async def _send(self, method: str, url: str, idempotent: Optional[bool], kwargs: Dict[str, Any]) -> aiohttp.ClientResponse:
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise self._unavailable()
+
+        retries = self.retries if (method in IDEMPOTENT_METHODS if idempotent is None else idempotent) else 0
+        deadline = time.monotonic() + self.budget
+        attempt = 0
+        try:
+            while True:
+                self.requests += 1
+                note_upstream_call(self.name)
+                remaining = deadline - time.monotonic()
+                timeout = aiohttp.ClientTimeout(total=min(self.timeout, remaining), connect=min(self.connect_timeout, remaining))
+                error: Optional[BaseException] = None
+                started = time.perf_counter()
+                try:
+                    resp = await self.session.request(method, url, timeout=timeout, **kwargs)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    error = e
+                    self.limiter.sample(time.perf_counter() - started, False)
+                else:
+                    # Being told to slow down counts against the limit just like a slow response
+                    self.limiter.sample(time.perf_counter() - started, resp.status < 500 and resp.status != 429)
+                    if resp.status < 500:
+                        self.breaker.success()
+                        return resp
+
+                self.failed += 1
+                self.breaker.failure()
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                if attempt >= retries or time.monotonic() + delay >= deadline or not self.breaker.allow():
+                    if error is None:
+                        # Out of retries, the caller gets the 5xx to deal with like any other status
+                        return resp
+                    logger.info(f"{method} {url} failed after {attempt + 1} attempts: {error!r}")
+                    raise self._unavailable() from error
+
+                if error is None:
+                    resp.release()
+                attempt += 1
+                self.retried += 1
+                await asyncio.sleep(delay)
+        except BaseException:
+            # Cancelled, or a bad request that never reached the upstream, says nothing about its health
+            self.breaker.abandon()
+            raise
+
+    async def close(self):
+        await self.session.close()
+
+
+HTTPSession = Union[aiohttp.ClientSession, Upstream]
+
+
+class Upstreams:
+    """The HTTP client for each service the bot talks to, so a slow one can't use up another's connections"""
+    def __init__(self, overrides: Optional[Dict[str, Dict[str, Any]]] = None, *, trace_configs: Iterable[aiohttp.TraceConfig] = ()):
+        overrides = overrides or {}
+        trace_configs = list(trace_configs)
+        settings = {name: {**defaults, **overrides.get(name, {})} for name, defaults in UPSTREAM_DEFAULTS.items()}
+        self.osu = Upstream("osu", trace_configs=trace_configs, **settings["osu"])
+        self.ordr = Upstream("ordr", trace_configs=trace_configs, **settings["ordr"])
+        self.cdn = Upstream("cdn", trace_configs=trace_configs, **settings["cdn"])
+
+    def __iter__(self):
+        return iter((self.osu, self.ordr, self.cdn))
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        return {upstream.name: upstream.stats for upstream in self}
+
+    async def close(self):
+        await asyncio.gather(*(upstream.close() for upstream in self))
+
+    async def __aenter__(self) -> Upstreams:
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()